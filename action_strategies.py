@@ -1,7 +1,8 @@
 """Action strategies to be used in expected value."""
-from best_move import perfect_mover_cache
-from utils import get_cards_seen, get_hilo_running_count
+from best_move import BucketingError, approximation_error, perfect_mover_cache
+from utils import get_hilo_running_count, RuleSet, ShoeCounts
 import csv
+import random
 
 
 class BaseMover:
@@ -9,8 +10,8 @@ class BaseMover:
 
     @staticmethod
     def get_move(hand_value: int, hand_has_ace: bool, dealer_up_card: int, can_double: bool, can_split: bool,
-                 can_surrender: bool, can_insure: bool, hand_cards: list[int], cards_seen: list[int], deck_number: int,
-                 dealer_peeks_for_blackjack: bool, das: bool, dealer_stands_soft_17: bool) -> tuple[str, bool]:
+                 can_surrender: bool, can_insure: bool, hand_cards: list[int], cards_seen: list[int], rules: RuleSet
+                 ) -> tuple[str, bool]:
         """
         Raise `NotImplementedError`. To be overwritten in the other classes.
 
@@ -23,10 +24,7 @@ class BaseMover:
         :param can_insure: Whether we can take insurance.
         :param hand_cards: The cards in our hand (e.g. 8, 7, 3).
         :param cards_seen: The cards we have already seen from the shoe. Used when card counting.
-        :param deck_number: The number of decks in the starting shoe.
-        :param dealer_peeks_for_blackjack: Whether the dealer peeks for blackjack.
-        :param das: Whether we can double after splitting.
-        :param dealer_stands_soft_17: Whether the dealer stands on soft 17.
+        :param rules: The rules of the game, including the number of decks in the starting shoe.
         :return: The action to do, and whether to take insurance.
         """
         raise NotImplementedError("The `get_move` method hasn't been overridden.")
@@ -37,8 +35,8 @@ class SimpleMover(BaseMover):
 
     @staticmethod
     def get_move(hand_value: int, hand_has_ace: bool, dealer_up_card: int, can_double: bool, can_split: bool,
-                 can_surrender: bool, can_insure: bool, hand_cards: list[int], cards_seen: list[int], deck_number: int,
-                 dealer_peeks_for_blackjack: bool, das: bool, dealer_stands_soft_17: bool) -> tuple[str, bool]:
+                 can_surrender: bool, can_insure: bool, hand_cards: list[int], cards_seen: list[int], rules: RuleSet
+                 ) -> tuple[str, bool]:
         """
         Hit (value <= 16) or stand (value >= 17). Never take insurance.
 
@@ -51,10 +49,7 @@ class SimpleMover(BaseMover):
         :param can_insure: Whether we can take insurance.
         :param hand_cards: The cards in our hand (e.g. 8, 7, 3).
         :param cards_seen: The cards we have already seen from the shoe. Used when card counting.
-        :param deck_number: The number of decks in the starting shoe.
-        :param dealer_peeks_for_blackjack: Whether the dealer peeks for blackjack.
-        :param das: Whether we can double after splitting.
-        :param dealer_stands_soft_17: Whether the dealer stands on soft 17.
+        :param rules: The rules of the game, including the number of decks in the starting shoe.
         :return: The action to do, and whether to take insurance.
         """
         if hand_value < 17:
@@ -102,8 +97,7 @@ class BasicStrategyMover(BaseMover):
 
     def get_move(self, hand_value: int, hand_has_ace: bool, dealer_up_card: int,  # type: ignore[override]
                  can_double: bool, can_split: bool, can_surrender: bool, can_insure: bool, hand_cards: list[int],
-                 cards_seen: list[int], deck_number: int, dealer_peeks_for_blackjack: bool, das: bool,
-                 dealer_stands_soft_17: bool) -> tuple[str, bool]:
+                 cards_seen: list[int], rules: RuleSet) -> tuple[str, bool]:
         """
         Get the move to play from basic strategy.
 
@@ -116,10 +110,7 @@ class BasicStrategyMover(BaseMover):
         :param can_insure: Whether we can take insurance.
         :param hand_cards: The cards in our hand (e.g. 8, 7, 3).
         :param cards_seen: The cards we have already seen from the shoe. Used when card counting.
-        :param deck_number: The number of decks in the starting shoe.
-        :param dealer_peeks_for_blackjack: Whether the dealer peeks for blackjack.
-        :param das: Whether we can double after splitting.
-        :param dealer_stands_soft_17: Whether the dealer stands on soft 17.
+        :param rules: The rules of the game, including the number of decks in the starting shoe.
         :return: The action to do, and whether to take insurance.
         """
         insure = False
@@ -183,8 +174,7 @@ class BasicStrategyDeviationsMover(BaseMover):
 
     def get_move(self, hand_value: int, hand_has_ace: bool, dealer_up_card: int,  # type: ignore[override]
                  can_double: bool, can_split: bool, can_surrender: bool, can_insure: bool, hand_cards: list[int],
-                 cards_seen: list[int], deck_number: int, dealer_peeks_for_blackjack: bool, das: bool,
-                 dealer_stands_soft_17: bool) -> tuple[str, bool]:
+                 cards_seen: list[int], rules: RuleSet) -> tuple[str, bool]:
         """
         Get the move to play from basic strategy.
 
@@ -197,13 +187,10 @@ class BasicStrategyDeviationsMover(BaseMover):
         :param can_insure: Whether we can take insurance.
         :param hand_cards: The cards in our hand (e.g. 8, 7, 3).
         :param cards_seen: The cards we have already seen from the shoe. Used when card counting.
-        :param deck_number: The number of decks in the starting shoe.
-        :param dealer_peeks_for_blackjack: Whether the dealer peeks for blackjack.
-        :param das: Whether we can double after splitting.
-        :param dealer_stands_soft_17: Whether the dealer stands on soft 17.
+        :param rules: The rules of the game, including the number of decks in the starting shoe.
         :return: The action to do, and whether to take insurance.
         """
-        true_count = get_hilo_running_count(cards_seen) / (deck_number - (len(cards_seen) + 1) / 52)
+        true_count = get_hilo_running_count(cards_seen) / (rules.deck_number - (len(cards_seen) + 1) / 52)
         insure = False
         if can_split:
             card = hand_cards[0]
@@ -326,8 +313,7 @@ class CardCountMover(BaseMover):
 
     def get_move(self, hand_value: int, hand_has_ace: bool, dealer_up_card: int,  # type: ignore[override]
                  can_double: bool, can_split: bool, can_surrender: bool, can_insure: bool, hand_cards: list[int],
-                 cards_seen: list[int], deck_number: int, dealer_peeks_for_blackjack: bool, das: bool,
-                 dealer_stands_soft_17: bool) -> tuple[str, bool]:
+                 cards_seen: list[int], rules: RuleSet) -> tuple[str, bool]:
         """
         Get the move to play.
 
@@ -340,13 +326,10 @@ class CardCountMover(BaseMover):
         :param can_insure: Whether we can take insurance.
         :param hand_cards: The cards in our hand (e.g. 8, 7, 3).
         :param cards_seen: The cards we have already seen from the shoe. Used when card counting.
-        :param deck_number: The number of decks in the starting shoe.
-        :param dealer_peeks_for_blackjack: Whether the dealer peeks for blackjack.
-        :param das: Whether we can double after splitting.
-        :param dealer_stands_soft_17: Whether the dealer stands on soft 17.
+        :param rules: The rules of the game, including the number of decks in the starting shoe.
         :return: The action to do, and whether to take insurance.
         """
-        true_count = get_hilo_running_count(cards_seen) / (deck_number - (len(cards_seen) + 1) / 52)
+        true_count = get_hilo_running_count(cards_seen) / (rules.deck_number - (len(cards_seen) + 1) / 52)
 
         for min_tc, max_tc in self.filenames:
             if min_tc <= true_count < max_tc:
@@ -381,14 +364,30 @@ class CardCountMover(BaseMover):
 class PerfectMover(BaseMover):
     """Get the best move to play using all available information."""
 
-    @staticmethod
-    def get_move(hand_value: int, hand_has_ace: bool, dealer_up_card: int, can_double: bool, can_split: bool,
-                 can_surrender: bool, can_insure: bool, hand_cards: list[int], cards_seen: list[int], deck_number: int,
-                 dealer_peeks_for_blackjack: bool, das: bool, dealer_stands_soft_17: bool) -> tuple[str, bool]:
+    def __init__(self, bucket_size: int = 1, validation_rate: float = .01, infinite_deck: bool = False) -> None:
+        """
+        Choose whether to use exact or approximate results.
+
+        :param bucket_size: Round deep shoes to buckets of this size, so that similar shoes share results
+            (see `best_move.bucket_counts`). Much faster, but only approximate. 1 gives exact results.
+        :param validation_rate: How often to also calculate the exact results when using buckets,
+            to measure the error (see `bucketing_error`).
+        :param infinite_deck: Whether to draw every card with the probabilities of the shoe instead of removing the
+            cards that are drawn (see `best_move.infinite_deck_mover`). Fast enough for large EV calculations,
+            but approximate. `bucket_size` is ignored.
+        """
+        self.bucket_size = bucket_size
+        self.infinite_deck = infinite_deck
+        self.validation_rate = validation_rate
+        self.errors: list[tuple[float, float]] = []
+
+    def get_move(self, hand_value: int, hand_has_ace: bool, dealer_up_card: int,  # type: ignore[override]
+                 can_double: bool, can_split: bool, can_surrender: bool, can_insure: bool, hand_cards: list[int],
+                 cards_seen: list[int], rules: RuleSet) -> tuple[str, bool]:
         """
         Get the best move to play by taking into account every available information. Uses the best move analysis.
 
-        Very slow to be used in large EV calculations.
+        Very slow to be used in large EV calculations, unless the shoes are put into buckets.
 
         :param hand_value: The value of the hand (e.g. 18).
         :param hand_has_ace: Whether the hand has an ace that is counted as 11.
@@ -399,13 +398,26 @@ class PerfectMover(BaseMover):
         :param can_insure: Whether we can take insurance.
         :param hand_cards: The cards in our hand (e.g. 8, 7, 3).
         :param cards_seen: The cards we have already seen from the shoe. Used when card counting.
-        :param deck_number: The number of decks in the starting shoe.
-        :param dealer_peeks_for_blackjack: Whether the dealer peeks for blackjack.
-        :param das: Whether we can double after splitting.
-        :param dealer_stands_soft_17: Whether the dealer stands on soft 17.
+        :param rules: The rules of the game, including the number of decks in the starting shoe.
         :return: The action to do, and whether to take insurance.
         """
-        cards_not_seen = get_cards_seen(deck_number, cards_seen)
-        profits = perfect_mover_cache(tuple(hand_cards), dealer_up_card, tuple(cards_not_seen), can_double, can_insure,
-                                      can_surrender, int(can_split), dealer_peeks_for_blackjack, das, dealer_stands_soft_17)
-        return str(profits[1]), profits[2] > 0  # profit[1] is a string. str is there for mypy.
+        cards_not_seen = ShoeCounts.from_decks(rules.deck_number).remove_cards(cards_seen)
+        profits = perfect_mover_cache(tuple(hand_cards), dealer_up_card, cards_not_seen, can_double, can_insure,
+                                      can_surrender, int(can_split), rules.dealer_peeks_for_blackjack, rules.das,
+                                      rules.dealer_stands_soft_17, bucket_size=self.bucket_size,
+                                      infinite_deck=self.infinite_deck)
+        if self.bucket_size > 1 and not self.infinite_deck and random.random() < self.validation_rate:
+            self.errors.append(approximation_error(tuple(hand_cards), dealer_up_card, cards_not_seen, self.bucket_size,
+                                                   can_double, can_insure, can_surrender, int(can_split),
+                                                   rules.dealer_peeks_for_blackjack, rules.das,
+                                                   rules.dealer_stands_soft_17))
+        action_codes = {"stand": "s", "hit": "h", "double": "d", "split": "p", "surrender": "u"}
+        return action_codes[str(profits[1])], profits[2] > 0  # profit[1] is a string. str is there for mypy.
+
+    def bucketing_error(self) -> BucketingError:
+        """
+        Get the largest errors caused by the buckets in the positions that were validated.
+
+        :return: The largest errors.
+        """
+        return BucketingError.from_errors(self.errors)
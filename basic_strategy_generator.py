@@ -1,16 +1,22 @@
 """Generate basic strategy and plot it in graphs."""
-from best_move import perfect_mover_cache
-from shoe_generators import hilo_generator
-from utils import DECK
-from utils import list_range_str
-from typing import Iterable, cast
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
+from best_move import perfect_mover_batch, setup_worker_caches
+from budget_cache import cache_budget, set_cache_budget
+from shared_cache import shared_table_for
+from shoe_generators import hilo_compositions, hilo_representative_shoes
+from utils import RuleSet, ShoeCounts
+from collections import Counter
+from typing import Any, Container, Iterable, Iterator, NamedTuple, Sequence
 import itertools
 import csv
 import re
 import argparse
+import cache_stats
 import multiprocessing
+import multiprocessing.pool
+import os
+import sqlite3
+import struct
+import threading
 
 
 class Hand:
@@ -82,260 +88,442 @@ def argmax(*profits: float) -> tuple[float, str]:
     return 0, ""
 
 
-def no_ace_table_generator(cores: int = 1, card_numbers: tuple[int, ...] = (2, 3, 4), number_of_decks: int = 6,
-                           true_count: int | None = None, shoes_to_test: int | None = None,
-                           deck_penetration: float = .25, dealer_peeks_for_blackjack: bool = True, das: bool = True,
-                           dealer_stands_soft_17: bool = True, can_surrender: bool = True) -> dict[int, dict[int, str]]:
-    """
-    Generate basic strategy when we don't have an ace.
+class HandTask(NamedTuple):
+    """A hand to analyse in every shoe it is tested in, as it is sent to the worker processes."""
 
-    :param cores: How many cores to use in the generation of basic strategy.
-    :param card_numbers: Test all hand with card_numbers number of hands. (e.g. if card_numbers is (2, 3), then all hands
-        with 2 or 3 cards will be tested)
-    :param number_of_decks: The number of decks in the initial shoe.
-    :param true_count: The true count that we should generate basic strategy for.
-        Default is None which generates general basic strategy. An integer, generated deviations from basic strategy.
-    :param shoes_to_test: How many shoes to test when generating deviations.
-    :param deck_penetration: When to reshuffle the shoe. Reshuffles when cards remaining < starting cards * deck penetration.
-        So the shoe can't have fewer than starting cards * deck penetration cards.
-    :param dealer_peeks_for_blackjack: Whether the dealer peeks for blackjack.
-    :param das: Whether we can double after splitting.
-    :param dealer_stands_soft_17: Whether the dealer stands on soft 17.
-    :param can_surrender: Whether the game rules allow surrendering.
-    :return: The basic strategy table, to be saved and/or plotted.
+    cards: tuple[int, ...]
+    dealer_up_card: int
+    shoes: tuple[ShoeCounts, ...]
+    weights: tuple[float, ...]  # How many times each shoe was generated, or the probability it represents.
+    can_double: bool
+    can_insure: bool
+    can_surrender: bool
+    max_splits: int
+    table: str  # The table the hand is in ("no_ace", "ace" or "split").
+    true_count: int | None = None  # The true count of the shoes, or None for full shoes.
+
+
+class GeneratorCheckpoint:
+    """
+    A SQLite file that keeps the results of the hands that have already been analysed, so an interrupted generation can
+    be resumed. Each hand is written in its own transaction as soon as its results arrive, and the generation is marked
+    as finished when every hand has been analysed (see `finish`).
     """
-    shoe = DECK * number_of_decks
-    shoe.sort()
 
-    arguments = []
-    all_combinations = []
+    def __init__(self, path: str, settings: str, resume: bool = False, fresh: bool = False) -> None:
+        """
+        :param path: The file to store the results in. It is created if it doesn't exist.
+        :param settings: A description of the settings of the generation (the rules, the effort, etc.). The results of a
+            generation with other settings are never reused.
+        :param resume: Whether to keep the results that are already in the file.
+        :param fresh: Whether to delete the results that are already in the file. If neither `resume` nor `fresh` is set,
+            the results of a finished generation are deleted, but the file must not have the results of an unfinished one,
+            so an interrupted generation is never lost by accident.
+        """
+        if resume and fresh:
+            raise ValueError("A generation can't be both resumed and started fresh.")
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS settings "
+                                    "(settings TEXT NOT NULL, finished INTEGER NOT NULL DEFAULT 0)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS hands (kind TEXT NOT NULL, true_count TEXT NOT NULL, "
+                                    "cards BLOB NOT NULL, dealer_up_card INTEGER NOT NULL, options BLOB NOT NULL, "
+                                    "shoes BLOB NOT NULL, weights BLOB NOT NULL, profits BLOB NOT NULL, "
+                                    "PRIMARY KEY (kind, true_count, cards, dealer_up_card))")
+            row = self.connection.execute("SELECT settings, finished FROM settings").fetchone()
+            if resume and row is not None and row[0] != settings:
+                raise ValueError(f"{path} was created by a generation with other settings ({row[0]}).")
+            hands = self.connection.execute("SELECT COUNT(*) FROM hands").fetchone()[0]
+            if not resume and not fresh and hands and not (row is not None and row[1]):
+                raise ValueError(f"{path} already has the results of {hands} hands of an unfinished generation. Resume "
+                                 f"the generation, or start a fresh one to delete them.")
+            if not resume or row is None:
+                self.connection.execute("DELETE FROM settings")
+                self.connection.execute("DELETE FROM hands")
+                self.connection.execute("INSERT INTO settings (settings) VALUES (?)", (settings,))
+
+    def put(self, task: HandTask, shoe_profits: Sequence[Sequence[float]]) -> None:
+        """
+        Store the results of a hand.
+
+        :param task: The hand.
+        :param shoe_profits: The expected returns of the hand in each shoe.
+        """
+        shoes = [count for shoe in task.shoes for count in shoe]
+        profits = [profit for profits in shoe_profits for profit in profits]
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO hands VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                    (task.table, str(task.true_count), bytes(task.cards), task.dealer_up_card,
+                                     bytes((task.can_double, task.can_insure, task.can_surrender, task.max_splits)),
+                                     struct.pack(f"<{len(shoes)}H", *shoes),
+                                     struct.pack(f"<{len(task.weights)}d", *task.weights),
+                                     struct.pack(f"<{len(profits)}d", *profits)))
+
+    def results(self) -> dict[tuple[str, int | None, tuple[int, ...], int], tuple[HandTask, list[tuple[float, ...]]]]:
+        """
+        Get the results of the hands that have already been analysed.
+
+        :return: Each hand's task and its expected returns in each shoe, by the table, the true count, the player's cards
+            and the dealer's up card.
+        """
+        results = {}
+        for kind, true_count, cards, dealer_up_card, options, shoes, weights, profits in self.connection.execute(
+                "SELECT * FROM hands"):
+            counts = struct.unpack(f"<{len(shoes) // 2}H", shoes)
+            all_profits = struct.unpack(f"<{len(profits) // 8}d", profits)
+            can_double, can_insure, can_surrender, max_splits = options
+            task = HandTask(tuple(cards), dealer_up_card,
+                            tuple(ShoeCounts(*counts[index:index + 10]) for index in range(0, len(counts), 10)),
+                            struct.unpack(f"<{len(weights) // 8}d", weights), bool(can_double), bool(can_insure),
+                            bool(can_surrender), max_splits, kind, None if true_count == "None" else int(true_count))
+            results[kind, task.true_count, task.cards, dealer_up_card] = task, [
+                all_profits[index:index + 6] for index in range(0, len(all_profits), 6)]
+        return results
+
+    def finish(self) -> None:
+        """Mark the generation as finished, so the next generation that isn't resumed can delete its results."""
+        with self.connection:
+            self.connection.execute("UPDATE settings SET finished = 1")
+
+    def close(self) -> None:
+        """Close the connection to the file."""
+        self.connection.close()
+
+    def __len__(self) -> int:
+        """
+        Get how many hands are stored.
+
+        :return: The number of hands.
+        """
+        return int(self.connection.execute("SELECT COUNT(*) FROM hands").fetchone()[0])
+
+
+class TableSpec(NamedTuple):
+    """A strategy table to generate, and how its hands are analysed."""
+
+    name: str  # "no_ace", "ace" or "split".
+    hands: Counter[tuple[int, ...]]  # How many of the tested combinations are each hand.
+    max_splits: int
+    shoes_number: int | None  # How many shoes to test each hand in when generating deviations.
+    weighted_compositions: bool = False  # Whether the shoes are representative shoes (see `generate_test_shoes_for_counts`).
+
 
+TABLE_LABELS = {"no_ace": "No ace", "ace": "Ace", "split": "Split"}
+TABLE_ROWS = {"no_ace": range(4, 22), "ace": range(12, 22), "split": range(2, 12)}
+
+
+def no_ace_hands(card_numbers: tuple[int, ...]) -> Counter[tuple[int, ...]]:
+    """
+    Get the hands without an ace of the no ace table.
+
+    :param card_numbers: How many cards the hands have.
+    :return: How many of the tested combinations are each hand (sorted).
+    """
+    multiplicities: Counter[tuple[int, ...]] = Counter()
     possible_cards = [2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10]
     for card_number in card_numbers:
-        all_combinations_card_number = list(itertools.combinations_with_replacement(possible_cards, card_number))
-        all_combinations_card_number = list(map(lambda comb: tuple(sorted(comb)), all_combinations_card_number))
-        all_combinations += all_combinations_card_number
-        set_combinations = dict.fromkeys(all_combinations_card_number)
-        for cards in set_combinations:
-            hand_value = Hand(cards).value()
-            if hand_value > 21 or hand_value < 4:
-                continue
-            for dealer_up_card in range(2, 12):
+        multiplicities.update(tuple(sorted(comb))
+                              for comb in itertools.combinations_with_replacement(possible_cards, card_number))
+    return Counter({cards: number for cards, number in multiplicities.items() if 4 <= Hand(cards).value() <= 21})
 
-                if true_count is None:
-                    default_shoe = shoe.copy()
-                    for card in cards + (dealer_up_card,):
-                        default_shoe.remove(card)
-                    decks = [default_shoe]
-                else:
-                    decks = []
-                    for _ in range(shoes_to_test if shoes_to_test else 1):
-                        decks.append(hilo_generator(true_count, number_of_decks, deck_penetration,
-                                                    list(cards) + [dealer_up_card]))
-
-                for example_shoe in decks:
-                    shoe_copy = example_shoe.copy()
-                    arguments.append((cards, dealer_up_card, tuple(shoe_copy), card_number <= 2,
-                                      card_number == 2, can_surrender and card_number == 2, 0,
-                                      dealer_peeks_for_blackjack, das, dealer_stands_soft_17, True))
-
-    data_table = {player_total: {dealer_up_card: {
-        key: [0., 0., 0., 0., 0., 0., 0.] for key in ["all", "double", "surrender", "insurance"]}
-        for dealer_up_card in range(2, 12)} for player_total in range(4, 22)}
-    with multiprocessing.Pool(processes=cores) as pool:
-        for argument, profits_not_cast in zip(arguments, pool.starmap(perfect_mover_cache, arguments)):
-            profits = cast(tuple[float, ...], profits_not_cast)
-            cards = argument[0]
-            dealer_up_card = argument[1]
-            hand = Hand(cards)
-            hand_value, hand_aces = hand.value_aces()
-            card_number = len(cards)
-            print(f"Player cards: {cards}, Dealer up card: {dealer_up_card}, No ace profits: {profits}")
-
-            data_table[hand_value][dealer_up_card]["all"][6] += 1 * all_combinations.count(cards)
-            data_table[hand_value][dealer_up_card]["all"][0] += profits[0] * all_combinations.count(cards)
-            data_table[hand_value][dealer_up_card]["all"][1] += profits[1] * all_combinations.count(cards)
-            data_table[hand_value][dealer_up_card]["all"][2] -= 1000 * all_combinations.count(cards)
-            data_table[hand_value][dealer_up_card]["all"][3] -= 1000 * all_combinations.count(cards)
-            data_table[hand_value][dealer_up_card]["all"][4] -= 1000 * all_combinations.count(cards)
-            data_table[hand_value][dealer_up_card]["all"][5] -= 1000 * all_combinations.count(cards)
-            if card_number == 2:
-                data_table[hand_value][dealer_up_card]["double"][6] += 1 * all_combinations.count(cards)
-                data_table[hand_value][dealer_up_card]["double"][0] += profits[0] * all_combinations.count(cards)
-                data_table[hand_value][dealer_up_card]["double"][1] += profits[1] * all_combinations.count(cards)
-                data_table[hand_value][dealer_up_card]["double"][2] += profits[2] * all_combinations.count(cards)
-                data_table[hand_value][dealer_up_card]["double"][3] -= 1000 * all_combinations.count(cards)
-                data_table[hand_value][dealer_up_card]["double"][4] -= 1000 * all_combinations.count(cards)
-                data_table[hand_value][dealer_up_card]["double"][5] -= 1000 * all_combinations.count(cards)
-
-                data_table[hand_value][dealer_up_card]["surrender"][6] += 1 * all_combinations.count(cards)
-                data_table[hand_value][dealer_up_card]["surrender"][0] += profits[0] * all_combinations.count(cards)
-                data_table[hand_value][dealer_up_card]["surrender"][1] += profits[1] * all_combinations.count(cards)
-                data_table[hand_value][dealer_up_card]["surrender"][2] += profits[2] * all_combinations.count(cards)
-                data_table[hand_value][dealer_up_card]["surrender"][3] += profits[3] * all_combinations.count(cards)
-                data_table[hand_value][dealer_up_card]["surrender"][4] += profits[4] * all_combinations.count(cards)
-                data_table[hand_value][dealer_up_card]["surrender"][5] -= 1000 * all_combinations.count(cards)
-            if dealer_up_card == 11 and card_number == 2:
-                data_table[hand_value][dealer_up_card]["insurance"][6] += 1 * all_combinations.count(cards)
-                data_table[hand_value][dealer_up_card]["insurance"][0] += profits[0] * all_combinations.count(cards)
-                data_table[hand_value][dealer_up_card]["insurance"][1] += profits[1] * all_combinations.count(cards)
-                data_table[hand_value][dealer_up_card]["insurance"][2] += profits[2] * all_combinations.count(cards)
-                data_table[hand_value][dealer_up_card]["insurance"][3] += profits[3] * all_combinations.count(cards)
-                data_table[hand_value][dealer_up_card]["insurance"][4] += profits[4] * all_combinations.count(cards)
-                data_table[hand_value][dealer_up_card]["insurance"][5] += profits[5] * all_combinations.count(cards)
-
-    print(f"No ace data table:\n{data_table}")
-
-    clean_table = {player_total: {dealer_up_card: "" for dealer_up_card in range(2, 12)} for player_total in range(4, 22)}
-    for player_total in range(4, 22):
-        for dealer_up_card in range(2, 12):
 
-            print(f"Player total: {player_total}, Dealer up card: {dealer_up_card}, "
-                  f"No ace data row: {data_table[player_total][dealer_up_card]}")
+def ace_hands(card_numbers: tuple[int, ...]) -> Counter[tuple[int, ...]]:
+    """
+    Get the hands with an ace that counts as 11 of the ace table.
 
-            clean_text = ""
+    :param card_numbers: How many cards the hands have.
+    :return: How many of the tested combinations are each hand (sorted).
+    """
+    multiplicities: Counter[tuple[int, ...]] = Counter()
+    possible_cards = [2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10, 11]
+    for card_number in card_numbers:
+        multiplicities.update(tuple(sorted(comb + (11,)))
+                              for comb in itertools.combinations_with_replacement(possible_cards, card_number - 1))
+    return Counter({cards: number for cards, number in multiplicities.items()
+                    if 12 <= Hand(cards).value_aces()[0] <= 21 and Hand(cards).value_aces()[1]})
 
-            if data_table[player_total][dealer_up_card]["insurance"][6]:
-                profit_line = [profit / data_table[player_total][dealer_up_card]["insurance"][6] for profit in
-                               data_table[player_total][dealer_up_card]["insurance"][:6]]
 
-                if profit_line[5] > 0:
-                    clean_text += f"i ({round(profit_line[5], 2)}) "
+def split_hands() -> Counter[tuple[int, ...]]:
+    """
+    Get the pairs of the split table.
 
-            if data_table[player_total][dealer_up_card]["surrender"][6]:
-                profit_line = [profit / data_table[player_total][dealer_up_card]["surrender"][6] for profit in
-                               data_table[player_total][dealer_up_card]["surrender"][:6]]
-                max_profit, max_action = argmax(*profit_line[:5])
-                if max_action == "u":
-                    clean_text += f"u ({round(max_profit, 2)}) "
+    :return: Each pair, once.
+    """
+    return Counter((split_card, split_card) for split_card in range(2, 12))
 
-            if data_table[player_total][dealer_up_card]["double"][6]:
-                profit_line = [profit / data_table[player_total][dealer_up_card]["double"][6] for profit in
-                               data_table[player_total][dealer_up_card]["double"][:6]]
-                max_profit, max_action = argmax(*profit_line[:4])
-                if max_action == "d":
-                    clean_text += f"d ({round(max_profit, 2)}) "
 
-            profit_line = [profit / max(data_table[player_total][dealer_up_card]["all"][6], 1) for profit in
-                           data_table[player_total][dealer_up_card]["all"][:6]]
-            max_profit, max_action = argmax(*profit_line[:2])
-            clean_text += f"{max_action} ({round(max_profit, 2)}) "
+def add_weighted_profits(row: list[float], profits: Sequence[float], weight: float, actions: int) -> None:
+    """
+    Add the expected returns of a hand to a row of a data table.
 
-            clean_table[player_total][dealer_up_card] = clean_text.strip()
-    return clean_table
+    :param row: The weighted sums of the expected returns of the 6 actions, followed by the sum of the weights.
+    :param profits: The expected returns of all 6 possible actions.
+    :param weight: How many of the tested hand combinations are this hand (times the weight of the shoe).
+    :param actions: How many of the actions (in order) can be chosen. The others are added as -1000.
+    """
+    row[6] += weight
+    for action in range(6):
+        row[action] += (profits[action] if action < actions else -1000) * weight
 
 
-def ace_table_generator(cores: int = 1, card_numbers: tuple[int, ...] = (2, 3, 4), number_of_decks: int = 6,
-                        true_count: int | None = None, shoes_to_test: int | None = None,
-                        deck_penetration: float = .25, dealer_peeks_for_blackjack: bool = True, das: bool = True,
-                        dealer_stands_soft_17: bool = True, can_surrender: bool = True) -> dict[int, dict[int, str]]:
+def generate_test_shoes_for_counts(cards: tuple[int, ...], dealer_up_card: int, number_of_decks: int,
+                                   true_counts: Sequence[int | None], shoes_number: int | None, deck_penetration: float,
+                                   weighted_compositions: bool = False
+                                   ) -> dict[int | None, tuple[tuple[ShoeCounts, ...], tuple[float, ...]]]:
     """
-    Generate basic strategy when we have an ace.
+    Get the shoes to test a hand in for many true counts. The shoes of all the true counts are sampled in one batch
+    (see `shoe_generators.hilo_compositions`), or they are a few representative shoes, weighted by their exact
+    probabilities, which are the same in every run (see `shoe_generators.hilo_representative_shoes`).
 
-    :param cores: How many cores to use in the generation of basic strategy.
-    :param card_numbers: Test all hand with card_numbers number of hands. (e.g. if card_numbers is (2, 3), then all hands
-        with 2 or 3 cards will be tested)
+    :param cards: The player's cards.
+    :param dealer_up_card: The dealer's up card.
     :param number_of_decks: The number of decks in the initial shoe.
-    :param true_count: The true count that we should generate basic strategy for.
-        Default is None which generates general basic strategy. An integer, generated deviations from basic strategy.
-    :param shoes_to_test: How many shoes to test when generating deviations.
-    :param deck_penetration: When to reshuffle the shoe. Reshuffles when cards remaining < starting cards * deck penetration.
-        So the shoe can't have fewer than starting cards * deck penetration cards.
-    :param dealer_peeks_for_blackjack: Whether the dealer peeks for blackjack.
-    :param das: Whether we can double after splitting.
-    :param dealer_stands_soft_17: Whether the dealer stands on soft 17.
-    :param can_surrender: Whether the game rules allow surrendering.
-    :return: The basic strategy table, to be saved and/or plotted.
+    :param true_counts: The true counts of the shoes. None is a full shoe.
+    :param shoes_number: How many shoes to generate with each true count, or how many representative shoes to use.
+    :param deck_penetration: When the shoe is reshuffled (see `shoe_generators.hilo_generator`).
+    :param weighted_compositions: Whether to use representative shoes instead of random shoes.
+    :return: The different shoes of each true count, and how many times each was generated (or the probability each
+        represents).
+    """
+    test_shoes: dict[int | None, tuple[tuple[ShoeCounts, ...], tuple[float, ...]]] = {}
+    if None in true_counts:
+        test_shoes[None] = (ShoeCounts.from_decks(number_of_decks).remove_cards(cards + (dealer_up_card,)),), (1,)
+    counted = [true_count for true_count in true_counts if true_count is not None]
+    if counted and weighted_compositions:
+        for true_count, (compositions, probabilities) in hilo_representative_shoes(
+                counted, number_of_decks, deck_penetration, cards + (dealer_up_card,),
+                shoes_number if shoes_number else 1).items():
+            test_shoes[true_count] = (tuple(ShoeCounts(*composition) for composition in compositions.tolist()),
+                                      tuple(probabilities.tolist()))
+    elif counted:
+        for true_count, compositions in hilo_compositions(counted, number_of_decks, deck_penetration,
+                                                          cards + (dealer_up_card,),
+                                                          shoes_number if shoes_number else 1).items():
+            shoes = Counter(ShoeCounts(*composition) for composition in compositions.tolist())
+            test_shoes[true_count] = tuple(shoes), tuple(shoes.values())
+    return test_shoes
+
+
+def generate_test_shoes(cards: tuple[int, ...], dealer_up_card: int, number_of_decks: int, true_count: int | None,
+                        shoes_number: int | None, deck_penetration: float
+                        ) -> tuple[tuple[ShoeCounts, ...], tuple[float, ...]]:
     """
-    shoe = DECK * number_of_decks
-    shoe.sort()
+    Get the shoes to test a hand in. Shoes that are generated more than once are only tested once, with a higher weight.
 
-    arguments = []
-    all_combinations = []
-    possible_cards = [2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10, 11]
-    for card_number in card_numbers:
-        all_combinations_card_number = list(itertools.combinations_with_replacement(possible_cards, card_number - 1))
-        all_combinations_card_number = list(map(lambda comb: comb + (11,), all_combinations_card_number))
-        all_combinations_card_number = list(map(lambda comb: tuple(sorted(comb)), all_combinations_card_number))
-        all_combinations += all_combinations_card_number
-        set_combinations = dict.fromkeys(all_combinations_card_number)
-        for cards in set_combinations:
-            hand = Hand(cards)
-            hand_value, hand_aces = hand.value_aces()
-            if hand_value > 21 or hand_value < 12 or hand_aces == 0:
-                continue
+    :param cards: The player's cards.
+    :param dealer_up_card: The dealer's up card.
+    :param number_of_decks: The number of decks in the initial shoe.
+    :param true_count: The true count of the shoes, or None for a full shoe.
+    :param shoes_number: How many shoes to generate with the true count.
+    :param deck_penetration: When the shoe is reshuffled (see `shoe_generators.hilo_generator`).
+    :return: The different shoes, and how many times each was generated.
+    """
+    return generate_test_shoes_for_counts(cards, dealer_up_card, number_of_decks, (true_count,), shoes_number,
+                                          deck_penetration)[true_count]
+
+
+def hand_tasks(specs: Sequence[TableSpec], true_counts: Sequence[int | None], number_of_decks: int,
+               deck_penetration: float, done: Container[tuple[str, int | None, tuple[int, ...], int]]
+               ) -> Iterator[HandTask]:
+    """
+    Create the tasks of the hands of some tables, for every true count.
+
+    :param specs: The tables.
+    :param true_counts: The true counts to generate the tables for. None is basic strategy.
+    :param number_of_decks: The number of decks in the initial shoe.
+    :param deck_penetration: When the shoe is reshuffled (see `shoe_generators.hilo_generator`).
+    :param done: The hands that have already been analysed (see `GeneratorCheckpoint.results`). They are skipped.
+    :return: The tasks, generated lazily.
+    """
+    for spec in specs:
+        for cards in spec.hands:
             for dealer_up_card in range(2, 12):
+                missing = [true_count for true_count in true_counts
+                           if (spec.name, true_count, cards, dealer_up_card) not in done]
+                if not missing:
+                    continue
+                test_shoes = generate_test_shoes_for_counts(cards, dealer_up_card, number_of_decks, missing,
+                                                            spec.shoes_number, deck_penetration,
+                                                            spec.weighted_compositions)
+                for true_count in missing:
+                    yield HandTask(cards, dealer_up_card, *test_shoes[true_count], len(cards) <= 2, len(cards) == 2,
+                                   len(cards) == 2, spec.max_splits, spec.name, true_count)
+
+
+WINDOW_PER_CORE = 16  # How many tasks each worker process can have waiting (see `analyse_hands`).
+SEND_TIMEOUT = .1  # How often the tasks of `analyse_hands` check whether their results are still read, in seconds.
+
+worker_rules = RuleSet()
+worker_infinite_deck = False
 
-                if true_count is None:
-                    default_shoe = shoe.copy()
-                    for card in cards + (dealer_up_card,):
-                        default_shoe.remove(card)
-                    decks = [default_shoe]
-                else:
-                    decks = []
-                    for _ in range(shoes_to_test if shoes_to_test else 1):
-                        decks.append(hilo_generator(true_count, number_of_decks, deck_penetration,
-                                                    list(cards) + [dealer_up_card]))
-
-                for example_shoe in decks:
-                    shoe_copy = example_shoe.copy()
-                    arguments.append((cards, dealer_up_card, tuple(shoe_copy), card_number <= 2,
-                                      card_number == 2, can_surrender and card_number == 2, 0,
-                                      dealer_peeks_for_blackjack, das, dealer_stands_soft_17, True))
-
-    data_table = {player_total: {dealer_up_card: {
+
+def setup_generator_worker(rules: RuleSet, infinite_deck: bool, *cache_arguments: Any) -> None:
+    """
+    Set up a worker process of the generators, so the tasks don't have to carry the rules.
+
+    :param rules: The rules of the game. The maximum number of splits is given by each task.
+    :param infinite_deck: Whether to use the infinite-deck engine of the best move analysis.
+    :param cache_arguments: The arguments of `best_move.setup_worker_caches`.
+    """
+    global worker_rules, worker_infinite_deck
+    worker_rules = rules
+    worker_infinite_deck = infinite_deck
+    setup_worker_caches(*cache_arguments)
+
+
+def analyse_hand(indexed_task: tuple[int, HandTask]) -> tuple[int, list[tuple[float, ...]]]:
+    """
+    Analyse a hand in every shoe it is tested in, in a worker process.
+
+    :param indexed_task: The index of the task, to match its results, which arrive in any order, and the task.
+    :return: The index of the task and the expected returns of the hand in each shoe.
+    """
+    index, task = indexed_task
+    return index, perfect_mover_batch(task.cards, task.dealer_up_card, task.shoes, task.can_double, task.can_insure,
+                                      task.can_surrender, rules=worker_rules._replace(max_splits=task.max_splits),
+                                      infinite_deck=worker_infinite_deck)
+
+
+def analyse_hands(pool: multiprocessing.pool.Pool, tasks: Iterable[HandTask], window: int,
+                  checkpoint: GeneratorCheckpoint | None = None) -> Iterator[tuple[HandTask, list[tuple[float, ...]]]]:
+    """
+    Analyse hands in worker processes, yielding the results as soon as each hand is ready, in any order.
+
+    The tasks are only generated when there are fewer than `window` tasks waiting for their results, so they never
+    all have to be in memory. No more tasks are sent once the results stop being read (e.g. when a task raises an
+    exception), so the pool can be closed.
+
+    :param pool: The worker processes (see `setup_generator_worker`).
+    :param tasks: The hands to analyse.
+    :param window: How many tasks can wait for their results at once.
+    :param checkpoint: Where to store the results as soon as they arrive. If it is None, they aren't stored.
+    :return: Each task and the expected returns of the hand in each shoe.
+    """
+    waiting: dict[int, HandTask] = {}
+    slots = threading.BoundedSemaphore(window)
+    stopped = threading.Event()
+
+    def send_tasks() -> Iterator[tuple[int, HandTask]]:
+        for index, task in enumerate(tasks):
+            # Called by the pool's thread that sends the tasks, so it waits for results. It stops waiting when the
+            # results are no longer read, or the pool could never be closed.
+            while not slots.acquire(timeout=SEND_TIMEOUT):
+                if stopped.is_set():
+                    return
+            waiting[index] = task
+            yield index, task
+
+    try:
+        for index, shoe_profits in pool.imap_unordered(analyse_hand, send_tasks()):
+            slots.release()
+            task = waiting.pop(index)
+            if checkpoint is not None:
+                checkpoint.put(task, shoe_profits)
+            yield task, shoe_profits
+    finally:
+        stopped.set()
+
+
+def empty_data_table(name: str) -> dict[int, dict[int, Any]]:
+    """
+    Create the data table of a strategy table, before any hand is added to it.
+
+    :param name: The table ("no_ace", "ace" or "split").
+    :return: For each row and dealer up card, the weighted sums of the expected returns (see `add_weighted_profits`).
+        The no ace and ace tables have a row for all hands, for the hands that can double, surrender and take insurance.
+    """
+    if name == "split":
+        return {split_card: {dealer_up_card: [0., 0., 0., 0., 0., 0., 0.] for dealer_up_card in range(2, 12)}
+                for split_card in TABLE_ROWS[name]}
+    return {player_total: {dealer_up_card: {
         key: [0., 0., 0., 0., 0., 0., 0.] for key in ["all", "double", "surrender", "insurance"]}
-        for dealer_up_card in range(2, 12)} for player_total in range(12, 22)}
-    with multiprocessing.Pool(processes=cores) as pool:
-        for argument, profits_not_cast in zip(arguments, pool.starmap(perfect_mover_cache, arguments)):
-            profits = cast(tuple[float, ...], profits_not_cast)
-            cards = argument[0]
-            dealer_up_card = argument[1]
-            hand = Hand(cards)
-            hand_value, hand_aces = hand.value_aces()
-            card_number = len(cards)
-            print(f"Player cards: {cards}, Dealer up card: {dealer_up_card}, Ace profits: {profits}")
-
-            data_table[hand_value][dealer_up_card]["all"][6] += 1 * all_combinations.count(cards)
-            data_table[hand_value][dealer_up_card]["all"][0] += profits[0] * all_combinations.count(cards)
-            data_table[hand_value][dealer_up_card]["all"][1] += profits[1] * all_combinations.count(cards)
-            data_table[hand_value][dealer_up_card]["all"][2] -= 1000 * all_combinations.count(cards)
-            data_table[hand_value][dealer_up_card]["all"][3] -= 1000 * all_combinations.count(cards)
-            data_table[hand_value][dealer_up_card]["all"][4] -= 1000 * all_combinations.count(cards)
-            data_table[hand_value][dealer_up_card]["all"][5] -= 1000 * all_combinations.count(cards)
-            if card_number == 2:
-                data_table[hand_value][dealer_up_card]["double"][6] += 1 * all_combinations.count(cards)
-                data_table[hand_value][dealer_up_card]["double"][0] += profits[0] * all_combinations.count(cards)
-                data_table[hand_value][dealer_up_card]["double"][1] += profits[1] * all_combinations.count(cards)
-                data_table[hand_value][dealer_up_card]["double"][2] += profits[2] * all_combinations.count(cards)
-                data_table[hand_value][dealer_up_card]["double"][3] -= 1000 * all_combinations.count(cards)
-                data_table[hand_value][dealer_up_card]["double"][4] -= 1000 * all_combinations.count(cards)
-                data_table[hand_value][dealer_up_card]["double"][5] -= 1000 * all_combinations.count(cards)
-
-                data_table[hand_value][dealer_up_card]["surrender"][6] += 1 * all_combinations.count(cards)
-                data_table[hand_value][dealer_up_card]["surrender"][0] += profits[0] * all_combinations.count(cards)
-                data_table[hand_value][dealer_up_card]["surrender"][1] += profits[1] * all_combinations.count(cards)
-                data_table[hand_value][dealer_up_card]["surrender"][2] += profits[2] * all_combinations.count(cards)
-                data_table[hand_value][dealer_up_card]["surrender"][3] += profits[3] * all_combinations.count(cards)
-                data_table[hand_value][dealer_up_card]["surrender"][4] += profits[4] * all_combinations.count(cards)
-                data_table[hand_value][dealer_up_card]["surrender"][5] -= 1000 * all_combinations.count(cards)
-            if dealer_up_card == 11 and card_number == 2:
-                data_table[hand_value][dealer_up_card]["insurance"][6] += 1 * all_combinations.count(cards)
-                data_table[hand_value][dealer_up_card]["insurance"][0] += profits[0] * all_combinations.count(cards)
-                data_table[hand_value][dealer_up_card]["insurance"][1] += profits[1] * all_combinations.count(cards)
-                data_table[hand_value][dealer_up_card]["insurance"][2] += profits[2] * all_combinations.count(cards)
-                data_table[hand_value][dealer_up_card]["insurance"][3] += profits[3] * all_combinations.count(cards)
-                data_table[hand_value][dealer_up_card]["insurance"][4] += profits[4] * all_combinations.count(cards)
-                data_table[hand_value][dealer_up_card]["insurance"][5] += profits[5] * all_combinations.count(cards)
-    print(f"Ace data table:\n{data_table}")
-
-    clean_table = {player_total: {dealer_up_card: "" for dealer_up_card in range(2, 12)} for player_total in range(12, 22)}
-    for player_total in range(12, 22):
+        for dealer_up_card in range(2, 12)} for player_total in TABLE_ROWS[name]}
+
+
+def add_hand_results(data_table: dict[int, dict[int, Any]], spec: TableSpec, task: HandTask,
+                     shoe_profits: list[tuple[float, ...]]) -> None:
+    """
+    Add the expected returns of a hand in each shoe to the data table of its strategy table.
+
+    :param data_table: The data table (see `empty_data_table`).
+    :param spec: The strategy table.
+    :param task: The hand.
+    :param shoe_profits: The expected returns of the hand in each shoe.
+    """
+    cards, dealer_up_card = task.cards, task.dealer_up_card
+    if spec.name == "split":
+        for split_shoe, shoe_weight, profits in zip(task.shoes, task.weights, shoe_profits):
+            print(f"Player cards: {cards}, Dealer up card: {dealer_up_card}, Split profits: {profits},"
+                  f" Split shoe: {split_shoe}")
+            add_weighted_profits(data_table[cards[0]][dealer_up_card], profits, shoe_weight, 6)
+        return
+
+    rows = data_table[Hand(cards).value()][dealer_up_card]
+    for profits, shoe_weight in zip(shoe_profits, task.weights):
+        print(f"Player cards: {cards}, Dealer up card: {dealer_up_card}, {TABLE_LABELS[spec.name]} profits: {profits}")
+        weight = spec.hands[cards] * shoe_weight
+        add_weighted_profits(rows["all"], profits, weight, 2)
+        if len(cards) == 2:
+            add_weighted_profits(rows["double"], profits, weight, 3)
+            add_weighted_profits(rows["surrender"], profits, weight, 5)
+        if dealer_up_card == 11 and len(cards) == 2:
+            add_weighted_profits(rows["insurance"], profits, weight, 6)
+
+
+def generate_data_tables(specs: Sequence[TableSpec], true_counts: Sequence[int | None], cores: int, rules: RuleSet,
+                         deck_penetration: float, cache_file: str | None, infinite_deck: bool,
+                         checkpoint: GeneratorCheckpoint | None) -> dict[tuple[str, int | None], dict[int, dict[int, Any]]]:
+    """
+    Analyse the hands of some strategy tables for many true counts, all in one pool of worker processes.
+
+    :param specs: The tables.
+    :param true_counts: The true counts to generate the tables for. None is basic strategy.
+    :param cores: How many cores to use.
+    :param rules: The rules of the game. The maximum number of splits is given by each table.
+    :param deck_penetration: When to reshuffle the shoe (see `shoe_generators.hilo_generator`).
+    :param cache_file: A file to store the results of the best move analysis in. If it is None, they aren't stored.
+    :param infinite_deck: Whether to use the infinite-deck engine of the best move analysis.
+    :param checkpoint: Where to store the results of each hand. The hands that are already in it aren't analysed again.
+        If it is None, the results aren't stored.
+    :return: The data table (see `empty_data_table`) of each table and true count.
+    """
+    data_tables = {(spec.name, true_count): empty_data_table(spec.name) for spec in specs for true_count in true_counts}
+    specs_by_name = {spec.name: spec for spec in specs}
+    done = {key: result for key, result in (checkpoint.results() if checkpoint is not None else {}).items()
+            if key[:2] in data_tables and key[2] in specs_by_name[key[0]].hands}
+    tasks = hand_tasks(specs, true_counts, rules.deck_number, deck_penetration, done)
+    with shared_table_for(cores) as table, multiprocessing.Pool(processes=cores, initializer=setup_generator_worker,
+                                                                initargs=(rules, infinite_deck, cache_file, table,
+                                                                          cache_stats.enabled, (), *cache_budget())
+                                                                ) as pool:
+        for task, shoe_profits in itertools.chain(done.values(), analyse_hands(pool, tasks, WINDOW_PER_CORE * cores,
+                                                                               checkpoint)):
+            add_hand_results(data_tables[task.table, task.true_count], specs_by_name[task.table], task, shoe_profits)
+        pool.close()
+        pool.join()  # Let the workers exit normally, so they can print their cache stats.
+    return data_tables
+
+
+def clean_totals_table(name: str, data_table: dict[int, dict[int, Any]]) -> dict[int, dict[int, str]]:
+    """
+    Choose the best actions of the no ace or the ace table.
+
+    :param name: The table ("no_ace" or "ace").
+    :param data_table: The data table (see `empty_data_table`).
+    :return: The basic strategy table, to be saved and/or plotted.
+    """
+    clean_table = {player_total: {dealer_up_card: "" for dealer_up_card in range(2, 12)}
+                   for player_total in TABLE_ROWS[name]}
+    for player_total in TABLE_ROWS[name]:
         for dealer_up_card in range(2, 12):
-            clean_text = ""
 
             print(f"Player total: {player_total}, Dealer up card: {dealer_up_card}, "
-                  f"Ace data row: {data_table[player_total][dealer_up_card]}")
+                  f"{TABLE_LABELS[name]} data row: {data_table[player_total][dealer_up_card]}")
+
+            clean_text = ""
 
             if data_table[player_total][dealer_up_card]["insurance"][6]:
                 profit_line = [profit / data_table[player_total][dealer_up_card]["insurance"][6] for profit in
@@ -367,70 +555,13 @@ def ace_table_generator(cores: int = 1, card_numbers: tuple[int, ...] = (2, 3, 4
     return clean_table
 
 
-def split_table_generator(cores: int = 1, max_splits: int = 1, number_of_decks: int = 6, true_count: int | None = None,
-                          shoes_to_test: int | None = None, deck_penetration: float = .25,
-                          dealer_peeks_for_blackjack: bool = True, das: bool = True,
-                          dealer_stands_soft_17: bool = True, can_surrender: bool = True) -> dict[int, dict[int, str]]:
+def clean_split_table(data_table: dict[int, dict[int, Any]]) -> dict[int, dict[int, str]]:
     """
-    Generate basic strategy when we can split.
+    Choose the best actions of the split table.
 
-    :param cores: How many cores to use in the generation of basic strategy.
-    :param max_splits: The maximum number of times a hand can be split. (1=fastest, fairly accurate; 3=slowest, super accurate)
-    :param number_of_decks: The number of decks in the initial shoe.
-    :param true_count: The true count that we should generate basic strategy for.
-        Default is None which generates general basic strategy. An integer, generated deviations from basic strategy.
-    :param shoes_to_test: How many shoes to test when generating deviations.
-    :param deck_penetration: When to reshuffle the shoe. Reshuffles when cards remaining < starting cards * deck penetration.
-        So the shoe can't have fewer than starting cards * deck penetration cards.
-    :param dealer_peeks_for_blackjack: Whether the dealer peeks for blackjack.
-    :param das: Whether we can double after splitting.
-    :param dealer_stands_soft_17: Whether the dealer stands on soft 17.
-    :param can_surrender: Whether the game rules allow surrendering.
+    :param data_table: The data table (see `empty_data_table`).
     :return: The basic strategy table, to be saved and/or plotted.
     """
-    shoe = DECK * number_of_decks
-    shoe.sort()
-
-    arguments = []
-
-    for split_card in range(2, 12):
-        cards = (split_card, split_card)
-        for dealer_up_card in range(2, 12):
-            if true_count is None:
-                default_shoe = shoe.copy()
-                for card in cards + (dealer_up_card,):
-                    default_shoe.remove(card)
-                decks = [default_shoe]
-            else:
-                decks = []
-                for _ in range(shoes_to_test if shoes_to_test else 1):
-                    decks.append(hilo_generator(true_count, number_of_decks, deck_penetration, list(cards) + [dealer_up_card]))
-
-            for example_shoe in decks:
-                shoe_copy = example_shoe.copy()
-                arguments.append((cards, dealer_up_card, tuple(shoe_copy), True, True, can_surrender, max_splits,
-                                  dealer_peeks_for_blackjack, das, dealer_stands_soft_17, True))
-
-    data_table = {player_total: {dealer_up_card: [0., 0., 0., 0., 0., 0., 0.] for dealer_up_card in range(2, 12)}
-                  for player_total in range(2, 12)}
-    with multiprocessing.Pool(processes=cores) as pool:
-        for argument, profits_not_cast in zip(arguments, pool.starmap(perfect_mover_cache, arguments)):
-            profits = cast(tuple[float, ...], profits_not_cast)
-            split_card = argument[0][0]
-            dealer_up_card = argument[1]
-
-            print(f"Player cards: {argument[0]}, Dealer up card: {dealer_up_card}, Split profits: {profits},"
-                  f" Split shoe: {argument[2]}")
-            data_table[split_card][dealer_up_card][6] += 1
-            data_table[split_card][dealer_up_card][0] += profits[0]
-            data_table[split_card][dealer_up_card][1] += profits[1]
-            data_table[split_card][dealer_up_card][2] += profits[2]
-            data_table[split_card][dealer_up_card][3] += profits[3]
-            data_table[split_card][dealer_up_card][4] += profits[4]
-            data_table[split_card][dealer_up_card][5] += profits[5]
-
-    print(f"Split data table:\n{data_table}")
-
     clean_table = {player_total: {dealer_up_card: "" for dealer_up_card in range(2, 12)} for player_total in range(2, 12)}
     for split_card in range(2, 12):
         for dealer_up_card in range(2, 12):
@@ -459,256 +590,388 @@ def split_table_generator(cores: int = 1, max_splits: int = 1, number_of_decks:
     return clean_table
 
 
-def draw_and_export_tables(effort: int = 0, cores: int = 1, filename: str | None = None, true_count: int | None = None,
-                           number_of_decks: int = 6, deck_penetration: float = .25,
-                           dealer_peeks_for_blackjack: bool = True, das: bool = True,
+def clean_data_table(name: str, data_table: dict[int, dict[int, Any]]) -> dict[int, dict[int, str]]:
+    """
+    Choose the best actions of a strategy table.
+
+    :param name: The table ("no_ace", "ace" or "split").
+    :param data_table: The data table (see `empty_data_table`).
+    :return: The basic strategy table, to be saved and/or plotted.
+    """
+    print(f"{TABLE_LABELS[name]} data table:\n{data_table}")
+    return clean_split_table(data_table) if name == "split" else clean_totals_table(name, data_table)
+
+
+def no_ace_table_generator(cores: int = 1, card_numbers: tuple[int, ...] = (2, 3, 4), number_of_decks: int = 6,
+                           true_count: int | None = None, shoes_to_test: int | None = None,
+                           deck_penetration: float = .25, dealer_peeks_for_blackjack: bool = True, das: bool = True,
                            dealer_stands_soft_17: bool = True, can_surrender: bool = True,
-                           plot_results: bool = True) -> tuple[list[list[str]], ...]:
+                           cache_file: str | None = None, infinite_deck: bool = False,
+                           checkpoint: GeneratorCheckpoint | None = None, weighted_compositions: bool = False
+                           ) -> dict[int, dict[int, str]]:
     """
-    Create the graphs with the basic strategy (and maybe save it to a file).
+    Generate basic strategy when we don't have an ace.
 
-    :param effort: How many different hand combinations to test. (min: 0=fastest, very accurate;
-        max: 5=very slow, super accurate)
     :param cores: How many cores to use in the generation of basic strategy.
-    :param filename: Where to store the basic strategy. If it is None, then it isn't saved.
+    :param card_numbers: Test all hand with card_numbers number of hands. (e.g. if card_numbers is (2, 3), then all hands
+        with 2 or 3 cards will be tested)
+    :param number_of_decks: The number of decks in the initial shoe.
     :param true_count: The true count that we should generate basic strategy for.
         Default is None which generates general basic strategy. An integer, generated deviations from basic strategy.
+    :param shoes_to_test: How many shoes to test when generating deviations.
+    :param deck_penetration: When to reshuffle the shoe. Reshuffles when cards remaining < starting cards * deck penetration.
+        So the shoe can't have fewer than starting cards * deck penetration cards.
+    :param dealer_peeks_for_blackjack: Whether the dealer peeks for blackjack.
+    :param das: Whether we can double after splitting.
+    :param dealer_stands_soft_17: Whether the dealer stands on soft 17.
+    :param can_surrender: Whether the game rules allow surrendering.
+    :param cache_file: A file to store the results of the best move analysis in, so later runs can reuse them.
+        If it is None, the results aren't stored.
+    :param infinite_deck: Whether to use the infinite-deck engine of the best move analysis, which draws every card with
+        the probabilities of the shoe. Much faster, but approximate.
+    :param checkpoint: Where to store the results of each hand, so the generation can be resumed. The hands that are
+        already in it aren't analysed again. If it is None, the results aren't stored.
+    :param weighted_compositions: Whether to test each hand in `shoes_to_test` representative shoes with the true count,
+        weighted by their exact probabilities, instead of random shoes. The results are the same in every run.
+    :return: The basic strategy table, to be saved and/or plotted.
+    """
+    rules = RuleSet(number_of_decks, 0, dealer_peeks_for_blackjack, das, dealer_stands_soft_17, can_surrender)
+    spec = TableSpec("no_ace", no_ace_hands(card_numbers), 0, shoes_to_test, weighted_compositions)
+    data_tables = generate_data_tables([spec], [true_count], cores, rules, deck_penetration, cache_file, infinite_deck,
+                                       checkpoint)
+    return clean_data_table(spec.name, data_tables[spec.name, true_count])
+
+
+def ace_table_generator(cores: int = 1, card_numbers: tuple[int, ...] = (2, 3, 4), number_of_decks: int = 6,
+                        true_count: int | None = None, shoes_to_test: int | None = None,
+                        deck_penetration: float = .25, dealer_peeks_for_blackjack: bool = True, das: bool = True,
+                        dealer_stands_soft_17: bool = True, can_surrender: bool = True,
+                        cache_file: str | None = None, infinite_deck: bool = False,
+                        checkpoint: GeneratorCheckpoint | None = None, weighted_compositions: bool = False
+                        ) -> dict[int, dict[int, str]]:
+    """
+    Generate basic strategy when we have an ace.
+
+    :param cores: How many cores to use in the generation of basic strategy.
+    :param card_numbers: Test all hand with card_numbers number of hands. (e.g. if card_numbers is (2, 3), then all hands
+        with 2 or 3 cards will be tested)
     :param number_of_decks: The number of decks in the initial shoe.
+    :param true_count: The true count that we should generate basic strategy for.
+        Default is None which generates general basic strategy. An integer, generated deviations from basic strategy.
+    :param shoes_to_test: How many shoes to test when generating deviations.
     :param deck_penetration: When to reshuffle the shoe. Reshuffles when cards remaining < starting cards * deck penetration.
         So the shoe can't have fewer than starting cards * deck penetration cards.
     :param dealer_peeks_for_blackjack: Whether the dealer peeks for blackjack.
     :param das: Whether we can double after splitting.
     :param dealer_stands_soft_17: Whether the dealer stands on soft 17.
     :param can_surrender: Whether the game rules allow surrendering.
-    :param plot_results: Whether we should plot the basic strategy at the end.
-    :return: The three basic strategy tables. (for hard totals, soft totals, and pair splitting)
+    :param cache_file: A file to store the results of the best move analysis in, so later runs can reuse them.
+        If it is None, the results aren't stored.
+    :param infinite_deck: Whether to use the infinite-deck engine of the best move analysis, which draws every card with
+        the probabilities of the shoe. Much faster, but approximate.
+    :param checkpoint: Where to store the results of each hand, so the generation can be resumed. The hands that are
+        already in it aren't analysed again. If it is None, the results aren't stored.
+    :param weighted_compositions: Whether to test each hand in `shoes_to_test` representative shoes with the true count,
+        weighted by their exact probabilities, instead of random shoes. The results are the same in every run.
+    :return: The basic strategy table, to be saved and/or plotted.
+    """
+    rules = RuleSet(number_of_decks, 0, dealer_peeks_for_blackjack, das, dealer_stands_soft_17, can_surrender)
+    spec = TableSpec("ace", ace_hands(card_numbers), 0, shoes_to_test, weighted_compositions)
+    data_tables = generate_data_tables([spec], [true_count], cores, rules, deck_penetration, cache_file, infinite_deck,
+                                       checkpoint)
+    return clean_data_table(spec.name, data_tables[spec.name, true_count])
+
+
+def split_table_generator(cores: int = 1, max_splits: int = 1, number_of_decks: int = 6, true_count: int | None = None,
+                          shoes_to_test: int | None = None, deck_penetration: float = .25,
+                          dealer_peeks_for_blackjack: bool = True, das: bool = True,
+                          dealer_stands_soft_17: bool = True, can_surrender: bool = True,
+                          cache_file: str | None = None, infinite_deck: bool = False,
+                          checkpoint: GeneratorCheckpoint | None = None, weighted_compositions: bool = False
+                          ) -> dict[int, dict[int, str]]:
+    """
+    Generate basic strategy when we can split.
+
+    :param cores: How many cores to use in the generation of basic strategy.
+    :param max_splits: The maximum number of times a hand can be split. (e.g. 3 for up to 4 hands)
+    :param number_of_decks: The number of decks in the initial shoe.
+    :param true_count: The true count that we should generate basic strategy for.
+        Default is None which generates general basic strategy. An integer, generated deviations from basic strategy.
+    :param shoes_to_test: How many shoes to test when generating deviations.
+    :param deck_penetration: When to reshuffle the shoe. Reshuffles when cards remaining < starting cards * deck penetration.
+        So the shoe can't have fewer than starting cards * deck penetration cards.
+    :param dealer_peeks_for_blackjack: Whether the dealer peeks for blackjack.
+    :param das: Whether we can double after splitting.
+    :param dealer_stands_soft_17: Whether the dealer stands on soft 17.
+    :param can_surrender: Whether the game rules allow surrendering.
+    :param cache_file: A file to store the results of the best move analysis in, so later runs can reuse them.
+        If it is None, the results aren't stored.
+    :param infinite_deck: Whether to use the infinite-deck engine of the best move analysis, which draws every card with
+        the probabilities of the shoe. Much faster, but approximate.
+    :param checkpoint: Where to store the results of each hand, so the generation can be resumed. The hands that are
+        already in it aren't analysed again. If it is None, the results aren't stored.
+    :param weighted_compositions: Whether to test each hand in `shoes_to_test` representative shoes with the true count,
+        weighted by their exact probabilities, instead of random shoes. The results are the same in every run.
+    :return: The basic strategy table, to be saved and/or plotted.
+    """
+    rules = RuleSet(number_of_decks, max_splits, dealer_peeks_for_blackjack, das, dealer_stands_soft_17, can_surrender)
+    spec = TableSpec("split", split_hands(), max_splits, shoes_to_test, weighted_compositions)
+    data_tables = generate_data_tables([spec], [true_count], cores, rules, deck_penetration, cache_file, infinite_deck,
+                                       checkpoint)
+    return clean_data_table(spec.name, data_tables[spec.name, true_count])
+
+
+def effort_settings(effort: int) -> tuple[tuple[int, ...], int, int, int, int]:
+    """
+    Get how many hands and shoes are tested with an effort.
+
+    :param effort: How many different hand combinations to test. (min: 0=fastest, very accurate;
+        max: 5=very slow, super accurate)
+    :return: The numbers of cards of the tested hands, the maximum number of splits, how many shoes each hand is tested
+        in when generating deviations, how many shoes each pair is tested in, and how many representative shoes each
+        hand is tested in (see `generate_test_shoes_for_counts`).
     """
     card_numbers: tuple[int, ...] = (2,)
     max_splits = 1
     shoes_to_test = 30
     shoes_for_split = 10
+    representative_shoes = 6
     if effort == 0:
         card_numbers = (2,)
         max_splits = 1
         shoes_to_test = 30
         shoes_for_split = 10
+        representative_shoes = 6
     elif effort == 1:
         card_numbers = (2, 3)
         max_splits = 1
         shoes_to_test = 50
         shoes_for_split = 20
+        representative_shoes = 8
     elif effort == 2:
         card_numbers = (2, 3, 4)
         max_splits = 2
         shoes_to_test = 100
         shoes_for_split = 40
+        representative_shoes = 10
     elif effort == 3:
         card_numbers = (2, 3, 4, 5)
         max_splits = 3
         shoes_to_test = 200
         shoes_for_split = 80
+        representative_shoes = 12
     elif effort == 4:
         card_numbers = (2, 3, 4, 5, 6)
         max_splits = 3
         shoes_to_test = 500
         shoes_for_split = 200
+        representative_shoes = 16
+    return card_numbers, max_splits, shoes_to_test, shoes_for_split, representative_shoes
+
+
+def generate_strategy_tables(true_counts: Sequence[int | None], effort: int = 0, cores: int = 1,
+                             number_of_decks: int = 6, deck_penetration: float = .25,
+                             dealer_peeks_for_blackjack: bool = True, das: bool = True,
+                             dealer_stands_soft_17: bool = True, can_surrender: bool = True,
+                             cache_file: str | None = None, infinite_deck: bool = False,
+                             checkpoint_file: str | None = None, resume: bool = False,
+                             weighted_compositions: bool = False, fresh: bool = False
+                             ) -> dict[int | None, tuple[list[list[str]], ...]]:
+    """
+    Generate the three strategy tables for many true counts. The hands of every table and true count are analysed in
+    one pool of worker processes, and the shoes of the different true counts are sampled in one batch.
+
+    :param true_counts: The true counts to generate the tables for. None generates general basic strategy.
+    :param effort: How many different hand combinations to test (see `effort_settings`).
+    :param cores: How many cores to use.
+    :param number_of_decks: The number of decks in the initial shoe.
+    :param deck_penetration: When to reshuffle the shoe. Reshuffles when cards remaining < starting cards * deck penetration.
+    :param dealer_peeks_for_blackjack: Whether the dealer peeks for blackjack.
+    :param das: Whether we can double after splitting.
+    :param dealer_stands_soft_17: Whether the dealer stands on soft 17.
+    :param can_surrender: Whether the game rules allow surrendering.
+    :param cache_file: A file to store the results of the best move analysis in. If it is None, they aren't stored.
+    :param infinite_deck: Whether to use the infinite-deck engine of the best move analysis.
+    :param checkpoint_file: A file to store the results of each hand in as soon as they arrive, so an interrupted
+        generation can be resumed. If it is None, the results aren't stored.
+    :param resume: Whether to continue the generation stored in `checkpoint_file`, instead of starting a new one.
+    :param weighted_compositions: Whether to test each hand in a few representative shoes with the true count, weighted
+        by their exact probabilities, instead of random shoes (see `generate_test_shoes_for_counts`).
+    :param fresh: Whether to delete the results that are already in `checkpoint_file`. If neither `resume` nor `fresh`
+        is set, the file must not have the results of an unfinished generation.
+    :return: The three strategy tables (for hard totals, soft totals, and pair splitting) of each true count.
+    """
+    card_numbers, max_splits, shoes_to_test, shoes_for_split, representative_shoes = effort_settings(effort)
+    if weighted_compositions:
+        shoes_to_test = shoes_for_split = representative_shoes
+    rules = RuleSet(number_of_decks, max_splits, dealer_peeks_for_blackjack, das, dealer_stands_soft_17, can_surrender)
+    specs = [TableSpec("no_ace", no_ace_hands(card_numbers), 0, shoes_to_test, weighted_compositions),
+             TableSpec("ace", ace_hands(card_numbers), 0, shoes_to_test, weighted_compositions),
+             TableSpec("split", split_hands(), max_splits, shoes_for_split, weighted_compositions)]
+
+    checkpoint = None
+    if checkpoint_file:
+        settings = (f"effort={effort}, decks={number_of_decks}, penetration={deck_penetration}, "
+                    f"peek={dealer_peeks_for_blackjack}, das={das}, stand_soft_17={dealer_stands_soft_17}, "
+                    f"surrender={can_surrender}, infinite_deck={infinite_deck}, "
+                    f"weighted_compositions={weighted_compositions}")
+        checkpoint = GeneratorCheckpoint(checkpoint_file, settings, resume, fresh)
+    data_tables = generate_data_tables(specs, true_counts, cores, rules, deck_penetration, cache_file, infinite_deck,
+                                       checkpoint)
+    if checkpoint is not None:
+        checkpoint.finish()
+        checkpoint.close()
+
+    tables = {}
+    for true_count in true_counts:
+        if true_count is not None:
+            print(f"True count: {true_count}")
+        clean_tables = {spec.name: clean_data_table(spec.name, data_tables[spec.name, true_count]) for spec in specs}
+        for spec in specs:
+            print(f"{TABLE_LABELS[spec.name]} table:\n{clean_tables[spec.name]}")
+        tables[true_count] = tuple([[clean_tables[spec.name][row][dealer_card] for dealer_card in range(2, 12)]
+                                    for row in TABLE_ROWS[spec.name]] for spec in specs)
+    return tables
+
+
+def export_tables(filename: str, no_ace_table: list[list[str]], ace_table: list[list[str]],
+                  split_table: list[list[str]]) -> None:
+    """
+    Save the strategy tables to a file, which can be used by `action_strategies.BasicStrategyMover`.
+
+    :param filename: The file.
+    :param no_ace_table: The table of the hard totals.
+    :param ace_table: The table of the soft totals.
+    :param split_table: The table of the pairs.
+    """
+    with open(filename, "w", newline='') as csv_file:
+        writer = csv.writer(csv_file, delimiter=',')
+        for row_index, hand_total in enumerate(range(4, 22)):
+            new_row = list(map(lambda item: re.sub(r'\([^)]*\)', '', item).replace(" ", ""), no_ace_table[row_index]))
+            writer.writerow([f"n{hand_total}"] + new_row)
+        for row_index, hand_total in enumerate(range(12, 22)):
+            new_row = list(map(lambda item: re.sub(r'\([^)]*\)', '', item).replace(" ", ""), ace_table[row_index]))
+            writer.writerow([f"a{hand_total}"] + new_row)
+        for row_index, card in enumerate(range(2, 12)):
+            new_row = list(map(lambda item: re.sub(r'\([^)]*\)', '', item).replace(" ", ""), split_table[row_index]))
+            writer.writerow([f"s{card}"] + new_row)
+
+
+def draw_and_export_tables(effort: int = 0, cores: int = 1, filename: str | None = None, true_count: int | None = None,
+                           number_of_decks: int = 6, deck_penetration: float = .25,
+                           dealer_peeks_for_blackjack: bool = True, das: bool = True,
+                           dealer_stands_soft_17: bool = True, can_surrender: bool = True,
+                           plot_results: bool = True, cache_file: str | None = None, infinite_deck: bool = False,
+                           checkpoint_file: str | None = None, resume: bool = False, weighted_compositions: bool = False,
+                           fresh: bool = False) -> tuple[list[list[str]], ...]:
+    """
+    Create the graphs with the basic strategy (and maybe save it to a file).
 
-    fig, ax = plt.subplots(dpi=200)
-
-    fig.patch.set_visible(False)
-    fig.set_size_inches(7, 4.8)
-    ax.set_yticklabels([])
-    ax.set_xticklabels([])
-    ax.set_xticks([])
-    ax.set_yticks([])
-    ax.spines['top'].set_visible(False)
-    ax.spines['right'].set_visible(False)
-    ax.spines['bottom'].set_visible(False)
-    ax.spines['left'].set_visible(False)
-    ax.yaxis.set_label_coords(-0.12, 0)
-
-    no_ace_table_dict = no_ace_table_generator(cores, card_numbers, number_of_decks=number_of_decks, true_count=true_count,
-                                               shoes_to_test=shoes_to_test, deck_penetration=deck_penetration,
-                                               dealer_peeks_for_blackjack=dealer_peeks_for_blackjack, das=das,
-                                               dealer_stands_soft_17=dealer_stands_soft_17, can_surrender=can_surrender)
-
-    print("Save the line below (no ace table) if you want to stop and continue later by commenting the above line and "
-          "replacing it with the precalculated table.")
-    print(no_ace_table_dict)
-    no_ace_table = [[
-        no_ace_table_dict[hand_total][dealer_card] for dealer_card in range(2, 12)] for hand_total in range(4, 22)]
-
-    no_ace_colors: list[list[str]] = [[] for _ in range(18)]
-    for row in range(18):
-        for col in range(10):
-            if no_ace_table[row][col].startswith("s"):
-                no_ace_colors[row].append("y")
-            elif no_ace_table[row][col].startswith("h"):
-                no_ace_colors[row].append("w")
-            elif no_ace_table[row][col].startswith("d"):
-                no_ace_colors[row].append("g")
-            elif no_ace_table[row][col].startswith("p"):
-                no_ace_colors[row].append("c")
-            elif no_ace_table[row][col].startswith("u"):
-                no_ace_colors[row].append("r")
-            elif no_ace_table[row][col].startswith("i"):
-                no_ace_colors[row].append("maroon")
-
-    table = ax.table(cellText=no_ace_table, cellColours=no_ace_colors, colLabels=list_range_str(2, 12),
-                     rowLabels=list_range_str(4, 22), loc='center', cellLoc='center')
-    table.scale(1.13, 1.1)
-    table.auto_set_font_size(False)
-    table.set_fontsize(3.5)
-
-    ax.set_title("Hard totals")
-    ax.set_xlabel("Dealer Up Card")
-    ax.set_ylabel("Player Cards")
-    ax.xaxis.tick_top()
-
-    handles = [patches.Rectangle((0, 0), .1, .1, facecolor=color, edgecolor='k', lw=.6)
-               for color in ["y", "w", "g", "c", "r", "maroon"]]
-    ax.legend(handles, ["Stand", "Hit", "Double", "Split", "Surrender", "Insurance"], fontsize="xx-small",
-              bbox_to_anchor=(0.5, -0.14), ncol=6, loc=8)
-
-    plt.tight_layout()
-
-    fig2, ax2 = plt.subplots(dpi=200)
-
-    fig2.patch.set_visible(False)
-    fig2.set_size_inches(7, 3.2)
-    ax2.set_yticklabels([])
-    ax2.set_xticklabels([])
-    ax2.set_xticks([])
-    ax2.set_yticks([])
-    ax2.spines['top'].set_visible(False)
-    ax2.spines['right'].set_visible(False)
-    ax2.spines['bottom'].set_visible(False)
-    ax2.spines['left'].set_visible(False)
-    ax2.yaxis.set_label_coords(-0.12, 0)
-
-    ace_table_dict = ace_table_generator(cores, card_numbers, number_of_decks=number_of_decks, true_count=true_count,
-                                         shoes_to_test=shoes_to_test, deck_penetration=deck_penetration,
-                                         dealer_peeks_for_blackjack=dealer_peeks_for_blackjack, das=das,
-                                         dealer_stands_soft_17=dealer_stands_soft_17, can_surrender=can_surrender)
-
-    print("Save the line below (ace table) if you want to stop and continue later by commenting the above line and "
-          "replacing it with the precalculated table.")
-    print(ace_table_dict)
-    ace_table = [[ace_table_dict[hand_total][dealer_card] for dealer_card in range(2, 12)] for hand_total in range(12, 22)]
-
-    ace_colors: list[list[str]] = [[] for _ in range(10)]
-    for row in range(10):
-        for col in range(10):
-            if ace_table[row][col].startswith("s"):
-                ace_colors[row].append("y")
-            elif ace_table[row][col].startswith("h"):
-                ace_colors[row].append("w")
-            elif ace_table[row][col].startswith("d"):
-                ace_colors[row].append("g")
-            elif ace_table[row][col].startswith("p"):
-                ace_colors[row].append("c")
-            elif ace_table[row][col].startswith("u"):
-                ace_colors[row].append("r")
-            elif ace_table[row][col].startswith("i"):
-                ace_colors[row].append("maroon")
-
-    row_labels = ["A,A"] + [f"A,{card}" for card in range(2, 11)]
-    table = ax2.table(cellText=ace_table, cellColours=ace_colors, colLabels=list_range_str(2, 12),
-                      rowLabels=row_labels, loc='center', cellLoc='center')
-    table.scale(1.13, 1.25)
-    table.auto_set_font_size(False)
-    table.set_fontsize(3.5)
-
-    ax2.set_title("Soft totals")
-    ax2.set_xlabel("Dealer Up Card")
-    ax2.set_ylabel("Player Cards")
-    ax2.xaxis.tick_top()
-
-    handles = [patches.Rectangle((0, 0), .1, .1, facecolor=color, edgecolor='k', lw=.6)
-               for color in ["y", "w", "g", "c", "r", "maroon"]]
-    ax2.legend(handles, ["Stand", "Hit", "Double", "Split", "Surrender", "Insurance"], fontsize="xx-small",
-               bbox_to_anchor=(0.5, -0.23), ncol=6, loc=8)
-
-    plt.tight_layout()
-
-    fig3, ax3 = plt.subplots(dpi=200)
-
-    fig3.patch.set_visible(False)
-    fig3.set_size_inches(7, 3.2)
-    ax3.set_yticklabels([])
-    ax3.set_xticklabels([])
-    ax3.set_xticks([])
-    ax3.set_yticks([])
-    ax3.spines['top'].set_visible(False)
-    ax3.spines['right'].set_visible(False)
-    ax3.spines['bottom'].set_visible(False)
-    ax3.spines['left'].set_visible(False)
-    ax3.yaxis.set_label_coords(-0.12, 0)
-
-    split_table_dict = split_table_generator(cores, max_splits, number_of_decks=number_of_decks, true_count=true_count,
-                                             shoes_to_test=shoes_for_split, deck_penetration=deck_penetration,
-                                             dealer_peeks_for_blackjack=dealer_peeks_for_blackjack, das=das,
-                                             dealer_stands_soft_17=dealer_stands_soft_17, can_surrender=can_surrender)
-
-    print("Save the line below (split table) if you want to stop and continue later by commenting the above line and "
-          "replacing it with the precalculated table.")
-    print(split_table_dict)
-    split_table = [[split_table_dict[card][dealer_card] for dealer_card in range(2, 12)] for card in range(2, 12)]
-
-    split_colors: list[list[str]] = [[] for _ in range(10)]
-    for row in range(10):
-        for col in range(10):
-            if split_table[row][col].startswith("s"):
-                split_colors[row].append("y")
-            elif split_table[row][col].startswith("h"):
-                split_colors[row].append("w")
-            elif split_table[row][col].startswith("d"):
-                split_colors[row].append("g")
-            elif split_table[row][col].startswith("p"):
-                split_colors[row].append("c")
-            elif split_table[row][col].startswith("u"):
-                split_colors[row].append("r")
-            elif split_table[row][col].startswith("i"):
-                split_colors[row].append("maroon")
-
-    row_labels = [f"{card},{card}" for card in range(2, 11)] + ["A,A"]
-
-    table = ax3.table(cellText=split_table, cellColours=split_colors, colLabels=list_range_str(2, 12),
-                      rowLabels=row_labels, loc='center', cellLoc='center')
-    table.scale(1.13, 1.25)
-    table.auto_set_font_size(False)
-    table.set_fontsize(3.5)
-
-    ax3.set_title("Pair Splitting")
-    ax3.set_xlabel("Dealer Up Card")
-    ax3.set_ylabel("Player Cards")
-    ax3.xaxis.tick_top()
-
-    handles = [patches.Rectangle((0, 0), .1, .1, facecolor=color, edgecolor='k', lw=.6)
-               for color in ["y", "w", "g", "c", "r", "maroon"]]
-    ax3.legend(handles, ["Stand", "Hit", "Double", "Split", "Surrender", "Insurance"], fontsize="xx-small",
-               bbox_to_anchor=(0.5, -0.23), ncol=6, loc=8)
-
-    plt.tight_layout()
+    :param effort: How many different hand combinations to test. (min: 0=fastest, very accurate;
+        max: 5=very slow, super accurate)
+    :param cores: How many cores to use in the generation of basic strategy.
+    :param filename: Where to store the basic strategy. If it is None, then it isn't saved.
+    :param true_count: The true count that we should generate basic strategy for.
+        Default is None which generates general basic strategy. An integer, generated deviations from basic strategy.
+    :param number_of_decks: The number of decks in the initial shoe.
+    :param deck_penetration: When to reshuffle the shoe. Reshuffles when cards remaining < starting cards * deck penetration.
+        So the shoe can't have fewer than starting cards * deck penetration cards.
+    :param dealer_peeks_for_blackjack: Whether the dealer peeks for blackjack.
+    :param das: Whether we can double after splitting.
+    :param dealer_stands_soft_17: Whether the dealer stands on soft 17.
+    :param can_surrender: Whether the game rules allow surrendering.
+    :param plot_results: Whether we should plot the basic strategy at the end.
+    :param cache_file: A file to store the results of the best move analysis in, so later runs can reuse them.
+        If it is None, the results aren't stored.
+    :param infinite_deck: Whether to use the infinite-deck engine of the best move analysis, which draws every card with
+        the probabilities of the shoe. Much faster, but approximate.
+    :param checkpoint_file: A file to store the results of each hand in as soon as they arrive, so an interrupted
+        generation can be resumed. If it is None, the results aren't stored.
+    :param resume: Whether to continue the generation stored in `checkpoint_file`, instead of starting a new one. The hands
+        that are already in it aren't analysed again.
+    :param weighted_compositions: Whether to test each hand in a few representative shoes with the true count, weighted
+        by their exact probabilities, instead of random shoes. Needs fewer shoes, and the results are the same in every
+        run.
+    :param fresh: Whether to delete the results that are already in `checkpoint_file` and start a new generation. If
+        neither `resume` nor `fresh` is set, the file must not have the results of an unfinished generation.
+    :return: The three basic strategy tables. (for hard totals, soft totals, and pair splitting)
+    """
+    no_ace_table, ace_table, split_table = generate_strategy_tables(
+        [true_count], effort, cores, number_of_decks, deck_penetration, dealer_peeks_for_blackjack, das,
+        dealer_stands_soft_17, can_surrender, cache_file, infinite_deck, checkpoint_file, resume,
+        weighted_compositions, fresh)[true_count]
 
     if filename:
-        with open(filename, "w", newline='') as csv_file:
-            writer = csv.writer(csv_file, delimiter=',')
-            for row_index, hand_total in enumerate(range(4, 22)):
-                new_row = list(map(lambda item: re.sub(r'\([^)]*\)', '', item).replace(" ", ""), no_ace_table[row_index]))
-                writer.writerow([f"n{hand_total}"] + new_row)
-            for row_index, hand_total in enumerate(range(12, 22)):
-                new_row = list(map(lambda item: re.sub(r'\([^)]*\)', '', item).replace(" ", ""), ace_table[row_index]))
-                writer.writerow([f"a{hand_total}"] + new_row)
-            for row_index, card in enumerate(range(2, 12)):
-                new_row = list(map(lambda item: re.sub(r'\([^)]*\)', '', item).replace(" ", ""), split_table[row_index]))
-                writer.writerow([f"s{card}"] + new_row)
+        export_tables(filename, no_ace_table, ace_table, split_table)
 
     if plot_results:
-        plt.show()
+        from plotting import plot_strategy_tables
+        plot_strategy_tables(no_ace_table, ace_table, split_table)
     return no_ace_table, ace_table, split_table
 
 
+def true_count_filename(filename: str, true_count: int) -> str:
+    """
+    Get the file the strategy of a true count is saved to, named like the files in `data`.
+
+    :param filename: The file given by the user (e.g. "6deck_s17_das_peek.csv").
+    :param true_count: The true count.
+    :return: The file of the true count (e.g. "6deck_s17_das_peek_tc_plus_3.csv").
+    """
+    stem, extension = os.path.splitext(filename)
+    if true_count == 0:
+        return f"{stem}_tc_0{extension}"
+    return f"{stem}_tc_{'plus' if true_count > 0 else 'minus'}_{abs(true_count)}{extension}"
+
+
+def draw_and_export_deviations(true_counts: Sequence[int], effort: int = 0, cores: int = 1, filename: str | None = None,
+                               number_of_decks: int = 6, deck_penetration: float = .25,
+                               dealer_peeks_for_blackjack: bool = True, das: bool = True,
+                               dealer_stands_soft_17: bool = True, can_surrender: bool = True,
+                               cache_file: str | None = None, infinite_deck: bool = False,
+                               checkpoint_file: str | None = None, resume: bool = False,
+                               weighted_compositions: bool = False, fresh: bool = False
+                               ) -> dict[int, tuple[list[list[str]], ...]]:
+    """
+    Generate the deviations from basic strategy for many true counts in one run (and maybe save them to files).
+
+    :param true_counts: The true counts to generate deviations for.
+    :param effort: How many different hand combinations to test. (min: 0=fastest, very accurate;
+        max: 5=very slow, super accurate)
+    :param cores: How many cores to use in the generation.
+    :param filename: Where to store the strategy. Each true count is saved to its own file, with the true count added to
+        the name (see `true_count_filename`). If it is None, then they aren't saved.
+    :param number_of_decks: The number of decks in the initial shoe.
+    :param deck_penetration: When to reshuffle the shoe. Reshuffles when cards remaining < starting cards * deck penetration.
+        So the shoe can't have fewer than starting cards * deck penetration cards.
+    :param dealer_peeks_for_blackjack: Whether the dealer peeks for blackjack.
+    :param das: Whether we can double after splitting.
+    :param dealer_stands_soft_17: Whether the dealer stands on soft 17.
+    :param can_surrender: Whether the game rules allow surrendering.
+    :param cache_file: A file to store the results of the best move analysis in, so later runs can reuse them.
+        If it is None, the results aren't stored.
+    :param infinite_deck: Whether to use the infinite-deck engine of the best move analysis, which draws every card with
+        the probabilities of the shoe. Much faster, but approximate.
+    :param checkpoint_file: A file to store the results of each hand in as soon as they arrive, so an interrupted
+        generation can be resumed. If it is None, the results aren't stored.
+    :param resume: Whether to continue the generation stored in `checkpoint_file`, instead of starting a new one. The hands
+        that are already in it aren't analysed again.
+    :param weighted_compositions: Whether to test each hand in a few representative shoes with the true count, weighted
+        by their exact probabilities, instead of random shoes. Needs fewer shoes, and the results are the same in every
+        run.
+    :param fresh: Whether to delete the results that are already in `checkpoint_file` and start a new generation. If
+        neither `resume` nor `fresh` is set, the file must not have the results of an unfinished generation.
+    :return: The three strategy tables (for hard totals, soft totals, and pair splitting) of each true count.
+    """
+    tables = generate_strategy_tables(true_counts, effort, cores, number_of_decks, deck_penetration,
+                                      dealer_peeks_for_blackjack, das, dealer_stands_soft_17, can_surrender, cache_file,
+                                      infinite_deck, checkpoint_file, resume, weighted_compositions, fresh)
+    if filename:
+        for true_count in true_counts:
+            export_tables(true_count_filename(filename, true_count), *tables[true_count])
+    return {true_count: tables[true_count] for true_count in true_counts}
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(prog='Basic Strategy Generation',
                                      description='Create highly customized basic strategy tables based on specific '
@@ -720,9 +983,13 @@ if __name__ == "__main__":
                         help='How many cores to use in the calculation. (default: 1, use -1 for all cores)')
     parser.add_argument("-f", "--filename", help='Where to save the basic strategy generated. Leave empty '
                                                  'to not save. (default: don\'t save)')
-    parser.add_argument("-tc", "--true-count", help='Generate deviations from basic strategy for a specific'
-                                                    ' true count. Leave empty to generate basic strategy. '
-                                                    '(default: generate basic strategy)')
+    parser.add_argument("-tc", "--true-count", type=int, help='Generate deviations from basic strategy for a specific'
+                                                              ' true count. Leave empty to generate basic strategy. '
+                                                              '(default: generate basic strategy)')
+    parser.add_argument("--true-count-range",
+                        help='Generate deviations from basic strategy for every true count in a range, in one run '
+                             '(e.g. -10:10). Each true count is saved to its own file, with the true count added to '
+                             'the filename. (default: generate for one true count)')
     parser.add_argument("--decks", default=6, type=int, help='How many decks the shoe starts with. (default: 6)')
     parser.add_argument("--deck-penetration", default=.25, type=float, help='When to reshuffle the shoe. '
                                                                             'Reshuffles when cards remaining < starting cards'
@@ -735,8 +1002,40 @@ if __name__ == "__main__":
     parser.add_argument("--no-peek", action='store_true', help="Dealer doesn't peek for blackjack. (default: false)")
     parser.add_argument("--surrender", action='store_true', help='Allow surrendering. (default: true)')
     parser.add_argument("--no-surrender", action='store_true', help='Don\'t allow surrendering. (default: false)')
+    parser.add_argument("--cache-file", help='A file to store the results in, so later runs can reuse them. '
+                                             '(default: don\'t store)')
+    parser.add_argument("--stats", action='store_true', help='Print how the caches were used by each worker. '
+                                                             '(default: false)')
+    parser.add_argument("--infinite-deck", action='store_true',
+                        help='Draw every card with the probabilities of the shoe, instead of removing the cards that are '
+                             'drawn. Much faster, but approximate. (default: false)')
+    parser.add_argument("--cache-mb", type=float,
+                        help='How much memory the caches of the best move analysis can take in each process, in '
+                             'megabytes. (default: no limit on memory, only on the number of results)')
+    parser.add_argument("--compact-cache", action='store_true',
+                        help='Store the cached results as 32-bit floats, which take less memory but are only accurate '
+                             'to about 7 significant digits. Only used with --cache-mb. (default: false)')
+    parser.add_argument("--checkpoint", default="basic_strategy_checkpoint.db",
+                        help='A file to store the results of each hand in as soon as they are ready, so an interrupted '
+                             'run can be resumed. (default: basic_strategy_checkpoint.db)')
+    parser.add_argument("--weighted-compositions", action='store_true',
+                        help='Test each hand in a few representative shoes with the true count, weighted by their exact '
+                             'probabilities, instead of random shoes. Faster, and the same in every run. '
+                             '(default: false)')
+    checkpoint_mode = parser.add_mutually_exclusive_group()
+    checkpoint_mode.add_argument("--resume", action='store_true',
+                                 help='Continue the run stored in the checkpoint, instead of starting a new one. The '
+                                      'hands that are already in it aren\'t analysed again. (default: false)')
+    checkpoint_mode.add_argument("--fresh", action='store_true',
+                                 help='Delete the results stored in the checkpoint and start a new run. Without --resume '
+                                      'or --fresh, a finished run in the checkpoint is replaced, but an interrupted one '
+                                      'stops the new run. (default: false)')
     args = parser.parse_args()
 
+    if args.stats:
+        cache_stats.enable_stats()
+    set_cache_budget(args.cache_mb, args.compact_cache)
+
     stand_soft_17 = args.stand17 or (not args.hit17)
     das_allowed = args.das or (not args.no_das)
     peek_for_bj = args.peek or (not args.no_peek)
@@ -744,5 +1043,14 @@ if __name__ == "__main__":
 
     cores_used = args.cores if args.cores != -1 else multiprocessing.cpu_count()
 
-    draw_and_export_tables(args.effort, cores_used, args.filename, args.true_count, args.decks, args.deck_penetration,
-                           peek_for_bj, das_allowed, stand_soft_17, surrender_allowed, True)
+    if args.true_count_range:
+        lowest_count, highest_count = map(int, args.true_count_range.split(":"))
+        draw_and_export_deviations(range(lowest_count, highest_count + 1), args.effort, cores_used, args.filename,
+                                   args.decks, args.deck_penetration, peek_for_bj, das_allowed, stand_soft_17,
+                                   surrender_allowed, args.cache_file, args.infinite_deck, args.checkpoint, args.resume,
+                                   args.weighted_compositions, args.fresh)
+    else:
+        draw_and_export_tables(args.effort, cores_used, args.filename, args.true_count, args.decks,
+                               args.deck_penetration, peek_for_bj, das_allowed, stand_soft_17, surrender_allowed, True,
+                               args.cache_file, args.infinite_deck, args.checkpoint, args.resume,
+                               args.weighted_compositions, args.fresh)
@@ -1,8 +1,23 @@
 """Calculate the best move to play by taking into account all available information."""
-from functools import lru_cache
-from utils import DECK
-from typing import Iterable
-import matplotlib.pyplot as plt
+from __future__ import annotations
+from contextlib import nullcontext
+from functools import lru_cache, partial, wraps
+from utils import DECK, RuleSet, ShoeCounts, readable_number
+from result_store import PrecomputedTable, ResultStore, result_key, table_hands, write_precomputed_table
+from shared_cache import SharedResultTable, shared_table_for
+from cache_stats import (ENTRY_OVERHEAD, CacheStats, deep_size, enable_stats, format_cache_stats, get_cache_stats,
+                         stats_enabled, timed)
+from budget_cache import budget_cache, cache_budget, entries_within_budget, set_cache_budget
+from typing import Any, Callable, Iterable, Iterator, NamedTuple, Sequence, TextIO, cast
+import csv
+import itertools
+import json
+import os
+import sys
+import time
+import numpy as np
+import numpy.typing as npt
+import multiprocessing.util
 import argparse
 
 
@@ -46,44 +61,53 @@ def tuple_sort(cards: Iterable[int]) -> tuple[int, ...]:
     """
     Sort a tuple. Used to increase cache hits.
 
-    :param cards: The cards in the shoe.
-    :return: The shoe with its cards sorted.
+    :param cards: The cards in the hand.
+    :return: The hand with its cards sorted.
     """
     return tuple(sorted(cards))
 
 
-def probabilities_if_dealer_peeks_for_blackjack(counts: dict[int, int], dealer_up_card: int) -> dict[int, float]:
+def remove_card(counts: tuple[int, ...], card: int) -> tuple[int, ...]:
+    """
+    Remove a card from the shoe.
+
+    :param counts: How many times each card is in the shoe. (e.g. (24, 24, 24, ..., 96, 24))
+    :param card: The card to remove.
+    :return: The counts of the shoe without this card.
+    """
+    counts_copy = list(counts)
+    counts_copy[card - 2] -= 1
+    return tuple(counts_copy)
+
+
+def probabilities_if_dealer_peeks_for_blackjack(counts: tuple[int, ...], dealer_up_card: int) -> tuple[float, ...]:
     """
     Account for the fact that if the dealer has an ace and doesn't have blackjack, then we know they don't have a 10.
 
     As such, our chances of getting a 10 are slightly higher and out chances of getting any other card are slightly lower.
     Similarly, if the dealer has a 10 and doesn't have blackjack, then we know they don't have an ace.
 
-    :param counts: How many times each card is in the deck. (e.g. {2: 12, 3: 11, 4: 15, ...})
+    :param counts: How many times each card is in the shoe. (e.g. (24, 24, 24, ..., 96, 24))
     :param dealer_up_card: The dealer's up card.
     :return: The probabilities of getting each card if the dealer peeks for blackjack.
     """
-    amount_of_cards_not_seen = sum(counts.values())
-    counts_no_blackjacks = {k: counts[k] for k in range(2, 12) if k + dealer_up_card != 21}
-    amount_of_cards_not_seen_no_blackjack = sum(counts_no_blackjacks.values())
-    probabilities_no_blackjack = {k: counts_no_blackjacks[k] / amount_of_cards_not_seen_no_blackjack for k in
-                                  range(2, 12) if k + dealer_up_card != 21}
-    new_probabilities = {k: 0. for k in range(2, 12)}
+    amount_of_cards_not_seen = sum(counts)
+    amount_of_cards_not_seen_no_blackjack = sum(counts[k - 2] for k in range(2, 12) if k + dealer_up_card != 21)
+    new_probabilities = [0.] * 10
     for possible_dealer_down_card in range(2, 12):
         if possible_dealer_down_card + dealer_up_card == 21:
             continue
-        counts_after_down_card = counts.copy()
-        counts_after_down_card[possible_dealer_down_card] -= 1
+        probability_down_card = counts[possible_dealer_down_card - 2] / amount_of_cards_not_seen_no_blackjack
+        counts_after_down_card = remove_card(counts, possible_dealer_down_card)
         amount_of_cards_not_seen_after_down_card = amount_of_cards_not_seen - 1
-        probabilities_after_down_card = {k: counts_after_down_card[k] / amount_of_cards_not_seen_after_down_card for k
-                                         in range(2, 12)}
         for k in range(2, 12):
-            new_probabilities[k] += probabilities_after_down_card.get(k, 0) * probabilities_no_blackjack[
-                possible_dealer_down_card]
-    return new_probabilities
+            new_probabilities[k - 2] += (counts_after_down_card[k - 2] / amount_of_cards_not_seen_after_down_card
+                                         * probability_down_card)
+    return tuple(new_probabilities)
 
 
 @lru_cache(maxsize=100_000)
+@timed
 def can_never_split(cards: tuple[int, ...]) -> bool:
     """
     Get if the player can't split.
@@ -109,114 +133,541 @@ def argmax(*profits: float) -> tuple[float, str]:
     return 0., ""
 
 
-def dict_to_tuple(counts: dict[int, int]) -> tuple[int, ...]:
+def counts_not_seen(cards_not_seen: Iterable[int] | ShoeCounts) -> tuple[int, ...]:
     """
-    Convert the dict of the counts of every card to a tuple, so it can be used with @cache.
+    Get the counts of the shoe from either of the two forms the public functions accept.
 
-    :param counts: How many times each card is in the deck. (e.g. {2: 12, 3: 11, 4: 15, ...})
-    :return: A tuple containing the number of times each card is in the shoe, but the keys are now the indices.
-        (e.g. {2: 12, 3: 11, 4: 15, ...} becomes (0, 0, 12, 11, 15, ...))
+    :param cards_not_seen: The cards the player hasn't already seen, either as the cards in the shoe
+        (e.g. [2, 10, 11, 10, ...]) or as the number of cards of each rank (`ShoeCounts`).
+    :return: How many times each card is in the shoe. (e.g. (24, 24, 24, ..., 96, 24))
     """
-    return (0, 0) + tuple([counts[k] for k in range(2, 12)])
+    if isinstance(cards_not_seen, ShoeCounts):
+        return tuple(cards_not_seen)
+    return tuple(ShoeCounts.from_cards(cards_not_seen))
 
 
-@lru_cache(maxsize=100_000)
-def create_deck_from_counts(counts: tuple[int, ...]) -> tuple[int, ...]:
+"""Shoes with fewer cards than this are never put into buckets by `bucket_counts`."""
+BUCKETING_MIN_CARDS: int = 104
+
+
+def bucket_counts(counts: tuple[int, ...], bucket_size: int) -> tuple[int, ...]:
     """
-    Create a deck from the counts of every card.
+    Round the number of cards of each rank to the nearest multiple of `bucket_size`, so that deep shoes that differ by
+    a few cards share the same dealer probabilities.
+
+    The shoes the dealer draws from only differ by the few cards the player drew, so almost all of them fall into the
+    same bucket. Shoes with fewer than `BUCKETING_MIN_CARDS` cards are left as they are, because every card changes
+    them more.
 
-    :param counts: How many times each card is in the deck. (e.g. (0, 0, 12, 11, 15, ...))
-    :return: A shoe with these cards.
+    :param counts: How many cards of each rank there are in the shoe.
+    :param bucket_size: The size of the buckets. 1 keeps the counts exact.
+    :return: The rounded counts.
     """
-    # Use with `dict_to_tuple` to use `@cache`.
-    deck = []
-    for card in range(2, 12):
-        deck += [card] * counts[card]
-    return tuple(deck)
+    if bucket_size <= 1 or sum(counts) < BUCKETING_MIN_CARDS:
+        return counts
+    return tuple((count + bucket_size // 2) // bucket_size * bucket_size for count in counts)
+
 
+"""The final results of the dealer's hand, in the order used by `dealer_probabilities`."""
+DEALER_OUTCOMES: tuple[str, ...] = ("17", "18", "19", "20", "21", "bust", "blackjack")
 
-def create_deck_from_counts_cache(counts: dict[int, int]) -> tuple[int, ...]:
+
+@budget_cache(maxsize=100_000, share=.1)
+@timed
+def card_probabilities(counts: tuple[int, ...], dealer_up_card: int,
+                       dealer_peeks_for_blackjack: bool) -> tuple[float, ...]:
     """
-    Create a deck from the counts of every card.
+    Get the probabilities of the player getting each card.
+
+    If the dealer peeks for blackjack and has a 10 or an ace, then the probabilities are conditioned on the dealer's
+    down card not giving them a blackjack.
 
-    :param counts: How many times each card is in the deck. (e.g. {2: 12, 3: 11, 4: 15, ...})
-    :return: A shoe with these cards.
+    :param counts: How many times each card is in the shoe. (e.g. (24, 24, 24, ..., 96, 24))
+    :param dealer_up_card: The dealer's up card.
+    :param dealer_peeks_for_blackjack: Whether the dealer peeks for blackjack.
+    :return: The probability of getting each card (2 to 11, in that order).
     """
-    return create_deck_from_counts(dict_to_tuple(counts))
+    if dealer_up_card in (10, 11) and dealer_peeks_for_blackjack:
+        return probabilities_if_dealer_peeks_for_blackjack(counts, dealer_up_card)
+    amount_of_cards_not_seen = sum(counts)
+    return tuple(count / amount_of_cards_not_seen for count in counts)
 
 
-@lru_cache(maxsize=1_000_000)
-def chances_of_beating_dealer(hand_value: int, dealer_value: int, dealer_has_ace: bool, counts: tuple[int, ...],
-                              dealer_more_than_1_card: bool, dealer_peeks_for_blackjack: bool,
-                              dealer_stands_soft_17: bool) -> float:
+@lru_cache(maxsize=2)
+def dealer_transitions(dealer_stands_soft_17: bool) -> dict[tuple[int, bool], list[tuple[int, int, int, bool]]]:
     """
-    Assumes that if the player got 21, it wasn't a blackjack. If it was a blackjack, then we don't call this function.
+    Get what happens to every hand of the dealer after drawing each card.
 
-    If dealer_peeks_for_blackjack is true, then the dealer can't have blackjack.
+    :param dealer_stands_soft_17: Whether the dealer stands on soft 17.
+    :return: For each hand value and whether the hand has an ace counted as 11, a list with the card drawn, the index
+        of the final result in `DEALER_OUTCOMES` (-1 if the dealer keeps drawing), and the new hand value and ace.
+        Blackjacks aren't considered.
+    """
+    transitions = {}
+    for dealer_value in range(2, 22):
+        for dealer_has_ace in (False, True):
+            card_transitions = []
+            for card in range(2, 12):
+                dealer = HandDealer(dealer_value + card, dealer_has_ace + (card == 11))
+                if dealer.value < 17 or dealer.value == 17 and dealer.aces > 0 and not dealer_stands_soft_17:
+                    card_transitions.append((card, -1, dealer.value, dealer.aces > 0))
+                elif dealer.value > 21:
+                    card_transitions.append((card, 5, dealer.value, False))
+                else:
+                    card_transitions.append((card, dealer.value - 17, dealer.value, False))
+            transitions[(dealer_value, dealer_has_ace)] = card_transitions
+    return transitions
+
+
+"""The final result probabilities of every dealer hand after the first draw, for each soft 17 rule. A hand is
+identified by its value, whether it has an ace counted as 11, and the cards left in the shoe."""
+dealer_hand_probabilities: dict[bool, dict[tuple[int, bool, tuple[int, ...]], tuple[float, ...]]] = {
+    True: {}, False: {}}
+DEALER_HANDS_MAXSIZE = 1_000_000
+DEALER_HANDS_SHARE = .4  # The share of the memory budget (see `budget_cache.set_cache_budget`).
+DEALER_HAND_BYTES = deep_size(((17, False, (24,) * 10), (.1,) * 7)) + ENTRY_OVERHEAD
+
+
+@budget_cache(maxsize=100_000, share=.1)
+@timed
+def dealer_final_probabilities(dealer_up_card: int, counts: tuple[int, ...], dealer_peeks_for_blackjack: bool,
+                               dealer_stands_soft_17: bool) -> tuple[float, ...]:
+    """
+    Get the probabilities of each final result of the dealer's hand without recursion.
 
-    :param hand_value: The player's final hand value.
-    :param dealer_value: The dealer's hand value at the moment.
-    :param dealer_has_ace: Whether the dealer has an ace that is counted as 11.
-    :param counts: How many times each card is in the deck. (e.g. (0, 0, 12, 11, 15, ...))
-    :param dealer_more_than_1_card: Whether the dealer has more than 1 card (not including the down card).
+    The dealer's hands that haven't been evaluated before are found one card at a time (breadth-first), so hands
+    that are reached by drawing the same cards in a different order are only visited once. They are then evaluated
+    from the last card drawn back to the first, and kept in `dealer_hand_probabilities` for the next shoes.
+
+    :param dealer_up_card: The dealer's up card.
+    :param counts: How many times each card is in the shoe. (e.g. (24, 24, 24, ..., 96, 24))
+    :param dealer_peeks_for_blackjack: Whether the dealer peeks for blackjack.
+    :param dealer_stands_soft_17: Whether the dealer stands on soft 17.
+    :return: The probabilities of each result in `DEALER_OUTCOMES`.
+    """
+    hand_probabilities = dealer_hand_probabilities[dealer_stands_soft_17]
+    if len(hand_probabilities) > entries_within_budget(DEALER_HANDS_SHARE, DEALER_HAND_BYTES, DEALER_HANDS_MAXSIZE):
+        hand_probabilities.clear()
+    transitions = dealer_transitions(dealer_stands_soft_17)
+
+    up_card_hand = (dealer_up_card, dealer_up_card == 11, counts)
+    layers = [{up_card_hand}]
+    while layers[-1]:
+        next_layer = set()
+        for dealer_value, dealer_has_ace, shoe in layers[-1]:
+            for card, outcome, value, has_ace in transitions[(dealer_value, dealer_has_ace)]:
+                if outcome == -1 and shoe[card - 2]:
+                    hand = (value, has_ace, remove_card(shoe, card))
+                    if hand not in hand_probabilities:
+                        next_layer.add(hand)
+        layers.append(next_layer)
+
+    blackjack_card = 21 - dealer_up_card if dealer_up_card >= 10 else 0
+    outcome_probabilities = [0.] * 7
+    for layer in reversed(layers[:-1]):
+        for hand in layer:
+            dealer_value, dealer_has_ace, shoe = hand
+            is_up_card = hand is up_card_hand
+            amount_of_cards_not_seen = sum(shoe)
+            if is_up_card and dealer_peeks_for_blackjack and blackjack_card:
+                # We use the probabilities of the card occurring without the one that would have caused the blackjack.
+                amount_of_cards_not_seen -= shoe[blackjack_card - 2]
+            outcome_probabilities = [0.] * 7
+            for card, outcome, value, has_ace in transitions[(dealer_value, dealer_has_ace)]:
+                count = shoe[card - 2]
+                if count == 0 or is_up_card and dealer_peeks_for_blackjack and card == blackjack_card:
+                    continue
+                probability = count / amount_of_cards_not_seen
+                if outcome == -1:
+                    next_probabilities = hand_probabilities[(value, has_ace, remove_card(shoe, card))]
+                    for index in range(7):
+                        outcome_probabilities[index] += next_probabilities[index] * probability
+                elif is_up_card and card == blackjack_card:
+                    outcome_probabilities[6] += probability
+                else:
+                    outcome_probabilities[outcome] += probability
+            if not is_up_card:  # The up card can get blackjack, unlike the hands after it, so it isn't reused.
+                hand_probabilities[hand] = tuple(outcome_probabilities)
+    return tuple(outcome_probabilities)
+
+
+"""Dealer probabilities calculated in advance by `prime_dealer_probabilities` for the shoes of the current batch."""
+primed_dealer_probabilities: dict[tuple[int, tuple[int, ...], bool, bool], tuple[float, ...]] = {}
+
+
+def dealer_probabilities(dealer_up_card: int, counts: tuple[int, ...], dealer_peeks_for_blackjack: bool,
+                         dealer_stands_soft_17: bool, bucket_size: int = 1) -> tuple[float, ...]:
+    """
+    Get the probabilities of each final result of the dealer's hand. Independent of the player's hand.
+
+    :param dealer_up_card: The dealer's up card.
+    :param counts: How many times each card is in the shoe. (e.g. (24, 24, 24, ..., 96, 24))
+    :param dealer_peeks_for_blackjack: Whether the dealer peeks for blackjack.
+    :param dealer_stands_soft_17: Whether the dealer stands on soft 17.
+    :param bucket_size: Round the shoe to buckets of this size first (see `bucket_counts`). 1 gives exact results.
+    :return: The probabilities of each result in `DEALER_OUTCOMES`.
+    """
+    if bucket_size > 1:
+        counts = bucket_counts(counts, bucket_size)
+    primed = primed_dealer_probabilities.get((dealer_up_card, counts, dealer_peeks_for_blackjack, dealer_stands_soft_17))
+    if primed is not None:
+        return primed
+    return dealer_final_probabilities(dealer_up_card, counts, dealer_peeks_for_blackjack, dealer_stands_soft_17)
+
+
+def dealer_probabilities_batch(dealer_up_card: int, counts: npt.ArrayLike, dealer_peeks_for_blackjack: bool,
+                               dealer_stands_soft_17: bool) -> npt.NDArray[np.float64]:
+    """
+    Get the probabilities of each final result of the dealer's hand for many shoes at once.
+
+    The dealer's draws are the same for every shoe, so each state of the dealer's hand is visited once and the
+    probabilities of all the shoes are updated together. States that are reached by drawing the same cards in a
+    different order are merged.
+
+    :param dealer_up_card: The dealer's up card.
+    :param counts: How many times each card is in each shoe. An array with shape (number of shoes, 10).
+    :param dealer_peeks_for_blackjack: Whether the dealer peeks for blackjack.
+    :param dealer_stands_soft_17: Whether the dealer stands on soft 17.
+    :return: The probabilities of each result in `DEALER_OUTCOMES` for each shoe. An array with shape
+        (number of shoes, 7).
+    """
+    shoe_counts = np.asarray(counts, dtype=np.int64).reshape(-1, 10)
+    outcome_probabilities = np.zeros((shoe_counts.shape[0], 7))
+    # The state of the dealer's hand is the cards drawn after the up card, their value,
+    # and whether an ace is counted as 11.
+    states: dict[tuple[tuple[int, ...], int, bool], npt.NDArray[np.float64]] = {
+        ((0,) * 10, dealer_up_card, dealer_up_card == 11): np.ones(shoe_counts.shape[0])}
+    while states:
+        next_states: dict[tuple[tuple[int, ...], int, bool], npt.NDArray[np.float64]] = {}
+        for (drawn, dealer_value, dealer_has_ace), state_probability in states.items():
+            dealer_more_than_1_card = any(drawn)
+            remaining = np.maximum(shoe_counts - np.array(drawn), 0).astype(np.float64)
+            if not dealer_more_than_1_card and dealer_peeks_for_blackjack and dealer_up_card in (10, 11):
+                remaining[:, 21 - dealer_up_card - 2] = 0
+            total = remaining.sum(axis=1, keepdims=True)
+            probabilities = np.divide(remaining, total, out=np.zeros_like(remaining), where=total > 0)
+            probabilities *= state_probability[:, np.newaxis]
+            for card in range(2, 12):
+                probability = probabilities[:, card - 2]
+                if not probability.any():
+                    continue
+                dealer = HandDealer(dealer_value + card, dealer_has_ace + (card == 11))
+                if dealer.value < 17 or dealer.value == 17 and dealer.aces > 0 and not dealer_stands_soft_17:
+                    next_drawn = list(drawn)
+                    next_drawn[card - 2] += 1
+                    next_state = (tuple(next_drawn), dealer.value, dealer.aces > 0)
+                    if next_state in next_states:
+                        next_states[next_state] += probability
+                    else:
+                        next_states[next_state] = probability.copy()
+                elif dealer.value > 21:
+                    outcome_probabilities[:, 5] += probability
+                elif dealer.value == 21 and not dealer_more_than_1_card:
+                    outcome_probabilities[:, 6] += probability
+                else:
+                    outcome_probabilities[:, dealer.value - 17] += probability
+        states = next_states
+    return outcome_probabilities
+
+
+def prime_dealer_probabilities(dealer_up_card: int, counts: Iterable[tuple[int, ...]], dealer_peeks_for_blackjack: bool,
+                               dealer_stands_soft_17: bool) -> None:
+    """
+    Calculate the dealer probabilities of many shoes with `dealer_probabilities_batch`,
+    so that `dealer_probabilities` can use them.
+
+    Replaces the probabilities primed before.
+
+    :param dealer_up_card: The dealer's up card.
+    :param counts: The counts of every shoe to calculate the probabilities for.
     :param dealer_peeks_for_blackjack: Whether the dealer peeks for blackjack.
     :param dealer_stands_soft_17: Whether the dealer stands on soft 17.
-    :return: The chances of beating the dealer.
+    """
+    primed_dealer_probabilities.clear()
+    all_counts = list(counts)
+    if not all_counts:
+        return
+    probabilities = dealer_probabilities_batch(dealer_up_card, all_counts, dealer_peeks_for_blackjack,
+                                               dealer_stands_soft_17)
+    for shoe_counts, shoe_probabilities in zip(all_counts, probabilities.tolist()):
+        primed_dealer_probabilities[(dealer_up_card, shoe_counts, dealer_peeks_for_blackjack,
+                                     dealer_stands_soft_17)] = tuple(shoe_probabilities)
+
+
+def reachable_counts(cards: tuple[int, ...], counts: tuple[int, ...]) -> set[tuple[int, ...]]:
+    """
+    Get the counts of every shoe the player can face by standing, doubling or hitting (but not splitting).
+
+    :param cards: The cards in the player's hand.
+    :param counts: How many times each card is in the shoe. (e.g. (24, 24, 24, ..., 96, 24))
+    :return: The counts of the shoe after every combination of cards the player can draw without busting
+        (and after the card drawn when doubling).
+    """
+    after_double = {remove_card(counts, card) for card in range(2, 12) if counts[card - 2]}
+    # The counts of the shoe also tell us which cards the player has drawn, so they identify the hand.
+    after_hits: set[tuple[int, ...]] = set()
+    hand = HandPlayer(cards)
+    hands = [(hand.value, hand.aces, counts)]
+    while hands:
+        hand_value, hand_aces, hand_counts = hands.pop()
+        if hand_counts in after_hits:
+            continue
+        after_hits.add(hand_counts)
+        for card in range(2, 12):
+            if hand_counts[card - 2] == 0:
+                continue
+            value = hand_value + card
+            aces = hand_aces + (card == 11)
+            while value > 21 and aces > 0:
+                value -= 10
+                aces -= 1
+            if value <= 21:
+                hands.append((value, aces, remove_card(hand_counts, card)))
+    return after_hits | after_double
+
+
+def split_reachable_counts(split_card: int, counts: tuple[int, ...]) -> set[tuple[int, ...]]:
+    """
+    Get the counts of every shoe the hands created by splitting can face (see `split_hands_profit`).
+
+    :param split_card: The card that was split.
+    :param counts: How many times each card is in the shoe. (e.g. (24, 24, 24, ..., 96, 24))
+    :return: The counts of the shoe after every combination of cards the split hands can draw without busting.
+    """
+    needed_counts = set()
+    for card in range(2, 12):
+        if counts[card - 2] == 0:
+            continue
+        first_hand_counts = remove_card(counts, card)
+        for hand_card, hand_counts in [(card, first_hand_counts)] + [
+                (card2, remove_card(first_hand_counts, card2)) for card2 in range(2, 12) if first_hand_counts[card2 - 2]]:
+            if split_card == 11:
+                needed_counts.add(hand_counts)  # Split aces only get one card.
+            else:
+                needed_counts |= reachable_counts((split_card, hand_card), hand_counts)
+    return needed_counts
+
+
+@lru_cache(maxsize=100)
+@timed
+def stand_payoffs(hand_value: int) -> tuple[float, ...]:
+    """
+    Get how much the player wins by standing against each final result of the dealer's hand.
+
+    Assumes that if the player got 21, it wasn't a blackjack.
+
+    :param hand_value: The player's final hand value.
+    :return: The profit against each result in `DEALER_OUTCOMES`.
     """
     if hand_value > 21:
-        return 0
-    ignore_blackjacks = not dealer_more_than_1_card and dealer_peeks_for_blackjack
-    if ignore_blackjacks:
-        counts_no_blackjacks = {k: counts[k] for k in range(2, 12) if k + dealer_value != 21}
-        amount_of_cards_not_seen_no_blackjack = sum(counts_no_blackjacks.values())
-        probabilities = {k: (counts_no_blackjacks[k] / amount_of_cards_not_seen_no_blackjack if k + dealer_value != 21 else 0)
-                         for k in range(2, 12)}
-    else:
-        amount_of_cards_not_seen = sum(counts)
-        probabilities = {k: counts[k] / amount_of_cards_not_seen for k in range(2, 12)}
+        return (-1.,) * 7
+    payoffs = [float((hand_value > dealer_value) - (hand_value < dealer_value)) for dealer_value in range(17, 22)]
+    return tuple(payoffs) + (1., -1.)
+
+
+def profit_from_standing(hand_value: int, outcome_probabilities: tuple[float, ...]) -> float:
+    """
+    Get the expected return of standing.
+
+    :param hand_value: The player's final hand value.
+    :param outcome_probabilities: The probabilities of each result in `DEALER_OUTCOMES`.
+    :return: The expected return of standing.
+    """
+    return sum(payoff * probability for payoff, probability in zip(stand_payoffs(hand_value), outcome_probabilities))
+
+
+shared_table: SharedResultTable | None = None
+
+
+def use_shared_table(table: SharedResultTable | None) -> None:
+    """
+    Share the results of `perfect_mover` with the other processes that use the same table.
+
+    :param table: The table to read and publish results to. If it is None, the results aren't shared.
+    """
+    global shared_table
+    shared_table = table
+
+
+def share_results(function: Callable[..., tuple[float, ...]]) -> Callable[..., tuple[float, ...]]:
+    """
+    Look up the results of `function` in the shared table before calculating them, and publish them after.
+
+    :param function: The function whose results to share.
+    :return: The function that uses the shared table.
+    """
+    @wraps(function)
+    def shared_function(*arguments: object) -> tuple[float, ...]:
+        if shared_table is None:
+            return function(*arguments)
+        profits = shared_table.get(arguments)
+        if profits is None:
+            profits = function(*arguments)
+            shared_table.put(arguments, profits)
+        return profits
+    return shared_function
+
+
+"""The expected returns of the branches of a position, calculated by the worker processes of `parallel_perfect_mover`."""
+primed_branch_profits: dict[tuple[Any, ...], float] = {}
+
+
+def best_hand_profit(cards: tuple[int, ...], dealer_up_card: int, counts: tuple[int, ...], can_double: bool,
+                     max_splits: int, rules: int, bucket_size: int = 1) -> float:
+    """
+    Get the best expected return of a hand that is played after the first action (after hitting or splitting).
+
+    Insurance and surrendering aren't available anymore, so they are never considered.
+
+    :param cards: The cards in the player's hand.
+    :param dealer_up_card: The dealer's up card.
+    :param counts: How many times each card is in the shoe. (e.g. (24, 24, 24, ..., 96, 24))
+    :param can_double: Whether the player can double.
+    :param max_splits: How many times the player can split their hand.
+    :param rules: The rules of the game (`RuleSet.analysis_code`).
+    :param bucket_size: The size of the buckets of the dealer's shoes (see `bucket_counts`). 1 gives exact results.
+    :return: The best expected return.
+    """
+    if can_never_split(cards):
+        max_splits = 0
+    if len(cards) > 2:
+        can_double = False
+    profits = perfect_mover(tuple_sort(cards), dealer_up_card, counts, can_double, False, False, max_splits, rules,
+                            bucket_size, True)  # Only the best expected return is needed.
+    return max(profits[:5])
+
+
+def hit_card_profit(cards: tuple[int, ...], dealer_up_card: int, counts: tuple[int, ...], card: int, can_double: bool,
+                    max_splits: int, rules: int, bucket_size: int = 1) -> float:
+    """
+    Get the expected return of hitting, when the player draws a card.
+
+    :param cards: The cards in the player's hand.
+    :param dealer_up_card: The dealer's up card.
+    :param counts: How many times each card is in the shoe, before the card is drawn.
+    :param card: The card the player draws.
+    :param can_double: Whether the player could double before hitting.
+    :param max_splits: How many times the player can split their hand.
+    :param rules: The rules of the game (`RuleSet.analysis_code`).
+    :param bucket_size: The size of the buckets of the dealer's shoes (see `bucket_counts`). 1 gives exact results.
+    :return: The best expected return of the hand after drawing the card, or -1 if it busts.
+    """
+    if primed_branch_profits:
+        primed = primed_branch_profits.get(("hit", cards, dealer_up_card, counts, card, can_double, max_splits, rules,
+                                            bucket_size))
+        if primed is not None:
+            return primed
+    hand = HandPlayer(cards + (card,))
+    if hand.value > 21:
+        return -1.
+    return best_hand_profit(hand.cards, dealer_up_card, remove_card(counts, card), can_double, max_splits, rules,
+                            bucket_size)
+
+
+@budget_cache(maxsize=100_000, share=.05)
+@timed
+def split_hands_profit(split_card: int, dealer_up_card: int, counts: tuple[int, ...], hands: int, splits_left: int,
+                       first_hand: bool, can_double: bool, rules: int, bucket_size: int = 1) -> float:
+    """
+    Get the expected return of the hands created by splitting, that are still waiting for their second card.
 
-    beat_probability = 0.
+    The hands are dealt their second card one at a time. If a hand gets the split card again and the player can still
+    split, the player chooses between playing the pair and splitting it into two more waiting hands, so the player can
+    end up with up to `splits_left + hands` hands. Every hand is played with the second card of the first hand
+    removed from the shoe, as well as its own second card. The cards drawn by the other hands are ignored, so the
+    expected returns of the hands are reused for any number of splits. Split aces only get one card each.
+
+    :param split_card: The card that was split.
+    :param dealer_up_card: The dealer's up card.
+    :param counts: How many times each card is in the shoe. (e.g. (24, 24, 24, ..., 96, 24))
+    :param hands: How many hands are waiting for their second card.
+    :param splits_left: How many more times the player can split.
+    :param first_hand: Whether none of the hands has gotten its second card yet.
+    :param can_double: Whether the player can double after splitting.
+    :param rules: The rules of the game (`RuleSet.analysis_code`).
+    :param bucket_size: The size of the buckets of the dealer's shoes (see `bucket_counts`). 1 gives exact results.
+    :return: The total expected return of the waiting hands.
+    """
+    probabilities = card_probabilities(counts, dealer_up_card, RuleSet.from_code(rules).dealer_peeks_for_blackjack)
+    profit = 0.
     for card in range(2, 12):
-        # In this loop, you probably need to use dealer.property instead of dealer_property.
-        # e.g. dealer.value instead of dealer_value.
-        if probabilities[card] == 0:
+        if counts[card - 2] == 0:
             continue
-        dealer = HandDealer(dealer_value + card, dealer_has_ace + (card == 11))
-        # If dealer_peeks_for_blackjack is true, then we use the probabilities of the card occurring without the one
-        # that would have caused the blackjack.
-        if dealer.value < 17 or dealer.value == 17 and dealer.aces > 0 and not dealer_stands_soft_17:
-            counts_copy = list(counts)
-            counts_copy[card] -= 1
-            beat_probability += (chances_of_beating_dealer(hand_value, dealer.value, dealer.aces > 0,
-                                                           tuple(counts_copy),
-                                                           True, dealer_peeks_for_blackjack,
-                                                           dealer_stands_soft_17) * probabilities[card])
-        else:
-            if hand_value > dealer.value or dealer.value > 21:
-                beat_probability += probabilities[card]
-            elif hand_value == dealer.value and (dealer_more_than_1_card or dealer.value != 21):
-                beat_probability += probabilities[card] * .5
-    return beat_probability
+        profit += split_card_profit(split_card, dealer_up_card, counts, card, hands, splits_left, first_hand, can_double,
+                                    rules, bucket_size) * probabilities[card - 2]
+    return profit
 
 
-@lru_cache(maxsize=100_000)
-def perfect_mover(cards: tuple[int, ...], dealer_up_card: int, cards_not_seen: tuple[int, ...],
+def split_card_profit(split_card: int, dealer_up_card: int, counts: tuple[int, ...], card: int, hands: int,
+                      splits_left: int, first_hand: bool, can_double: bool, rules: int, bucket_size: int = 1) -> float:
+    """
+    Get the expected return of the hands created by splitting, when the next waiting hand gets a card
+    (see `split_hands_profit`).
+
+    :param split_card: The card that was split.
+    :param dealer_up_card: The dealer's up card.
+    :param counts: How many times each card is in the shoe, before the card is drawn.
+    :param card: The second card of the next waiting hand.
+    :param hands: How many hands are waiting for their second card.
+    :param splits_left: How many more times the player can split.
+    :param first_hand: Whether none of the hands has gotten its second card yet.
+    :param can_double: Whether the player can double after splitting.
+    :param rules: The rules of the game (`RuleSet.analysis_code`).
+    :param bucket_size: The size of the buckets of the dealer's shoes (see `bucket_counts`). 1 gives exact results.
+    :return: The total expected return of the waiting hands.
+    """
+    if primed_branch_profits:
+        primed = primed_branch_profits.get(("split", split_card, dealer_up_card, counts, card, hands, splits_left,
+                                            first_hand, can_double, rules, bucket_size))
+        if primed is not None:
+            return primed
+    rule_set = RuleSet.from_code(rules)
+    hand_counts = remove_card(counts, card)
+    next_counts = hand_counts if first_hand else counts
+    if split_card == 11:
+        hand_profit = profit_from_standing(HandPlayer((card, 11)).value,
+                                           dealer_probabilities(dealer_up_card, hand_counts,
+                                                                rule_set.dealer_peeks_for_blackjack,
+                                                                rule_set.dealer_stands_soft_17, bucket_size))
+    else:
+        hand_profit = best_hand_profit((split_card, card), dealer_up_card, hand_counts, can_double, 0, rules,
+                                       bucket_size)
+    if hands > 1:
+        hand_profit += split_hands_profit(split_card, dealer_up_card, next_counts, hands - 1, splits_left, False,
+                                          can_double, rules, bucket_size)
+    if card == split_card and splits_left and (split_card != 11 or rule_set.can_resplit_aces):
+        hand_profit = max(hand_profit, split_hands_profit(split_card, dealer_up_card, next_counts, hands + 1,
+                                                          splits_left - 1, False, can_double, rules, bucket_size))
+    return hand_profit
+
+
+@budget_cache(maxsize=100_000, share=.25)
+@share_results
+@timed
+def perfect_mover(cards: tuple[int, ...], dealer_up_card: int, counts: tuple[int, ...],
                   can_double: bool = True, can_insure: bool = True, can_surrender: bool = True, max_splits: int = 3,
-                  dealer_peeks_for_blackjack: bool = True, das: bool = True, dealer_stands_soft_17: bool = True
-                  ) -> tuple[float, ...]:
+                  rules: int = RuleSet().analysis_code, bucket_size: int = 1, prune: bool = False) -> tuple[float, ...]:
     """
     Get the best move to play by taking into account even the cards that we have already seen.
 
+    The shoe is only ever handled as the number of cards of each rank, and the rules as a small integer,
+    so the cache keys stay small.
+
+    When pruning, doubling and hitting are only analysed while they can still be better than the best action found so
+    far. Every card that doesn't bust the hand can win at most 1 unit (2 units when doubling), so once the expected
+    return of the cards analysed so far plus this bound for the other cards is lower than the best action, the action
+    gets this bound as its expected return instead. The best expected return and action are still exact.
+
     :param cards: The cards in the player's hand.
     :param dealer_up_card: The dealer's up card.
-    :param cards_not_seen: The cards the player hasn't already seen.
+    :param counts: How many times each card is in the shoe. (e.g. (24, 24, 24, ..., 96, 24))
     :param can_double: Whether the player can double.
     :param can_insure: Whether the player can take insurance.
     :param can_surrender: Whether the player can surrender.
     :param max_splits: How many times the player can split their hand.
-    :param dealer_peeks_for_blackjack: Whether the dealer peeks for blackjack.
-    :param das: Whether we can double after splitting.
-    :param dealer_stands_soft_17: Whether the dealer stands on soft 17.
+    :param rules: The rules of the game (`RuleSet.analysis_code`).
+    :param bucket_size: The size of the buckets of the dealer's shoes (see `bucket_counts`). 1 gives exact results.
+    :param prune: Whether to stop analysing the actions that can't be the best. Only the best expected return is exact.
     :return: The expected returns of all 6 possible actions
         (`stand`, `hit`, `double`, `split`, `surrender`, and `insurance`, in that order).
     """
@@ -230,31 +681,15 @@ def perfect_mover(cards: tuple[int, ...], dealer_up_card: int, cards_not_seen: t
     if hand.value > 21:
         return -1., -1000., -1000., -1000., -1000., -1000.
 
-    amount_of_cards_not_seen = len(cards_not_seen)
-    counts = {k: cards_not_seen.count(k) for k in range(2, 12)}
-    probabilities = {k: counts[k] / amount_of_cards_not_seen for k in range(2, 12)}
-    if dealer_up_card in (10, 11) and dealer_peeks_for_blackjack:
-        probabilities = probabilities_if_dealer_peeks_for_blackjack(counts, dealer_up_card)
-
-    stand_profit = chances_of_beating_dealer(hand.value, dealer_up_card, dealer_up_card == 11, dict_to_tuple(counts),
-                                             False, dealer_peeks_for_blackjack,
-                                             dealer_stands_soft_17) * 2 - 1
+    rule_set = RuleSet.from_code(rules)
+    dealer_peeks_for_blackjack = rule_set.dealer_peeks_for_blackjack
+    dealer_stands_soft_17 = rule_set.dealer_stands_soft_17
+    amount_of_cards_not_seen = sum(counts)
+    probabilities = card_probabilities(counts, dealer_up_card, dealer_peeks_for_blackjack)
 
-    # Double
-    if can_double and len(cards) == 2:
-        profit = 0.
-        for card in range(2, 12):
-            if counts[card] == 0:
-                continue
-            hand = HandPlayer(cards + (card,))
-            counts_copy = counts.copy()
-            counts_copy[card] -= 1
-            profit += (chances_of_beating_dealer(hand.value, dealer_up_card, dealer_up_card == 11,
-                                                 dict_to_tuple(counts_copy),
-                                                 False, dealer_peeks_for_blackjack,
-                                                 dealer_stands_soft_17) * 2 - 1
-                       ) * (probabilities[card])
-        double_profit = profit * 2
+    stand_profit = profit_from_standing(hand.value, dealer_probabilities(dealer_up_card, counts,
+                                                                         dealer_peeks_for_blackjack,
+                                                                         dealer_stands_soft_17, bucket_size))
 
     # Surrender
     if len(cards) == 2 and can_surrender:
@@ -264,282 +699,520 @@ def perfect_mover(cards: tuple[int, ...], dealer_up_card: int, cards_not_seen: t
     if dealer_up_card == 11 and len(cards) == 2 and can_insure:
         # We use counts[10] / amount_of_cards_not_seen and not probabilities[10] as we choose whether we want insurance
         # before the dealer checks for blackjack.
-        insurance_profit = (1 * counts[10] / amount_of_cards_not_seen - .5 * (1 - counts[10] / amount_of_cards_not_seen))
+        insurance_profit = (1 * counts[10 - 2] / amount_of_cards_not_seen
+                            - .5 * (1 - counts[10 - 2] / amount_of_cards_not_seen))
+
+    # The most a hand can win after drawing each card: 1 unit if it doesn't bust, and -1 if it busts.
+    bounds = [0.] * 10
+    if prune:
+        for card in range(2, 12):
+            if counts[card - 2]:
+                bounds[card - 2] = (1. if HandPlayer(cards + (card,)).value <= 21 else -1.) * probabilities[card - 2]
+
+    # Double
+    if can_double and len(cards) == 2:
+        if prune and 2 * sum(bounds) < max(stand_profit, surrender_profit):
+            double_profit = 2 * sum(bounds)
+        else:
+            profit = 0.
+            for card in range(2, 12):
+                if counts[card - 2] == 0:
+                    continue
+                hand = HandPlayer(cards + (card,))
+                profit += profit_from_standing(hand.value,
+                                               dealer_probabilities(dealer_up_card, remove_card(counts, card),
+                                                                    dealer_peeks_for_blackjack, dealer_stands_soft_17,
+                                                                    bucket_size)
+                                               ) * (probabilities[card - 2])
+            double_profit = profit * 2
 
     # Hit
+    best_profit = max(stand_profit, double_profit, surrender_profit)
     profit = 0
     for card in range(2, 12):
-        if counts[card] == 0:
+        if counts[card - 2] == 0:
             continue
-        hand = HandPlayer(cards + (card,))
-        if hand.value <= 21:
-            counts_copy = counts.copy()
-            counts_copy[card] -= 1
-            profit += (perfect_mover_cache(hand.cards, dealer_up_card, create_deck_from_counts_cache(counts_copy),
-                                           can_double, False, False, max_splits, dealer_peeks_for_blackjack,
-                                           das, dealer_stands_soft_17)[0]
-                       * (probabilities[card]))
-        else:
-            profit -= 1 * probabilities[card]
+        if prune and profit + sum(bounds[card - 2:]) < best_profit:
+            profit += sum(bounds[card - 2:])  # Hitting can't be the best action, so the other cards aren't analysed.
+            break
+        profit += hit_card_profit(cards, dealer_up_card, counts, card, can_double, max_splits, rules,
+                                  bucket_size) * probabilities[card - 2]
     hit_profit = profit
 
     # Split
     if len(cards) == 2 and cards[0] == cards[1] and max_splits >= 1:
-        max_splits -= 1
+        split_profit = split_hands_profit(cards[0], dealer_up_card, counts, 2, max_splits - 1, True,
+                                          can_double and rule_set.das, rules, bucket_size)
 
-        if cards[0] == 11:
-            profit = 0
-            for card in range(2, 12):
-                if counts[card] == 0:
-                    continue
-                counts_copy = counts.copy()
-                counts_copy[card] -= 1
-                probabilities_copy = {k: counts_copy[k] / (amount_of_cards_not_seen - 1) for k in range(2, 12)}
-                if dealer_up_card in (10, 11) and dealer_peeks_for_blackjack:
-                    probabilities_copy = probabilities_if_dealer_peeks_for_blackjack(counts_copy, dealer_up_card)
-
-                for card2 in range(2, 12):
-                    if counts_copy[card2] == 0:
-                        continue
-                    counts_copy2 = counts_copy.copy()
-                    counts_copy2[card2] -= 1
-                    profit += ((chances_of_beating_dealer(HandPlayer((card, 11)).value, dealer_up_card, dealer_up_card == 11,
-                                                          dict_to_tuple(counts_copy),
-                                                          False, dealer_peeks_for_blackjack,
-                                                          dealer_stands_soft_17) * 2 - 1)
-                               + (chances_of_beating_dealer(HandPlayer((card2, 11)).value, dealer_up_card,
-                                                            dealer_up_card == 11,
-                                                            dict_to_tuple(counts_copy2),
-                                                            False, dealer_peeks_for_blackjack,
-                                                            dealer_stands_soft_17) * 2 - 1)
-                               ) * (probabilities[card] * probabilities_copy[card2])
-            split_profit = profit
+    return stand_profit, hit_profit, double_profit, split_profit, surrender_profit, insurance_profit
+
+
+def dealer_state(dealer_value: int, dealer_has_ace: bool) -> int:
+    """
+    Number the hands of the dealer that keep drawing, for the matrices of `dealer_absorption`.
+
+    :param dealer_value: The value of the dealer's hand (2 to 21).
+    :param dealer_has_ace: Whether the hand has an ace counted as 11.
+    :return: The index of the hand.
+    """
+    return (dealer_value - 2) * 2 + dealer_has_ace
 
+
+@budget_cache(maxsize=1_000, share=.01)
+@timed
+def dealer_absorption(probabilities: tuple[float, ...], dealer_stands_soft_17: bool) -> npt.NDArray[np.float64]:
+    """
+    Get the final result probabilities of every dealer hand, if each card is always drawn with the same probability
+    (an infinite shoe).
+
+    The dealer's draws are an absorbing Markov chain, so the results are found by solving one small linear system
+    (`(I - Q) B = R`) instead of following every sequence of cards.
+
+    :param probabilities: The probability of drawing each card (2 to 11, in that order).
+    :param dealer_stands_soft_17: Whether the dealer stands on soft 17.
+    :return: For each hand (see `dealer_state`), the probabilities of each result in `DEALER_OUTCOMES`.
+        Blackjacks aren't considered.
+    """
+    transient = np.zeros((40, 40))
+    absorbing = np.zeros((40, 7))
+    for (dealer_value, dealer_has_ace), card_transitions in dealer_transitions(dealer_stands_soft_17).items():
+        state = dealer_state(dealer_value, dealer_has_ace)
+        for card, outcome, value, has_ace in card_transitions:
+            if outcome == -1:
+                transient[state, dealer_state(value, has_ace)] += probabilities[card - 2]
+            else:
+                absorbing[state, outcome] += probabilities[card - 2]
+    return cast(npt.NDArray[np.float64], np.linalg.solve(np.eye(40) - transient, absorbing))
+
+
+@budget_cache(maxsize=10_000, share=.02)
+def infinite_deck_dealer_probabilities(dealer_up_card: int, probabilities: tuple[float, ...],
+                                       dealer_peeks_for_blackjack: bool, dealer_stands_soft_17: bool
+                                       ) -> tuple[float, ...]:
+    """
+    Get the probabilities of each final result of the dealer's hand in an infinite shoe.
+
+    :param dealer_up_card: The dealer's up card.
+    :param probabilities: The probability of drawing each card (2 to 11, in that order).
+    :param dealer_peeks_for_blackjack: Whether the dealer peeks for blackjack. If they do, the probabilities are
+        conditioned on the dealer not having blackjack.
+    :param dealer_stands_soft_17: Whether the dealer stands on soft 17.
+    :return: The probabilities of each result in `DEALER_OUTCOMES`.
+    """
+    absorption = dealer_absorption(probabilities, dealer_stands_soft_17)
+    blackjack_card = 21 - dealer_up_card if dealer_up_card >= 10 else 0
+    no_blackjack = 1 - probabilities[blackjack_card - 2] if dealer_peeks_for_blackjack and blackjack_card else 1.
+    outcome_probabilities = np.zeros(7)
+    for card, outcome, value, has_ace in dealer_transitions(dealer_stands_soft_17)[(dealer_up_card, dealer_up_card == 11)]:
+        probability = probabilities[card - 2]
+        if card == blackjack_card:
+            if not dealer_peeks_for_blackjack:
+                outcome_probabilities[6] += probability
+        elif outcome == -1:
+            outcome_probabilities += absorption[dealer_state(value, has_ace)] * probability / no_blackjack
         else:
-            profit = 0
+            outcome_probabilities[outcome] += probability / no_blackjack
+    return tuple(outcome_probabilities.tolist())
+
+
+def player_state(low_value: int, has_ace: bool, card: int) -> tuple[int, bool]:
+    """
+    Get the hand of the player after drawing a card. Hands are kept with every ace counted as 1.
+
+    :param low_value: The value of the hand, with every ace counted as 1.
+    :param has_ace: Whether the hand has an ace.
+    :param card: The card drawn.
+    :return: The value of the new hand with every ace counted as 1, and whether it has an ace.
+    """
+    return low_value + (1 if card == 11 else card), has_ace or card == 11
+
+
+def player_value(low_value: int, has_ace: bool) -> int:
+    """
+    Get the value of a hand of the player.
+
+    :param low_value: The value of the hand, with every ace counted as 1.
+    :param has_ace: Whether the hand has an ace.
+    :return: The value of the hand, with an ace counted as 11 if it doesn't bust the hand.
+    """
+    return low_value + 10 if has_ace and low_value <= 11 else low_value
+
+
+@budget_cache(maxsize=10_000, share=.02)
+@timed
+def infinite_deck_hand_profits(dealer_up_card: int, probabilities: tuple[float, ...], rules: int
+                               ) -> tuple[tuple[float, ...], tuple[float, ...]]:
+    """
+    Get the expected returns of standing and of hitting (and then playing perfectly) for every hand in an infinite shoe.
+
+    The hands only depend on their value and whether they have an ace, so there are 40 of them, and they are solved
+    from the largest to the smallest value, as drawing a card always increases the value with aces counted as 1.
+
+    :param dealer_up_card: The dealer's up card.
+    :param probabilities: The probability of drawing each card (2 to 11, in that order).
+    :param rules: The rules of the game (`RuleSet.analysis_code`).
+    :return: The expected returns of standing and of hitting, at index `low_value * 2 + has_ace`, where `low_value` is
+        the value of the hand with every ace counted as 1 (up to 21).
+    """
+    rule_set = RuleSet.from_code(rules)
+    outcome_probabilities = infinite_deck_dealer_probabilities(dealer_up_card, probabilities,
+                                                               rule_set.dealer_peeks_for_blackjack,
+                                                               rule_set.dealer_stands_soft_17)
+    stand_profits = [-1.] * 44
+    hit_profits = [-1.] * 44
+    best_profits = [-1.] * 44
+    for low_value in range(21, 1, -1):
+        for has_ace in (False, True):
+            state = low_value * 2 + has_ace
+            stand_profits[state] = profit_from_standing(player_value(low_value, has_ace), outcome_probabilities)
+            hit_profit = 0.
             for card in range(2, 12):
-                if counts[card] == 0:
-                    continue
-                counts_copy = counts.copy()
-                counts_copy[card] -= 1
-                probabilities_copy = {k: counts_copy[k] / (amount_of_cards_not_seen - 1) for k in range(2, 12)}
-                if dealer_up_card in (10, 11) and dealer_peeks_for_blackjack:
-                    probabilities_copy = probabilities_if_dealer_peeks_for_blackjack(counts_copy, dealer_up_card)
-
-                if max_splits == 0:
-                    for card2 in range(2, 12):
-                        if counts_copy[card2] == 0:
-                            continue
-                        counts_copy2 = counts_copy.copy()
-                        counts_copy2[card2] -= 1
-
-                        profit += (perfect_mover_cache((cards[0], card), dealer_up_card,
-                                                       create_deck_from_counts_cache(counts_copy),
-                                                       can_double and das,
-                                                       False, False,
-                                                       0, dealer_peeks_for_blackjack, das,
-                                                       dealer_stands_soft_17)[0]
-                                   + perfect_mover_cache((cards[0], card2), dealer_up_card,
-                                                         create_deck_from_counts_cache(counts_copy2),
-                                                         can_double and das,
-                                                         False, False,
-                                                         0, dealer_peeks_for_blackjack, das,
-                                                         dealer_stands_soft_17)[0]
-                                   ) * (probabilities[card] * probabilities_copy[card2])
-
-                elif cards[0] != card:  # Can't split the first hand.
-                    profit += (perfect_mover_cache((cards[0], card), dealer_up_card,
-                                                   create_deck_from_counts_cache(counts_copy), can_double and das,
-                                                   False, False, 0,
-                                                   dealer_peeks_for_blackjack, das, dealer_stands_soft_17)[0]
-                               + perfect_mover_cache((cards[0],), dealer_up_card,
-                                                     create_deck_from_counts_cache(counts_copy), can_double and das,
-                                                     False, False,
-                                                     max_splits, dealer_peeks_for_blackjack, das,
-                                                     dealer_stands_soft_17)[0]
-                               ) * (probabilities[card])
-                elif max_splits == 1:
-                    profit_split = 0.
-                    profit_no_split = 0.
-                    profit_split += (perfect_mover_cache((cards[0], card), dealer_up_card,
-                                                         create_deck_from_counts_cache(counts_copy), can_double and das,
-                                                         False, False, 1,
-                                                         dealer_peeks_for_blackjack, das, dealer_stands_soft_17)[0]
-                                     + perfect_mover_cache((cards[0],), dealer_up_card,
-                                                           create_deck_from_counts_cache(counts_copy), can_double and das,
-                                                           False, False,
-                                                           0, dealer_peeks_for_blackjack, das,
-                                                           dealer_stands_soft_17)[0]
-                                     ) * (probabilities[card])
-                    profit_no_split += (perfect_mover_cache((cards[0], card), dealer_up_card,
-                                                            create_deck_from_counts_cache(counts_copy), can_double and das,
-                                                            False, False, 0,
-                                                            dealer_peeks_for_blackjack, das, dealer_stands_soft_17)[0]
-                                        + perfect_mover_cache((cards[0],), dealer_up_card,
-                                                              create_deck_from_counts_cache(counts_copy), can_double and das,
-                                                              False, False,
-                                                              1, dealer_peeks_for_blackjack, das,
-                                                              dealer_stands_soft_17)[0]
-                                        ) * (probabilities[card])
-                    profit += max(profit_split, profit_no_split)
-                else:  # max_splits == 2
-                    for card2 in range(2, 12):
-                        if counts_copy[card2] == 0:
-                            continue
-                        counts_copy2 = counts_copy.copy()
-                        counts_copy2[card2] -= 1
-                        if card != card2:  # ([card, card2], [card], [card])  # Can't split the first of the three hands.
-                            for card3 in range(2, 12):
-                                if counts_copy2[card3] == 0:
-                                    continue
-                                counts_copy3 = counts_copy2.copy()
-                                counts_copy3[card3] -= 1
-                                if card3 == card:  # Can split the second of the three hands.
-                                    profit += max(perfect_mover_cache((cards[0], card2), dealer_up_card,
-                                                                      create_deck_from_counts_cache(counts_copy),
-                                                                      can_double and das, False, False, 0,
-                                                                      dealer_peeks_for_blackjack, das,
-                                                                      dealer_stands_soft_17)[0]
-                                                  + perfect_mover_cache((cards[0], card3), dealer_up_card,
-                                                                        create_deck_from_counts_cache(counts_copy2),
-                                                                        can_double and das, False, False, 1,
-                                                                        dealer_peeks_for_blackjack, das,
-                                                                        dealer_stands_soft_17)[0]
-                                                  + perfect_mover_cache((cards[0],), dealer_up_card,
-                                                                        create_deck_from_counts_cache(counts_copy3),
-                                                                        can_double and das, False, False, 0,
-                                                                        dealer_peeks_for_blackjack, das,
-                                                                        dealer_stands_soft_17)[0],
-                                                  perfect_mover_cache((cards[0], card2), dealer_up_card,
-                                                                      create_deck_from_counts_cache(counts_copy),
-                                                                      can_double and das,
-                                                                      False, False, 0,
-                                                                      dealer_peeks_for_blackjack, das,
-                                                                      dealer_stands_soft_17)[0]
-                                                  + perfect_mover_cache((cards[0], card3), dealer_up_card,
-                                                                        create_deck_from_counts_cache(counts_copy2),
-                                                                        can_double and das,
-                                                                        False, False, 0,
-                                                                        dealer_peeks_for_blackjack, das,
-                                                                        dealer_stands_soft_17)[0]
-                                                  + perfect_mover_cache((cards[0],), dealer_up_card,
-                                                                        create_deck_from_counts_cache(counts_copy3),
-                                                                        can_double and das,
-                                                                        False, False, 1,
-                                                                        dealer_peeks_for_blackjack, das,
-                                                                        dealer_stands_soft_17)[0]
-                                                  ) * (probabilities[card] * probabilities_copy[card2] * probabilities[card3])
-                                else:  # ([card, card2], [card, card3], [card])  # Can't split the first two hands.
-                                    profit += (perfect_mover_cache((cards[0], card2), dealer_up_card,
-                                                                   create_deck_from_counts_cache(counts_copy),
-                                                                   can_double and das,
-                                                                   False, False, 0,
-                                                                   dealer_peeks_for_blackjack, das,
-                                                                   dealer_stands_soft_17)[0]
-                                               + perfect_mover_cache((cards[0], card3), dealer_up_card,
-                                                                     create_deck_from_counts_cache(counts_copy2),
-                                                                     can_double and das,
-                                                                     False, False, 0,
-                                                                     dealer_peeks_for_blackjack, das,
-                                                                     dealer_stands_soft_17)[0]
-                                               + perfect_mover_cache((cards[0],), dealer_up_card,
-                                                                     create_deck_from_counts_cache(counts_copy3),
-                                                                     can_double and das,
-                                                                     False, False, 1,
-                                                                     dealer_peeks_for_blackjack, das,
-                                                                     dealer_stands_soft_17)[0]
-                                               ) * (probabilities[card] * probabilities_copy[card2] * probabilities[card3])
-                        else:  # Can split the first hand.
-                            profit_no_split = 0.
-                            profit_split = (perfect_mover_cache((cards[0],), dealer_up_card,
-                                                                create_deck_from_counts_cache(counts_copy2),
-                                                                can_double and das,
-                                                                False, False, 0,
-                                                                dealer_peeks_for_blackjack, das,
-                                                                dealer_stands_soft_17)[0] * 4
-                                            ) * (probabilities[card] * probabilities_copy[card2])
-                            for card3 in range(2, 12):
-                                if counts_copy2[card3] == 0:
-                                    continue
-                                counts_copy3 = counts_copy2.copy()
-                                counts_copy3[card3] -= 1
-                                if card3 == card:  # Can split the second of the three hands.
-                                    profit_no_split += max(perfect_mover_cache((cards[0], card2), dealer_up_card,
-                                                                               create_deck_from_counts_cache(counts_copy),
-                                                                               can_double and das, False, False, 0,
-                                                                               dealer_peeks_for_blackjack, das,
-                                                                               dealer_stands_soft_17)[0]
-                                                           + perfect_mover_cache((cards[0], card3), dealer_up_card,
-                                                                                 create_deck_from_counts_cache(counts_copy2),
-                                                                                 can_double and das, False, False, 1,
-                                                                                 dealer_peeks_for_blackjack, das,
-                                                                                 dealer_stands_soft_17)[0]
-                                                           + perfect_mover_cache((cards[0],), dealer_up_card,
-                                                                                 create_deck_from_counts_cache(counts_copy3),
-                                                                                 can_double and das,
-                                                                                 False, False, 0,
-                                                                                 dealer_peeks_for_blackjack, das,
-                                                                                 dealer_stands_soft_17)[0],
-                                                           perfect_mover_cache((cards[0], card2), dealer_up_card,
-                                                                               create_deck_from_counts_cache(counts_copy),
-                                                                               can_double and das,
-                                                                               False, False, 0,
-                                                                               dealer_peeks_for_blackjack, das,
-                                                                               dealer_stands_soft_17)[0]
-                                                           + perfect_mover_cache((cards[0], card3), dealer_up_card,
-                                                                                 create_deck_from_counts_cache(counts_copy2),
-                                                                                 can_double and das,
-                                                                                 False, False, 0,
-                                                                                 dealer_peeks_for_blackjack, das,
-                                                                                 dealer_stands_soft_17)[0]
-                                                           + perfect_mover_cache((cards[0],), dealer_up_card,
-                                                                                 create_deck_from_counts_cache(counts_copy3),
-                                                                                 can_double and das,
-                                                                                 False, False, 1,
-                                                                                 dealer_peeks_for_blackjack, das,
-                                                                                 dealer_stands_soft_17)[0]
-                                                           ) * (probabilities[card] * probabilities_copy[card2]
-                                                                * probabilities[card3])
-                                else:  # ([card, card2], [card, card3], [card])  # Can't split the first two hands.
-                                    profit_no_split += (perfect_mover_cache((cards[0], card2), dealer_up_card,
-                                                                            create_deck_from_counts_cache(counts_copy),
-                                                                            can_double and das,
-                                                                            False, False, 0,
-                                                                            dealer_peeks_for_blackjack, das,
-                                                                            dealer_stands_soft_17)[0]
-                                                        + perfect_mover_cache((cards[0], card3), dealer_up_card,
-                                                                              create_deck_from_counts_cache(counts_copy2),
-                                                                              can_double and das,
-                                                                              False, False, 0,
-                                                                              dealer_peeks_for_blackjack, das,
-                                                                              dealer_stands_soft_17)[0]
-                                                        + perfect_mover_cache((cards[0],), dealer_up_card,
-                                                                              create_deck_from_counts_cache(counts_copy3),
-                                                                              can_double and das,
-                                                                              False, False, 1,
-                                                                              dealer_peeks_for_blackjack, das,
-                                                                              dealer_stands_soft_17)[0]
-                                                        ) * (probabilities[card] * probabilities_copy[card2]
-                                                             * probabilities[card3])
-                            profit += max(profit_split, profit_no_split)
-
-            split_profit = profit
+                next_value, next_has_ace = player_state(low_value, has_ace, card)
+                if next_value <= 21:
+                    hit_profit += best_profits[next_value * 2 + next_has_ace] * probabilities[card - 2]
+                else:
+                    hit_profit -= probabilities[card - 2]
+            hit_profits[state] = hit_profit
+            best_profits[state] = max(stand_profits[state], hit_profit)
+    return tuple(stand_profits), tuple(hit_profits)
+
+
+@budget_cache(maxsize=100_000, share=.05)
+def infinite_deck_mover(cards: tuple[int, ...], dealer_up_card: int, probabilities: tuple[float, ...],
+                        can_double: bool = True, can_insure: bool = True, can_surrender: bool = True,
+                        max_splits: int = 3, rules: int = RuleSet().analysis_code) -> tuple[float, ...]:
+    """
+    Get the expected returns of all actions in an infinite shoe, where each card is always drawn with the same
+    probability. Much faster than `perfect_mover`, as the shoe doesn't change while the hand is played, but less exact
+    for small shoes.
+
+    :param cards: The cards in the player's hand.
+    :param dealer_up_card: The dealer's up card.
+    :param probabilities: The probability of drawing each card (2 to 11, in that order).
+    :param can_double: Whether the player can double.
+    :param can_insure: Whether the player can take insurance.
+    :param can_surrender: Whether the player can surrender.
+    :param max_splits: How many times the player can split their hand.
+    :param rules: The rules of the game (`RuleSet.analysis_code`).
+    :return: The expected returns of all 6 possible actions
+        (`stand`, `hit`, `double`, `split`, `surrender`, and `insurance`, in that order), like `perfect_mover`.
+    """
+    double_profit = -1000.
+    split_profit = -1000.
+    surrender_profit = -1000.
+    insurance_profit = -1000.
+
+    low_value, has_ace = sum(1 if card == 11 else card for card in cards), 11 in cards
+    if low_value > 21:
+        return -1., -1000., -1000., -1000., -1000., -1000.
+    stand_profits, hit_profits = infinite_deck_hand_profits(dealer_up_card, probabilities, rules)
+    stand_profit = stand_profits[low_value * 2 + has_ace]
+    hit_profit = hit_profits[low_value * 2 + has_ace]
+
+    def standing_profit(hand: tuple[int, bool]) -> float:
+        return stand_profits[hand[0] * 2 + hand[1]] if hand[0] <= 21 else -1.
+
+    # Double
+    if can_double and len(cards) == 2:
+        double_profit = 2 * sum(standing_profit(player_state(low_value, has_ace, card)) * probabilities[card - 2]
+                                for card in range(2, 12))
+
+    # Surrender
+    if len(cards) == 2 and can_surrender:
+        surrender_profit = -.5
+
+    # Insurance
+    if dealer_up_card == 11 and len(cards) == 2 and can_insure:
+        insurance_profit = probabilities[10 - 2] - .5 * (1 - probabilities[10 - 2])
+
+    # Split
+    if len(cards) == 2 and cards[0] == cards[1] and max_splits >= 1:
+        rule_set = RuleSet.from_code(rules)
+        split_card = cards[0]
+        split_hand = player_state(0, False, split_card)
+        hand_profits = []
+        for card in range(2, 12):
+            if split_card == 11:  # Split aces only get one card.
+                hand_profits.append(standing_profit(player_state(*split_hand, card)))
+            else:
+                hand_profits.append(max(infinite_deck_mover((split_card, card), dealer_up_card, probabilities,
+                                                            can_double and rule_set.das, False, False, 0, rules)[:3]))
+
+        @lru_cache(maxsize=None)
+        def waiting_hands_profit(hands: int, splits_left: int) -> float:
+            # The same as `split_hands_profit`, except that the shoe never changes.
+            profit = 0.
+            for card in range(2, 12):
+                hand_profit = hand_profits[card - 2]
+                if hands > 1:
+                    hand_profit += waiting_hands_profit(hands - 1, splits_left)
+                if card == split_card and splits_left and (split_card != 11 or rule_set.can_resplit_aces):
+                    hand_profit = max(hand_profit, waiting_hands_profit(hands + 1, splits_left - 1))
+                profit += hand_profit * probabilities[card - 2]
+            return profit
+
+        split_profit = waiting_hands_profit(2, max_splits - 1)
 
     return stand_profit, hit_profit, double_profit, split_profit, surrender_profit, insurance_profit
 
 
-def perfect_mover_cache(cards: Iterable[int], dealer_up_card: int, cards_not_seen: Iterable[int],
+persistent_store: ResultStore | None = None
+
+
+def use_persistent_store(path: str | None, max_entries: int = 1_000_000) -> None:
+    """
+    Keep the results of `perfect_mover_cache` in a file, so they can be reused by later runs.
+
+    :param path: The file to store the results in. If it is None, the results aren't stored.
+    :param max_entries: How many positions to keep in the file.
+    """
+    global persistent_store
+    if persistent_store is not None:
+        persistent_store.close()
+    persistent_store = ResultStore(path, max_entries) if path else None
+
+
+precomputed_tables: list[PrecomputedTable] = []
+
+
+def use_precomputed_tables(paths: Iterable[str]) -> None:
+    """
+    Answer hands dealt from a full shoe with precomputed tables, instead of analysing them.
+
+    :param paths: The files of the tables (see `build_precomputed_table`). Tables with other rules are ignored.
+    """
+    precomputed_tables[:] = [PrecomputedTable(path) for path in paths]
+
+
+def precomputed_perfect_mover(cards: tuple[int, ...], dealer_up_card: int, counts: tuple[int, ...],
+                              can_double: bool, can_insure: bool, can_surrender: bool, max_splits: int, rules: int
+                              ) -> tuple[float, ...] | None:
+    """
+    Get the results of `perfect_mover` from a precomputed table, if the hand was dealt from a full shoe.
+
+    :param cards: The cards in the player's hand (sorted).
+    :param dealer_up_card: The dealer's up card.
+    :param counts: How many cards of each rank there are in the shoe (see `counts_not_seen`).
+    :param can_double: Whether the player can double.
+    :param can_insure: Whether the player can take insurance.
+    :param can_surrender: Whether the player can surrender.
+    :param max_splits: How many times the player can split their hand.
+    :param rules: The rules of the game (`RuleSet.analysis_code`).
+    :return: The expected returns of all 6 possible actions, or None if no table has the position.
+    """
+    cards_dealt = sum(counts) + len(cards) + 1
+    for table in precomputed_tables:
+        if table.rules.deck_number * 52 != cards_dealt or table.rules.analysis_code != rules:
+            continue
+        # The tables are built with every action allowed (see `build_precomputed_table`).
+        if len(cards) == 2 and (not can_double or not can_insure or can_surrender != table.rules.surrender_allowed
+                                or max_splits != (0 if can_never_split(cards) else table.rules.max_splits)):
+            continue
+        if counts != tuple(ShoeCounts.from_decks(table.rules.deck_number).remove_cards(cards + (dealer_up_card,))):
+            continue
+        return table.get(cards, dealer_up_card)
+    return None
+
+
+def precompute_up_card(dealer_up_card: int, rules: RuleSet) -> list[tuple[float, ...]]:
+    """
+    Calculate the expected returns of every hand of a precomputed table against one dealer up card.
+
+    :param dealer_up_card: The dealer's up card.
+    :param rules: The rules of the game. The number of decks is the size of the full shoe.
+    :return: The expected returns of all 6 possible actions of each hand (in the order of `table_hands`).
+    """
+    profits: list[tuple[float, ...]] = []
+    for cards in table_hands():  # The smaller hands come first, so the larger ones are mostly already in the cache.
+        counts = ShoeCounts.from_decks(rules.deck_number).remove_cards(cards + (dealer_up_card,))
+        if min(counts) < 0:
+            profits.append((float("nan"),) * 6)
+            continue
+        profits.append(cast(tuple[float, ...], perfect_mover_cache(cards, dealer_up_card, counts, return_all_profits=True,
+                                                                   rules=rules)))
+    return profits
+
+
+def build_precomputed_table(path: str, deck_number: int = 6, max_splits: int = 1, dealer_peeks_for_blackjack: bool = True,
+                            das: bool = True, dealer_stands_soft_17: bool = True, surrender_allowed: bool = True,
+                            cores: int = 1) -> None:
+    """
+    Calculate the expected returns of every hand of 2 to 5 cards against every dealer up card, when the hand is dealt
+    from a full shoe, and write them to a table that `use_precomputed_tables` can load.
+
+    :param path: The file to write the table to.
+    :param deck_number: How many decks the full shoe has.
+    :param max_splits: How many times the player can split their hand.
+    :param dealer_peeks_for_blackjack: Whether the dealer peeks for blackjack.
+    :param das: Whether we can double after splitting.
+    :param dealer_stands_soft_17: Whether the dealer stands on soft 17.
+    :param surrender_allowed: Whether the player can surrender.
+    :param cores: How many processes to use. Each one calculates different dealer up cards.
+    """
+    rules = RuleSet(deck_number, max_splits, dealer_peeks_for_blackjack, das, dealer_stands_soft_17, surrender_allowed)
+    arguments = [(dealer_up_card, rules) for dealer_up_card in range(2, 12)]
+    if cores <= 1:
+        up_card_profits = [precompute_up_card(*argument) for argument in arguments]
+    else:
+        with multiprocessing.Pool(processes=cores, initializer=set_cache_budget, initargs=cache_budget()) as pool:
+            up_card_profits = pool.starmap(precompute_up_card, arguments)
+            pool.close()
+            pool.join()
+    write_precomputed_table(path, np.stack(up_card_profits, axis=1), rules)
+
+
+def cache_stats() -> dict[str, CacheStats]:
+    """
+    Get how the caches of the best move analysis have been used in this process.
+
+    :return: The hits, misses, evictions, size, estimated memory, and time spent of each cache.
+    """
+    return get_cache_stats({"perfect_mover": perfect_mover, "split_hands_profit": split_hands_profit,
+                            "dealer_final_probabilities": dealer_final_probabilities,
+                            "card_probabilities": card_probabilities, "can_never_split": can_never_split,
+                            "stand_payoffs": stand_payoffs, "infinite_deck_mover": infinite_deck_mover,
+                            "infinite_deck_hand_profits": infinite_deck_hand_profits,
+                            "dealer_absorption": dealer_absorption})
+
+
+def print_cache_stats() -> None:
+    """Print how the caches of the best move analysis have been used in this process."""
+    print(f"Cache stats (process {os.getpid()}):\n{format_cache_stats(cache_stats())}")
+
+
+def setup_worker_caches(cache_file: str | None, table: SharedResultTable | None, collect_stats: bool = False,
+                        table_files: Sequence[str] = (), cache_megabytes: float | None = None,
+                        compact_cache: bool = False) -> None:
+    """
+    Set up the caches of a worker process.
+
+    :param cache_file: The file to store the results in (see `use_persistent_store`).
+    :param table: The table to share the results with the other workers (see `use_shared_table`).
+    :param collect_stats: Whether to collect stats about the caches and print them when the worker exits.
+    :param table_files: The precomputed tables to use (see `use_precomputed_tables`).
+    :param cache_megabytes: The memory budget of the caches of the worker (see `budget_cache.set_cache_budget`).
+    :param compact_cache: Whether the caches store tuples of floats compactly.
+    """
+    set_cache_budget(cache_megabytes, compact_cache)
+    use_persistent_store(cache_file)
+    if cache_file:  # Close the store when the worker exits, so it writes which positions it used.
+        multiprocessing.util.Finalize(None, use_persistent_store, (None,), exitpriority=0)
+    use_shared_table(table)
+    use_precomputed_tables(table_files)
+    if collect_stats:
+        enable_stats()
+        multiprocessing.util.Finalize(None, print_cache_stats, exitpriority=0)
+
+
+def branch_profit(branch: str, *arguments: Any) -> float:
+    """
+    Calculate the expected return of a branch of a position in a worker process of `parallel_perfect_mover`.
+
+    :param branch: Either "hit" (`hit_card_profit`) or "split" (`split_card_profit`).
+    :param arguments: The arguments of the branch's function.
+    :return: The expected return of the branch.
+    """
+    return (hit_card_profit if branch == "hit" else split_card_profit)(*arguments)
+
+
+def parallel_perfect_mover(cards: tuple[int, ...], dealer_up_card: int, counts: tuple[int, ...],
+                           can_double: bool, can_insure: bool, can_surrender: bool, max_splits: int, rules: int,
+                           bucket_size: int = 1, prune: bool = False, cores: int = 1) -> tuple[float, ...]:
+    """
+    Get the results of `perfect_mover` for a single position with many processes.
+
+    Each card the player can draw by hitting, and each second card of the first hand when splitting, is a branch that a
+    worker process analyses. The workers share their results (see `SharedResultTable`), and the branches are then
+    combined by `perfect_mover` in this process in the same order as with a single process, so the results are exactly
+    the same. With pruning, all the branches are analysed, even the ones `perfect_mover` ends up skipping.
+
+    :param cards: The cards in the player's hand.
+    :param dealer_up_card: The dealer's up card.
+    :param counts: How many times each card is in the shoe. (e.g. (24, 24, 24, ..., 96, 24))
+    :param can_double: Whether the player can double.
+    :param can_insure: Whether the player can take insurance.
+    :param can_surrender: Whether the player can surrender.
+    :param max_splits: How many times the player can split their hand.
+    :param rules: The rules of the game (`RuleSet.analysis_code`).
+    :param bucket_size: The size of the buckets of the dealer's shoes (see `bucket_counts`). 1 gives exact results.
+    :param prune: Whether to stop analysing the actions that can't be the best (see `perfect_mover`).
+    :param cores: How many processes to use. With 1, the position is analysed in this process.
+    :return: The expected returns of all 6 possible actions.
+    """
+    arguments = (cards, dealer_up_card, counts, can_double, can_insure, can_surrender, max_splits, rules, bucket_size,
+                 prune)
+    if cores <= 1 or HandPlayer(cards).value > 21:
+        return perfect_mover(*arguments)
+    branches: list[tuple[Any, ...]] = []
+    if len(cards) == 2 and cards[0] == cards[1] and max_splits >= 1:  # The most expensive branches go first.
+        can_double_after_split = can_double and RuleSet.from_code(rules).das
+        branches += [("split", cards[0], dealer_up_card, counts, card, 2, max_splits - 1, True, can_double_after_split,
+                      rules, bucket_size) for card in range(2, 12) if counts[card - 2]]
+    branches += [("hit", cards, dealer_up_card, counts, card, can_double, max_splits, rules, bucket_size)
+                 for card in range(2, 12) if counts[card - 2] and HandPlayer(cards + (card,)).value <= 21]
+    cores = min(cores, len(branches))
+    if cores <= 1:
+        return perfect_mover(*arguments)
+    cache_file = persistent_store.path if persistent_store is not None else None
+    table_files = [precomputed.path for precomputed in precomputed_tables]
+    with shared_table_for(cores) as table, multiprocessing.Pool(processes=cores, initializer=setup_worker_caches,
+                                                                initargs=(cache_file, table, stats_enabled(),
+                                                                          table_files, *cache_budget())) as pool:
+        profits = pool.starmap(branch_profit, branches, chunksize=1)
+        pool.close()
+        pool.join()
+    primed_branch_profits.update(zip(branches, profits))
+    try:
+        return perfect_mover(*arguments)
+    finally:
+        primed_branch_profits.clear()
+
+
+def stored_perfect_mover(cards: tuple[int, ...], dealer_up_card: int, counts: tuple[int, ...],
+                         can_double: bool, can_insure: bool, can_surrender: bool, max_splits: int, rules: int,
+                         bucket_size: int = 1, prune: bool = False, cores: int = 1) -> tuple[float, ...]:
+    """
+    Get the results of `perfect_mover` from the persistent store, or calculate and store them if they aren't there.
+
+    :param cards: The cards in the player's hand.
+    :param dealer_up_card: The dealer's up card.
+    :param counts: How many cards of each rank there are in the shoe (see `counts_not_seen`).
+    :param can_double: Whether the player can double.
+    :param can_insure: Whether the player can take insurance.
+    :param can_surrender: Whether the player can surrender.
+    :param max_splits: How many times the player can split their hand.
+    :param rules: The rules of the game (`RuleSet.analysis_code`).
+    :param bucket_size: The size of the buckets of the dealer's shoes (see `bucket_counts`). 1 gives exact results.
+    :param prune: Whether to stop analysing the actions that can't be the best (see `perfect_mover`).
+    :param cores: How many processes to calculate the results with (see `parallel_perfect_mover`).
+    :return: The expected returns of all 6 possible actions.
+    """
+    arguments = (cards, dealer_up_card, counts, can_double, can_insure, can_surrender, max_splits, rules, bucket_size,
+                 prune)
+    if persistent_store is None:
+        return parallel_perfect_mover(*arguments, cores)
+    key = result_key(*arguments)
+    profits = persistent_store.get(key)
+    if profits is None:
+        profits = parallel_perfect_mover(*arguments, cores)
+        persistent_store.put(key, profits)
+    return profits
+
+
+def perfect_mover_cache(cards: Iterable[int], dealer_up_card: int, cards_not_seen: Iterable[int] | ShoeCounts,
                         can_double: bool = True, can_insure: bool = True, can_surrender: bool = True,
                         max_splits: int = 3, dealer_peeks_for_blackjack: bool = True,
                         das: bool = True, dealer_stands_soft_17: bool = True, return_all_profits: bool = False,
-                        print_profits: bool = False, plot_profits: bool = False
+                        print_profits: bool = False, plot_profits: bool = False, bucket_size: int = 1,
+                        rules: RuleSet | None = None, infinite_deck: bool = False, prune: bool = True, cores: int = 1
                         ) -> tuple[float, ...] | tuple[float, str, float]:
     """
     Increase cache hits in `perfect_mover`. Use this instead of `perfect_mover` for faster results.
 
     :param cards: The cards in the player's hand.
     :param dealer_up_card: The dealer's up card.
-    :param cards_not_seen: The cards the player hasn't already seen.
+    :param cards_not_seen: The cards the player hasn't already seen. Either the cards themselves
+        (e.g. [2, 10, 11, 10, ...]) or how many cards of each rank there are (`ShoeCounts`).
     :param can_double: Whether the player can double.
     :param can_insure: Whether the player can take insurance.
     :param can_surrender: Whether the player can surrender.
@@ -552,9 +1225,27 @@ def perfect_mover_cache(cards: Iterable[int], dealer_up_card: int, cards_not_see
     :param print_profits: Whether we should print the expected returns of all the actions.
     :param plot_profits: Whether we should create a table showing the expected returns of all possible actions,
         with the best move highlighted.
+    :param bucket_size: Round the shoes the dealer draws from to buckets of this size (see `bucket_counts`).
+        Much faster, but only approximate. Use `validate_bucketing` to measure the error. 1 gives exact results.
+    :param rules: The rules of the game. If given, they replace `max_splits`, `dealer_peeks_for_blackjack`, `das`, and
+        `dealer_stands_soft_17`, and the player can only surrender if both `can_surrender` and the rules allow it.
+        The number of decks is ignored, as the shoe is given.
+    :param infinite_deck: Whether to use `infinite_deck_mover`, which draws every card with the probabilities of the
+        shoe, instead of removing the cards that are drawn. It takes milliseconds, but is only approximate,
+        especially for small shoes. `bucket_size` is ignored.
+    :param prune: Whether to stop analysing the actions that can't be the best (see `perfect_mover`), when only the best
+        action is returned. The actions are always analysed fully if all the expected returns are returned, printed,
+        or plotted.
+    :param cores: How many processes to analyse the hand with (see `parallel_perfect_mover`). Only worth it for
+        positions that take seconds, like pairs that can be split many times.
     :return: The expected returns of all 6 possible actions, or only the best expected return,
         the action that gets this return, and the expected profit of taking insurance.
     """
+    if rules is None:
+        rules = RuleSet(0, max_splits, dealer_peeks_for_blackjack, das, dealer_stands_soft_17)
+    max_splits = rules.max_splits
+    can_surrender = can_surrender and rules.surrender_allowed
+    rules_code = rules.analysis_code
     cards = tuple(cards)
     if can_never_split(cards):
         max_splits = 0
@@ -563,13 +1254,20 @@ def perfect_mover_cache(cards: Iterable[int], dealer_up_card: int, cards_not_see
         can_insure = False
         can_surrender = False
     cards = tuple_sort(cards)
-    cards_not_seen = tuple_sort(cards_not_seen)
-
-    stand_profit, hit_profit, double_profit, split_profit, surrender_profit, insurance_profit = (
-        perfect_mover(cards=cards, dealer_up_card=dealer_up_card, cards_not_seen=cards_not_seen,
-                      can_double=can_double, can_insure=can_insure, can_surrender=can_surrender,
-                      max_splits=max_splits, dealer_peeks_for_blackjack=dealer_peeks_for_blackjack,
-                      das=das, dealer_stands_soft_17=dealer_stands_soft_17))
+    counts = counts_not_seen(cards_not_seen)
+    prune = prune and not (return_all_profits or print_profits or plot_profits)
+
+    profits = None
+    if infinite_deck:
+        profits = infinite_deck_mover(cards, dealer_up_card, card_probabilities(counts, dealer_up_card, False),
+                                      can_double, can_insure, can_surrender, max_splits, rules_code)
+    elif bucket_size == 1:  # The precomputed tables have exact results.
+        profits = precomputed_perfect_mover(cards, dealer_up_card, counts, can_double, can_insure, can_surrender,
+                                            max_splits, rules_code)
+    if profits is None:
+        profits = stored_perfect_mover(cards, dealer_up_card, counts, can_double, can_insure, can_surrender, max_splits,
+                                       rules_code, bucket_size, prune, cores)
+    stand_profit, hit_profit, double_profit, split_profit, surrender_profit, insurance_profit = profits
 
     if print_profits:
         print(f"Profits: Stand: {stand_profit}, Hit: {hit_profit}, Double: {double_profit}, Split: {split_profit}, "
@@ -585,29 +1283,9 @@ def perfect_mover_cache(cards: Iterable[int], dealer_up_card: int, cards_not_see
             profit_dict["surrender"] = surrender_profit
         if insurance_profit > -10:
             profit_dict["insurance"] = insurance_profit
-        get_insurance = insurance_profit > 0
-        best_action = argmax(stand_profit, hit_profit, double_profit, split_profit, surrender_profit)[1]
-        result_table = [[action.title(), str(round(profit_dict[action], 10))] for action in profit_dict]
-        result_table_colors = [(["y", "y"] if action == best_action or action == "insurance" and get_insurance else ["w", "w"]
-                                ) for action in profit_dict]
-        fig, ax = plt.subplots(dpi=200)
-        fig.patch.set_visible(False)
-        fig.set_size_inches(4, 2)
-        ax.set_yticklabels([])
-        ax.set_xticklabels([])
-        ax.set_xticks([])
-        ax.set_yticks([])
-        ax.spines['top'].set_visible(False)
-        ax.spines['right'].set_visible(False)
-        ax.spines['bottom'].set_visible(False)
-        ax.spines['left'].set_visible(False)
-        table = ax.table(result_table, result_table_colors, loc='center', cellLoc='center')
-        table.scale(1, 1.5)
-        ax.set_title("Actions and their expected returns")
-        ax.set_ylabel("Actions")
-        ax.set_xlabel("Expected Returns")
-        plt.tight_layout()
-        plt.show()
+        from plotting import plot_action_profits
+        plot_action_profits(profit_dict, argmax(stand_profit, hit_profit, double_profit, split_profit, surrender_profit)[1],
+                            insurance_profit > 0)
 
     if return_all_profits:
         return stand_profit, hit_profit, double_profit, split_profit, surrender_profit, insurance_profit
@@ -615,14 +1293,527 @@ def perfect_mover_cache(cards: Iterable[int], dealer_up_card: int, cards_not_see
     return argmax(stand_profit, hit_profit, double_profit, split_profit, surrender_profit) + (insurance_profit,)
 
 
+def perfect_mover_batch(cards: Iterable[int], dealer_up_card: int, shoes: Sequence[Iterable[int] | ShoeCounts],
+                        can_double: bool = True, can_insure: bool = True, can_surrender: bool = True,
+                        max_splits: int = 3, dealer_peeks_for_blackjack: bool = True, das: bool = True,
+                        dealer_stands_soft_17: bool = True, rules: RuleSet | None = None, infinite_deck: bool = False
+                        ) -> list[tuple[float, ...]]:
+    """
+    Get the expected returns of all 6 possible actions for the same hand in many different shoes.
+
+    The dealer probabilities of every shoe the player can face are calculated together in one batch
+    before the shoes are analysed one by one.
+
+    :param cards: The cards in the player's hand.
+    :param dealer_up_card: The dealer's up card.
+    :param shoes: The cards the player hasn't already seen in each shoe. Either the cards themselves
+        (e.g. [2, 10, 11, 10, ...]) or how many cards of each rank there are (`ShoeCounts`).
+    :param can_double: Whether the player can double.
+    :param can_insure: Whether the player can take insurance.
+    :param can_surrender: Whether the player can surrender.
+    :param max_splits: How many times the player can split their hand.
+    :param dealer_peeks_for_blackjack: Whether the dealer peeks for blackjack.
+    :param das: Whether we can double after splitting.
+    :param dealer_stands_soft_17: Whether the dealer stands on soft 17.
+    :param rules: The rules of the game. If given, they replace the other rules (see `perfect_mover_cache`).
+    :param infinite_deck: Whether to use `infinite_deck_mover` (see `perfect_mover_cache`). Nothing is calculated in
+        advance, as it is already fast.
+    :return: The expected returns of all 6 possible actions for each shoe
+        (`stand`, `hit`, `double`, `split`, `surrender`, and `insurance`, in that order).
+    """
+    if rules is None:
+        rules = RuleSet(0, max_splits, dealer_peeks_for_blackjack, das, dealer_stands_soft_17)
+    if infinite_deck:
+        return [cast(tuple[float, ...], perfect_mover_cache(cards, dealer_up_card, shoe, can_double, can_insure,
+                                                            can_surrender, return_all_profits=True, rules=rules,
+                                                            infinite_deck=True)) for shoe in shoes]
+    max_splits = rules.max_splits
+    can_surrender = can_surrender and rules.surrender_allowed
+    rules_code = rules.analysis_code
+    cards = tuple(cards)
+    if can_never_split(cards):
+        max_splits = 0
+    if len(cards) > 2:
+        can_double = False
+        can_insure = False
+        can_surrender = False
+    cards = tuple_sort(cards)
+    all_counts = [counts_not_seen(shoe) for shoe in shoes]
+    needed_counts: set[tuple[int, ...]] = set()
+    for counts in all_counts:
+        if precomputed_perfect_mover(cards, dealer_up_card, counts, can_double, can_insure, can_surrender, max_splits,
+                                     rules_code) is not None:
+            continue  # The hand is dealt from a full shoe, so it is in a precomputed table.
+        if persistent_store is not None and persistent_store.get(result_key(
+                cards, dealer_up_card, counts, can_double, can_insure, can_surrender, max_splits, rules_code)) is not None:
+            continue  # Already analysed by an earlier run.
+        needed_counts |= reachable_counts(cards, counts)
+        if len(cards) == 2 and cards[0] == cards[1] and max_splits:
+            needed_counts |= split_reachable_counts(cards[0], counts)
+    prime_dealer_probabilities(dealer_up_card, needed_counts, rules.dealer_peeks_for_blackjack,
+                               rules.dealer_stands_soft_17)
+    try:
+        return [cast(tuple[float, ...], perfect_mover_cache(cards, dealer_up_card, ShoeCounts(*counts), can_double,
+                                                            can_insure, can_surrender, return_all_profits=True,
+                                                            rules=rules)) for counts in all_counts]
+    finally:
+        primed_dealer_probabilities.clear()
+
+
+class DeepeningLevel(NamedTuple):
+    """The results of `progressive_perfect_mover` when the player can split a number of times."""
+
+    max_splits: int
+    profits: tuple[float, ...]
+    best_action: str
+    action_changed: bool
+    seconds: float
+
+    def describe(self) -> str:
+        """
+        Describe the results in one line.
+
+        :return: The description.
+        """
+        profits = ", ".join(f"{action.title()}: {profit}" for action, profit in zip(RESULT_FIELDS, self.profits)
+                            if profit > -10)
+        change = " (changed)" if self.action_changed else ""
+        return (f"Splits: {self.max_splits}, Profits: {profits}, Best action: {self.best_action}{change}, "
+                f"Time: {self.seconds:.2f}s")
+
+
+def progressive_perfect_mover(cards: Iterable[int], dealer_up_card: int, cards_not_seen: Iterable[int] | ShoeCounts,
+                              time_budget: float, can_double: bool = True, can_insure: bool = True,
+                              can_surrender: bool = True, max_splits: int = 3, dealer_peeks_for_blackjack: bool = True,
+                              das: bool = True, dealer_stands_soft_17: bool = True, rules: RuleSet | None = None,
+                              infinite_deck: bool = False) -> Iterator[DeepeningLevel]:
+    """
+    Analyse a hand within a time budget, allowing more splits while there is time left.
+
+    The hand is first analysed without splitting, then with 1 split, 2 splits, and so on up to `max_splits`. Each
+    analysis runs in a worker process that keeps its caches between them, and is stopped once the time budget is over.
+    The analysis without splitting is always finished, even if it takes longer than the budget. Hands that can't be
+    split are only analysed once.
+
+    :param cards: The cards in the player's hand.
+    :param dealer_up_card: The dealer's up card.
+    :param cards_not_seen: The cards the player hasn't already seen (see `perfect_mover_cache`).
+    :param time_budget: How many seconds the analysis can take.
+    :param can_double: Whether the player can double.
+    :param can_insure: Whether the player can take insurance.
+    :param can_surrender: Whether the player can surrender.
+    :param max_splits: The most times the player can split their hand.
+    :param dealer_peeks_for_blackjack: Whether the dealer peeks for blackjack.
+    :param das: Whether we can double after splitting.
+    :param dealer_stands_soft_17: Whether the dealer stands on soft 17.
+    :param rules: The rules of the game. If given, they replace the other rules (see `perfect_mover_cache`), and
+        their `max_splits` is the most times the player can split.
+    :param infinite_deck: Whether to use `infinite_deck_mover` (see `perfect_mover_cache`).
+    :return: The results with each number of splits, as soon as they are ready.
+    """
+    start = time.perf_counter()
+    if rules is None:
+        rules = RuleSet(0, max_splits, dealer_peeks_for_blackjack, das, dealer_stands_soft_17)
+    cards = tuple(cards)
+    splits = range(rules.max_splits + 1)
+    if len(cards) != 2 or cards[0] != cards[1]:
+        splits = range(rules.max_splits, rules.max_splits + 1)  # Splitting doesn't change anything.
+    cache_file = persistent_store.path if persistent_store is not None else None
+    table_files = [precomputed.path for precomputed in precomputed_tables]
+    previous_action = None
+    with multiprocessing.Pool(processes=1, initializer=setup_worker_caches,
+                              initargs=(cache_file, None, stats_enabled(), table_files, *cache_budget())) as pool:
+        for level_splits in splits:
+            time_left = start + time_budget - time.perf_counter()
+            if previous_action is not None and time_left <= 0:
+                return
+            result = pool.apply_async(perfect_mover_cache, (cards, dealer_up_card, cards_not_seen, can_double,
+                                                            can_insure, can_surrender),
+                                      {"return_all_profits": True, "rules": rules._replace(max_splits=level_splits),
+                                       "infinite_deck": infinite_deck})
+            try:
+                profits = cast(tuple[float, ...], result.get(None if previous_action is None else time_left))
+            except multiprocessing.TimeoutError:
+                return  # Leaving the pool stops the worker.
+            best_action = argmax(*profits[:5])[1]
+            yield DeepeningLevel(level_splits, profits, best_action,
+                                 previous_action is not None and best_action != previous_action,
+                                 time.perf_counter() - start)
+            previous_action = best_action
+
+
+def parse_duration(duration: str) -> float:
+    """
+    Read a duration given on the command line.
+
+    :param duration: The duration in seconds, optionally followed by a unit. (e.g. 5, 5s, 500ms, or 2m)
+    :return: The duration in seconds.
+    """
+    for unit, seconds in (("ms", .001), ("s", 1), ("m", 60)):
+        if duration.endswith(unit):
+            return float(duration[:-len(unit)]) * seconds
+    return float(duration)
+
+
+RESULT_FIELDS = ("stand", "hit", "double", "split", "surrender", "insurance", "best_action")
+
+
+class BucketingError(NamedTuple):
+    """How much putting the shoes into buckets changed the results of some positions."""
+
+    positions: int
+    max_error: float  # The largest difference in the expected return of an action.
+    max_regret: float  # The largest expected return lost by playing the action chosen with buckets.
+    changed_actions: int  # How many positions lost expected return because the best action changed.
+
+    @classmethod
+    def from_errors(cls, errors: Iterable[tuple[float, float]]) -> BucketingError:
+        """
+        Summarise the errors of many positions.
+
+        :param errors: The error and the regret of each position (from `approximation_error`).
+        :return: The summary.
+        """
+        errors = list(errors)
+        return cls(len(errors), max((error for error, _ in errors), default=0.),
+                   max((regret for _, regret in errors), default=0.), sum(regret > 0 for _, regret in errors))
+
+    def __str__(self) -> str:
+        """
+        Describe the errors.
+
+        :return: The description.
+        """
+        return (f"Bucketing error over {readable_number(self.positions)} positions: Max error: {self.max_error}, "
+                f"Max regret: {self.max_regret}, Changed actions: {readable_number(self.changed_actions)}")
+
+
+def approximation_error(cards: Iterable[int], dealer_up_card: int, cards_not_seen: Iterable[int] | ShoeCounts,
+                        bucket_size: int, can_double: bool = True, can_insure: bool = True, can_surrender: bool = True,
+                        max_splits: int = 3, dealer_peeks_for_blackjack: bool = True, das: bool = True,
+                        dealer_stands_soft_17: bool = True) -> tuple[float, float]:
+    """
+    Compare the results of a position with and without putting the shoe into buckets.
+
+    :param cards: The cards in the player's hand.
+    :param dealer_up_card: The dealer's up card.
+    :param cards_not_seen: The cards the player hasn't already seen (see `perfect_mover_cache`).
+    :param bucket_size: The size of the buckets (see `bucket_counts`).
+    :param can_double: Whether the player can double.
+    :param can_insure: Whether the player can take insurance.
+    :param can_surrender: Whether the player can surrender.
+    :param max_splits: How many times the player can split their hand.
+    :param dealer_peeks_for_blackjack: Whether the dealer peeks for blackjack.
+    :param das: Whether we can double after splitting.
+    :param dealer_stands_soft_17: Whether the dealer stands on soft 17.
+    :return: The largest difference in the expected return of an allowed action, and the expected return lost by
+        playing the best action with buckets instead of the exact best action.
+    """
+    counts = ShoeCounts(*counts_not_seen(cards_not_seen))
+    exact_profits, bucket_profits = (
+        cast(tuple[float, ...], perfect_mover_cache(cards, dealer_up_card, counts, can_double, can_insure, can_surrender,
+                                                    max_splits, dealer_peeks_for_blackjack, das, dealer_stands_soft_17,
+                                                    True, bucket_size=size)) for size in (1, bucket_size))
+    error = max(abs(exact - bucket) for exact, bucket in zip(exact_profits, bucket_profits) if exact > -10)
+    bucket_action = argmax(*bucket_profits[:5])[1]
+    regret = max(exact_profits[:5]) - exact_profits[RESULT_FIELDS.index(bucket_action)]
+    return error, regret
+
+
+def validate_bucketing(positions: Iterable[tuple[Iterable[int], int, Iterable[int] | ShoeCounts]], bucket_size: int,
+                       max_splits: int = 3, dealer_peeks_for_blackjack: bool = True, das: bool = True,
+                       dealer_stands_soft_17: bool = True, surrender_allowed: bool = True) -> BucketingError:
+    """
+    Measure how much putting the shoes into buckets changes the results of some positions.
+
+    :param positions: The player's cards, the dealer's up card, and the cards not seen of each position.
+    :param bucket_size: The size of the buckets (see `bucket_counts`).
+    :param max_splits: How many times the player can split their hand.
+    :param dealer_peeks_for_blackjack: Whether the dealer peeks for blackjack.
+    :param das: Whether we can double after splitting.
+    :param dealer_stands_soft_17: Whether the dealer stands on soft 17.
+    :param surrender_allowed: Whether the player can surrender.
+    :return: The largest errors seen.
+    """
+    return BucketingError.from_errors(approximation_error(cards, dealer_up_card, cards_not_seen, bucket_size, True,
+                                                          True, surrender_allowed, max_splits,
+                                                          dealer_peeks_for_blackjack, das, dealer_stands_soft_17)
+                                      for cards, dealer_up_card, cards_not_seen in positions)
+
+
+def parse_cards(cards: str | Iterable[int | str]) -> tuple[int, ...]:
+    """
+    Read cards written by a person (e.g. "A,10" or ["A", 10]).
+
+    :param cards: The cards, either separated by commas or in a list.
+    :return: The cards, with aces as 11.
+    """
+    if isinstance(cards, str):
+        cards = cards.split(",") if cards else []
+    return tuple(int(str(card).strip().upper().replace("A", "11")) for card in cards)
+
+
+def read_queries(file: TextIO, file_format: str) -> Iterator[dict[str, Any]]:
+    """
+    Read the positions to analyse from a file, one at a time.
+
+    Each position has the player's `cards`, the `dealer_card`, and optionally the `shoe` before the cards were dealt
+    (in the same format as the cards). Any other fields are kept, so they can be used to identify the position.
+
+    :param file: The file to read from.
+    :param file_format: `jsonl` (one JSON object per line) or `csv` (with a header).
+    :return: The positions.
+    """
+    if file_format == "csv":
+        yield from csv.DictReader(file)
+        return
+    for line in file:
+        if line.strip():
+            yield json.loads(line)
+
+
+def analyse_query(query: dict[str, Any], deck_number: int = 6, max_splits: int = 1,
+                  dealer_peeks_for_blackjack: bool = True, das: bool = True, dealer_stands_soft_17: bool = True,
+                  surrender_allowed: bool = True, infinite_deck: bool = False) -> dict[str, Any]:
+    """
+    Calculate the expected returns of all actions for one position of a batch.
+
+    :param query: The position (see `read_queries`).
+    :param deck_number: How many decks the shoe starts with, if the position doesn't have a shoe.
+    :param max_splits: How many times the player can split their hand.
+    :param dealer_peeks_for_blackjack: Whether the dealer peeks for blackjack.
+    :param das: Whether we can double after splitting.
+    :param dealer_stands_soft_17: Whether the dealer stands on soft 17.
+    :param surrender_allowed: Whether the player can surrender.
+    :param infinite_deck: Whether to use `infinite_deck_mover` (see `perfect_mover_cache`).
+    :return: The position with the expected return of each action (None if the action isn't allowed), the best action,
+        and the `error` that stopped the position from being analysed (None if it was analysed). A position that can't
+        be analysed (e.g. cards that can't be read, or a shoe without the cards of the position) has no results, so the
+        rest of the batch can still be analysed.
+    """
+    result = dict(query)
+    try:
+        cards = parse_cards(query["cards"])
+        dealer_up_card = parse_cards(str(query["dealer_card"]))[0]
+        shoe = (ShoeCounts.from_cards(parse_cards(query["shoe"])) if query.get("shoe")
+                else ShoeCounts.from_decks(deck_number))
+        shoe = shoe.remove_cards(cards + (dealer_up_card,))  # Remove the cards the player and the dealer have.
+        if min(shoe) < 0:
+            raise ValueError(f"The shoe doesn't contain the cards of the position {query}.")
+        profits = cast(tuple[float, ...], perfect_mover_cache(cards, dealer_up_card, shoe, True, True, surrender_allowed,
+                                                              max_splits, dealer_peeks_for_blackjack, das,
+                                                              dealer_stands_soft_17, True, infinite_deck=infinite_deck))
+    except Exception as error:
+        result.update(dict.fromkeys(RESULT_FIELDS))
+        result["error"] = f"{type(error).__name__}: {error}"
+        return result
+    for action, profit in zip(RESULT_FIELDS, profits):
+        result[action] = profit if profit > -10 else None  # Actions that aren't allowed have a return of -1000.
+    result["best_action"] = argmax(*profits[:5])[1]
+    result["error"] = None
+    return result
+
+
+def analyse_queries(queries: Iterable[dict[str, Any]], cores: int = 1, cache_file: str | None = None,
+                    collect_stats: bool = False, deck_number: int = 6, max_splits: int = 1,
+                    dealer_peeks_for_blackjack: bool = True, das: bool = True, dealer_stands_soft_17: bool = True,
+                    surrender_allowed: bool = True, infinite_deck: bool = False) -> Iterator[dict[str, Any]]:
+    """
+    Calculate the expected returns of all actions for many positions, yielding the results as soon as they are ready.
+
+    The worker processes are kept for the whole batch, so their caches stay warm between positions,
+    and they share their results with each other.
+
+    :param queries: The positions (see `read_queries`).
+    :param cores: How many processes to use.
+    :param cache_file: The file to store the results in (see `use_persistent_store`).
+    :param collect_stats: Whether the worker processes should print how their caches were used when they exit.
+    :param deck_number: How many decks the shoe starts with, if a position doesn't have a shoe.
+    :param max_splits: How many times the player can split their hand.
+    :param dealer_peeks_for_blackjack: Whether the dealer peeks for blackjack.
+    :param das: Whether we can double after splitting.
+    :param dealer_stands_soft_17: Whether the dealer stands on soft 17.
+    :param surrender_allowed: Whether the player can surrender.
+    :param infinite_deck: Whether to use `infinite_deck_mover` (see `perfect_mover_cache`).
+    :return: The results of the positions, in the same order as the positions (see `analyse_query`).
+    """
+    analyse = partial(analyse_query, deck_number=deck_number, max_splits=max_splits,
+                      dealer_peeks_for_blackjack=dealer_peeks_for_blackjack, das=das,
+                      dealer_stands_soft_17=dealer_stands_soft_17, surrender_allowed=surrender_allowed,
+                      infinite_deck=infinite_deck)
+    if cores <= 1:
+        use_persistent_store(cache_file)
+        yield from map(analyse, queries)
+        return
+    table_files = [precomputed.path for precomputed in precomputed_tables]
+    with shared_table_for(cores) as table, multiprocessing.Pool(processes=cores, initializer=setup_worker_caches,
+                                                                initargs=(cache_file, table, collect_stats, table_files,
+                                                                          *cache_budget())) as pool:
+        yield from pool.imap(analyse, queries, chunksize=16)
+        pool.close()
+        pool.join()
+
+
+def write_results(results: Iterable[dict[str, Any]], file: TextIO, file_format: str) -> None:
+    """
+    Write the results of a batch as they arrive.
+
+    :param results: The results (see `analyse_queries`).
+    :param file: The file to write to.
+    :param file_format: `jsonl` (one JSON object per line) or `csv` (with a header).
+    """
+    if file_format == "csv":
+        writer = None
+        for result in results:
+            if writer is None:  # The header has the fields of the first position, followed by the results.
+                writer = csv.DictWriter(file, list(result))
+                writer.writeheader()
+            writer.writerow(result)
+        return
+    for result in results:
+        file.write(json.dumps(result) + "\n")
+
+
+HILO_TAGS: tuple[int, ...] = (1, 1, 1, 1, 1, 0, 0, 0, -1, -1)
+"""The Hi-Lo count of each card, from 2 to ace."""
+
+
+class EffectsOfRemoval(NamedTuple):
+    """How much removing one card of each rank from a shoe changes the expected return of a round."""
+
+    baseline: float  # The expected return of a round dealt from the shoe.
+    effects: tuple[float, ...]  # The change in the expected return when a card is removed, at index `card - 2`.
+    frequencies: tuple[float, ...]  # The share of the shoe each rank makes up, at index `card - 2`.
+
+    def betting_correlation(self, tags: Sequence[float] = HILO_TAGS) -> float:
+        """
+        Measure how well a counting system predicts the changes in the expected return.
+
+        :param tags: The count of each card, from 2 to ace. (e.g. `HILO_TAGS`)
+        :return: The correlation between the effects of removal and the tags, with each rank weighted by its frequency.
+        """
+        products = sum(frequency * effect * tag for frequency, effect, tag in zip(self.frequencies, self.effects, tags))
+        effects_size = sum(frequency * effect ** 2 for frequency, effect in zip(self.frequencies, self.effects))
+        tags_size = sum(frequency * tag ** 2 for frequency, tag in zip(self.frequencies, tags))
+        return float(products / (effects_size * tags_size) ** .5)
+
+    def rows(self) -> list[dict[str, Any]]:
+        """
+        Describe every rank, so the results can be written by `write_results`.
+
+        :return: The card, its frequency, its effect of removal, and its Hi-Lo tag, with the baseline in every row.
+        """
+        return [{"card": "A" if card == 11 else str(card), "frequency": self.frequencies[card - 2],
+                 "eor": self.effects[card - 2], "hilo_tag": HILO_TAGS[card - 2], "baseline": self.baseline}
+                for card in range(2, 12)]
+
+
+def round_expected_value(cards: tuple[int, int], dealer_up_card: int, counts: tuple[int, ...],
+                         profits: tuple[float, ...], dealer_peeks_for_blackjack: bool) -> float:
+    """
+    Get the expected return of a round from the results of its first two cards, including the blackjacks.
+
+    Insurance is never taken.
+
+    :param cards: The player's first two cards.
+    :param dealer_up_card: The dealer's up card.
+    :param counts: How many cards of each rank there are in the shoe, after the cards were dealt.
+    :param profits: The expected returns of all 6 possible actions (from `perfect_mover`).
+    :param dealer_peeks_for_blackjack: Whether the dealer peeks for blackjack.
+    :return: The expected return of the round.
+    """
+    blackjack_card = {10: 11, 11: 10}.get(dealer_up_card)
+    dealer_blackjack = counts[blackjack_card - 2] / sum(counts) if blackjack_card else 0.
+    if sum(cards) == 21:
+        return 1.5 * (1 - dealer_blackjack)
+    if not dealer_peeks_for_blackjack:  # The dealer's blackjack is already in the results.
+        return max(profits[:5])
+    return -dealer_blackjack + (1 - dealer_blackjack) * max(profits[:5])
+
+
+def deal_probability(cards: tuple[int, int], dealer_up_card: int, counts: tuple[int, ...]) -> float:
+    """
+    Get the probability of dealing two cards to the player and an up card to the dealer.
+
+    :param cards: The player's first two cards, in any order.
+    :param dealer_up_card: The dealer's up card.
+    :param counts: How many cards of each rank there are in the shoe, before the cards are dealt.
+    :return: The probability.
+    """
+    probability = 1. if cards[0] == cards[1] else 2.
+    left = list(counts)
+    for card in (dealer_up_card,) + cards:
+        probability *= left[card - 2] / sum(left)
+        left[card - 2] -= 1
+    return probability
+
+
+def effects_of_removal(shoe: Iterable[int] | ShoeCounts | None = None, cores: int = 1, cache_file: str | None = None,
+                       collect_stats: bool = False, deck_number: int = 6, max_splits: int = 1,
+                       dealer_peeks_for_blackjack: bool = True, das: bool = True, dealer_stands_soft_17: bool = True,
+                       surrender_allowed: bool = True) -> EffectsOfRemoval:
+    """
+    Calculate the expected return of a round and how much it changes when one card of each rank is removed.
+
+    Every round is played perfectly for its shoe. All 11 shoes are analysed in the same job: each hand is analysed in
+    all the shoes at once, so the dealer probabilities of the shoes are calculated together (see `perfect_mover_batch`),
+    and the hands against the same up card are given to the same process, so they share its caches.
+
+    :param shoe: The cards in the shoe (e.g. [2, 10, 11, 10, ...]), or how many cards of each rank there are
+        (`ShoeCounts`). If it is None, a full shoe of `deck_number` decks is used.
+    :param cores: How many processes to use.
+    :param cache_file: The file to store the results in (see `use_persistent_store`).
+    :param collect_stats: Whether the worker processes should print how their caches were used when they exit.
+    :param deck_number: How many decks the shoe has, if no shoe is given.
+    :param max_splits: How many times the player can split their hand.
+    :param dealer_peeks_for_blackjack: Whether the dealer peeks for blackjack.
+    :param das: Whether we can double after splitting.
+    :param dealer_stands_soft_17: Whether the dealer stands on soft 17.
+    :param surrender_allowed: Whether the player can surrender.
+    :return: The expected return of the shoe, the effect of removing each rank, and the frequency of each rank.
+    """
+    rules = RuleSet(deck_number, max_splits, dealer_peeks_for_blackjack, das, dealer_stands_soft_17, surrender_allowed)
+    full_shoe = ShoeCounts.from_decks(deck_number) if shoe is None else ShoeCounts(*counts_not_seen(shoe))
+    shoes = [full_shoe] + [full_shoe.remove_cards((card,)) for card in range(2, 12)]
+    hands = [(first, second) for first in range(2, 12) for second in range(first, 12)]
+    arguments = []
+    shoe_indices = []  # The shoes each hand can be dealt from.
+    for dealer_up_card in range(2, 12):
+        for cards in hands:
+            hand_shoes = [removed_shoe.remove_cards(cards + (dealer_up_card,)) for removed_shoe in shoes]
+            shoe_indices.append([index for index, counts in enumerate(hand_shoes) if min(counts) >= 0])
+            arguments.append((cards, dealer_up_card, [hand_shoes[index] for index in shoe_indices[-1]]))
+    analyse = partial(perfect_mover_batch, rules=rules)
+    if cores <= 1:
+        use_persistent_store(cache_file)
+        all_profits = list(itertools.starmap(analyse, arguments))
+    else:
+        table_files = [precomputed.path for precomputed in precomputed_tables]
+        with shared_table_for(cores) as table, multiprocessing.Pool(processes=cores, initializer=setup_worker_caches,
+                                                                    initargs=(cache_file, table, collect_stats,
+                                                                              table_files, *cache_budget())) as pool:
+            all_profits = pool.starmap(analyse, arguments, chunksize=len(hands))
+            pool.close()
+            pool.join()
+
+    expected_values = [0.] * len(shoes)
+    for (cards, dealer_up_card, hand_shoes), indices, shoe_profits in zip(arguments, shoe_indices, all_profits):
+        for index, counts, profits in zip(indices, hand_shoes, shoe_profits):
+            expected_values[index] += (deal_probability(cards, dealer_up_card, shoes[index])
+                                       * round_expected_value(cards, dealer_up_card, counts, profits,
+                                                              dealer_peeks_for_blackjack))
+    baseline = expected_values[0]
+    return EffectsOfRemoval(baseline, tuple(value - baseline for value in expected_values[1:]),
+                            tuple(count / sum(full_shoe) for count in full_shoe))
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(prog='Best Move Analysis',
                                      description='Accurately calculate the best possible action for any blackjack hand.')
-    parser.add_argument("-c", "--cards", required=True, help='The cards the player has. (examples: A,10 or 2,8,4)')
-    parser.add_argument("-d", "--dealer-card", required=True, help='The up card of the dealer. (examples: A or 3)')
-    parser.add_argument("--splits", default=1, type=int, help='How many times the player can split. '
-                                                              '(min: 1=fastest, fairly accurate; '
-                                                              'max: 3=slowest, super accurate; default: 1)')
+    parser.add_argument("-c", "--cards", help='The cards the player has. (examples: A,10 or 2,8,4)')
+    parser.add_argument("-d", "--dealer-card", help='The up card of the dealer. (examples: A or 3)')
+    parser.add_argument("--splits", type=int, help='How many times the player can split. '
+                                                   '(e.g. 3 for up to 4 hands; default: 1, or 3 with --time-budget)')
     parser.add_argument("--decks", default=6, type=int, help='How many decks the shoe starts with. (default: 6)')
     parser.add_argument("--shoe", help='The cards in the shoe before the cards were dealt. Overrides --decks. '
                                        '(format: 2,6,5,8,6,2,A,10,9,...)')
@@ -634,17 +1825,87 @@ if __name__ == "__main__":
     parser.add_argument("--no-peek", action='store_true', help="Dealer doesn't peek for blackjack. (default: false)")
     parser.add_argument("--surrender", action='store_true', help='Allow surrendering. (default: true)')
     parser.add_argument("--no-surrender", action='store_true', help='Don\'t allow surrendering. (default: false)')
+    parser.add_argument("--cache-file", help='A file to store the results in, so later runs can reuse them. '
+                                             '(default: don\'t store)')
+    parser.add_argument("--stats", action='store_true', help='Print how the caches were used. (default: false)')
+    parser.add_argument("--batch", help='Analyse every position in a file instead of --cards and --dealer-card. '
+                                        'Use - to read from the standard input. (format: a csv file with the columns '
+                                        'cards, dealer_card, and optionally shoe, or a jsonl file with these fields)')
+    parser.add_argument("--output", default="-", help='Where to write the results of --batch or --eor. '
+                                                      '(default: - for the standard output)')
+    parser.add_argument("--format", choices=["csv", "jsonl"],
+                        help='The format of the --batch file and the results. (default: csv if the file ends in .csv, '
+                             'otherwise jsonl)')
+    parser.add_argument("--cores", default=1, type=int, help='How many cores to use for the hand, --batch, --build-table, '
+                                                             'and --eor. (default: 1)')
+    parser.add_argument("--table", action='append', default=[],
+                        help='A precomputed table (from --build-table) to answer hands dealt from a full shoe instantly. '
+                             'Can be used more than once for tables with different rules. (default: no tables)')
+    parser.add_argument("--build-table", help='Analyse every hand of 2 to 5 cards against every up card, dealt from a '
+                                              'full shoe with these rules, and write the results to this file.')
+    parser.add_argument("--eor", action='store_true', help='Calculate the effects of removal of each card from the shoe '
+                                                           '(--shoe or a full shoe of --decks) instead of analysing a '
+                                                           'hand. (default: false)')
+    parser.add_argument("--infinite-deck", action='store_true', help='Draw every card with the probabilities of the shoe, '
+                                                                     'instead of removing the cards that are drawn. '
+                                                                     'Much faster, but approximate. (default: false)')
+    parser.add_argument("--cache-mb", type=float,
+                        help='How much memory the caches of the best move analysis can take in each process, in '
+                             'megabytes. (default: no limit on memory, only on the number of results)')
+    parser.add_argument("--compact-cache", action='store_true',
+                        help='Store the cached results as 32-bit floats, which take less memory but are only accurate '
+                             'to about 7 significant digits. Only used with --cache-mb. (default: false)')
+    parser.add_argument("--time-budget", type=parse_duration,
+                        help='Answer within this time: analyse the hand without splitting first, then with more splits '
+                             'up to --splits while there is time left, and print the results of each. --cores is '
+                             'ignored. (e.g. 5s or 500ms; default: no limit)')
     args = parser.parse_args()
+    if not (args.batch or args.build_table or args.eor) and (args.cards is None or args.dealer_card is None):
+        parser.error("--cards and --dealer-card are required unless --batch, --build-table, or --eor is used.")
 
-    player_cards = tuple(map(lambda card: int(card.replace("A", "11")), args.cards.split(",")))
-    dealers_up_card = int(args.dealer_card.replace("A", "11"))
-    splits = args.splits
+    splits = args.splits if args.splits is not None else 3 if args.time_budget is not None else 1
     decks_number = args.decks
     stand_soft_17 = args.stand17 or (not args.hit17)
     das_allowed = args.das or (not args.no_das)
     peek_for_bj = args.peek or (not args.no_peek)
     surrender_allowed = args.surrender or (not args.no_surrender)
 
+    if args.stats:
+        enable_stats()
+    set_cache_budget(args.cache_mb, args.compact_cache)
+    use_precomputed_tables(args.table)
+
+    if args.build_table:
+        build_precomputed_table(args.build_table, decks_number, splits, peek_for_bj, das_allowed, stand_soft_17,
+                                surrender_allowed, args.cores)
+        sys.exit()
+
+    if args.eor:
+        eor_shoe = list(map(lambda shoe_card: int(shoe_card.replace("A", "11")), args.shoe.split(","))) if args.shoe else None
+        eor = effects_of_removal(eor_shoe, args.cores, args.cache_file, args.stats, decks_number, splits, peek_for_bj,
+                                 das_allowed, stand_soft_17, surrender_allowed)
+        eor_format = args.format or ("csv" if args.output.endswith(".csv") else "jsonl")
+        with open(args.output, "w", newline="") if args.output != "-" else nullcontext(sys.stdout) as output_file:
+            write_results(eor.rows(), output_file, eor_format)
+        print(f"Expected return: {eor.baseline}, Hi-Lo betting correlation: {eor.betting_correlation()}", file=sys.stderr)
+        if args.stats and args.cores <= 1:  # Otherwise, each worker prints its own stats.
+            print_cache_stats()
+        sys.exit()
+
+    if args.batch:
+        batch_format = args.format or ("csv" if args.batch.endswith(".csv") else "jsonl")
+        with (open(args.batch, newline="") if args.batch != "-" else nullcontext(sys.stdin)) as input_file, \
+                (open(args.output, "w", newline="") if args.output != "-" else nullcontext(sys.stdout)) as output_file:
+            write_results(analyse_queries(read_queries(input_file, batch_format), args.cores, args.cache_file,
+                                          args.stats, decks_number, splits, peek_for_bj, das_allowed, stand_soft_17,
+                                          surrender_allowed, args.infinite_deck), output_file, batch_format)
+        if args.stats and args.cores <= 1:  # Otherwise, each worker prints its own stats.
+            print_cache_stats()
+        sys.exit()
+
+    player_cards = tuple(map(lambda card: int(card.replace("A", "11")), args.cards.split(",")))
+    dealers_up_card = int(args.dealer_card.replace("A", "11"))
+
     if args.shoe:
         shoe = list(map(lambda shoe_card: int(shoe_card.replace("A", "11")), args.shoe.split(",")))
     else:
@@ -653,8 +1914,26 @@ if __name__ == "__main__":
     for player_or_dealer_card in player_cards + (dealers_up_card,):  # Remove the cards the player and the dealer have.
         shoe.remove(player_or_dealer_card)
 
+    use_persistent_store(args.cache_file)
+
+    if args.time_budget is not None:
+        analysed_splits = splits
+        for level in progressive_perfect_mover(player_cards, dealers_up_card, shoe, args.time_budget, True, True,
+                                               surrender_allowed, splits, peek_for_bj, das_allowed, stand_soft_17,
+                                               infinite_deck=args.infinite_deck):
+            print(level.describe())
+            analysed_splits = level.max_splits
+        if analysed_splits < splits and len(player_cards) == 2 and player_cards[0] == player_cards[1]:
+            print(f"Ran out of time before analysing {analysed_splits + 1} splits.")
+        if args.stats:
+            print_cache_stats()
+        sys.exit()
+
     best_profit, max_action, insurance_return = perfect_mover_cache(player_cards, dealers_up_card, shoe, True,
                                                                     True, surrender_allowed, splits,
                                                                     dealer_peeks_for_blackjack=peek_for_bj, das=das_allowed,
                                                                     dealer_stands_soft_17=stand_soft_17, print_profits=True,
-                                                                    plot_profits=True)
+                                                                    plot_profits=True, infinite_deck=args.infinite_deck,
+                                                                    cores=args.cores)
+    if args.stats:
+        print_cache_stats()
@@ -0,0 +1,198 @@
+"""Caches whose size is limited by the memory their entries take, instead of by their number of entries."""
+from __future__ import annotations
+from collections import OrderedDict
+from functools import lru_cache, update_wrapper
+from typing import Any, Callable, Generic, NamedTuple, TypeVar
+from cache_stats import ENTRY_OVERHEAD, deep_size
+import struct
+
+T = TypeVar("T")
+
+KEYWORD_MARK = object()  # Separates the positional from the keyword arguments in the keys, like `functools.lru_cache`.
+
+caches: list[BudgetCache[Any]] = []
+cache_megabytes: float | None = None
+compact_values = False
+
+
+class CacheInfo(NamedTuple):
+    """How a cache has been used, like the `cache_info` of `functools.lru_cache`."""
+
+    hits: int
+    misses: int
+    maxsize: int | None
+    currsize: int
+
+
+def pack_floats(value: Any) -> Any:
+    """
+    Store a tuple of floats as 32-bit floats, which takes about a quarter of the memory.
+
+    :param value: The value to store.
+    :return: The packed value, or the value itself if it isn't a tuple of floats.
+    """
+    if isinstance(value, tuple) and value and all(type(item) is float for item in value):
+        return struct.pack(f"{len(value)}f", *value)
+    return value
+
+
+def unpack_floats(value: Any) -> Any:
+    """
+    Get back a value stored by `pack_floats`. The floats are rounded to 32-bit precision (about 7 significant digits).
+
+    :param value: The stored value.
+    :return: The value.
+    """
+    if isinstance(value, bytes):
+        return struct.unpack(f"{len(value) // 4}f", value)
+    return value
+
+
+class BudgetCache(Generic[T]):
+    """
+    A least-recently-used cache of a function's results, with the same `cache_info` and `cache_clear` as
+    `functools.lru_cache`.
+
+    Without a memory budget (see `set_cache_budget`), the cache is a `functools.lru_cache` that keeps at most `maxsize`
+    entries. With a budget, it measures the memory of each entry (its arguments, its result, and the cache's own
+    overhead) and evicts the least recently used entries once the entries take more than its share of the budget.
+    """
+
+    def __init__(self, function: Callable[..., T], maxsize: int | None, share: float) -> None:
+        """
+        :param function: The function whose results to cache.
+        :param maxsize: How many entries to keep when there is no memory budget. None for no limit.
+        :param share: The share of the memory budget that this cache can use.
+        """
+        self.function = function
+        self.maxsize = maxsize
+        self.share = share
+        self.lru_function = lru_cache(maxsize=maxsize)(function)
+        self.call: Callable[..., T] = self.lru_function
+        self.entries: OrderedDict[Any, tuple[Any, int]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+        update_wrapper(self, function)
+        caches.append(self)
+
+    @property
+    def budget_bytes(self) -> int | None:
+        """
+        Get how much memory the entries can take.
+
+        :return: The budget of this cache in bytes, or None if there is no budget.
+        """
+        return int(cache_megabytes * 1_000_000 * self.share) if cache_megabytes is not None else None
+
+    def __call__(self, *arguments: Any, **keyword_arguments: Any) -> T:
+        """
+        Get the result of the function from the cache, or calculate it and store it.
+
+        :param arguments: The positional arguments of the function.
+        :param keyword_arguments: The keyword arguments of the function.
+        :return: The result of the function.
+        """
+        return self.call(*arguments, **keyword_arguments)
+
+    def budget_call(self, *arguments: Any, **keyword_arguments: Any) -> T:
+        """
+        Get the result of the function from the entries kept within the memory budget, or calculate it and store it.
+
+        :param arguments: The positional arguments of the function.
+        :param keyword_arguments: The keyword arguments of the function.
+        :return: The result of the function.
+        """
+        key = arguments + (KEYWORD_MARK,) + tuple(keyword_arguments.items()) if keyword_arguments else arguments
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return unpack_floats(entry[0])  # type: ignore[no-any-return]
+        self.misses += 1
+        result = self.function(*arguments, **keyword_arguments)
+        stored = pack_floats(result) if compact_values else result
+        budget = self.budget_bytes
+        size = deep_size(key) + deep_size(stored) + ENTRY_OVERHEAD
+        if key not in self.entries:  # A recursive call may have stored the same key already.
+            self.entries[key] = stored, size
+            self.bytes += size
+        while self.entries and budget is not None and self.bytes > budget:
+            _, (_, evicted_size) = self.entries.popitem(last=False)
+            self.bytes -= evicted_size
+            self.evictions += 1
+        return result
+
+    def cache_info(self) -> CacheInfo:
+        """
+        Get how the cache has been used.
+
+        :return: The hits, misses, maximum number of entries (None if there is a memory budget instead), and current
+            number of entries.
+        """
+        if self.call == self.lru_function:
+            return CacheInfo(*self.lru_function.cache_info())
+        return CacheInfo(self.hits, self.misses, None, len(self.entries))
+
+    def cache_clear(self) -> None:
+        """Remove every entry and reset the stats. The cache also starts using the current memory budget."""
+        self.lru_function.cache_clear()
+        self.entries.clear()
+        self.hits = self.misses = self.evictions = self.bytes = 0
+        self.call = self.lru_function if cache_megabytes is None else self.budget_call
+
+
+def budget_cache(maxsize: int | None, share: float) -> Callable[[Callable[..., T]], BudgetCache[T]]:
+    """
+    Cache the results of a function within a share of the memory budget (see `BudgetCache`).
+
+    :param maxsize: How many entries to keep when there is no memory budget. None for no limit.
+    :param share: The share of the memory budget that this cache can use. The shares of all caches should add up to 1.
+    :return: The decorator.
+    """
+    def decorator(function: Callable[..., T]) -> BudgetCache[T]:
+        return BudgetCache(function, maxsize, share)
+    return decorator
+
+
+def entries_within_budget(share: float, entry_bytes: int, maxsize: int) -> int:
+    """
+    Get how many entries of about the same size fit in a share of the memory budget, for caches that can't measure
+    each entry.
+
+    :param share: The share of the memory budget that the cache can use.
+    :param entry_bytes: The memory of an entry in bytes.
+    :param maxsize: How many entries to keep when there is no memory budget.
+    :return: How many entries to keep.
+    """
+    if cache_megabytes is None:
+        return maxsize
+    return int(cache_megabytes * 1_000_000 * share) // entry_bytes
+
+
+def cache_budget() -> tuple[float | None, bool]:
+    """
+    Get the memory budget of the caches of this process, to give the same budget to worker processes.
+
+    :return: The budget in megabytes (None if there is no budget), and whether tuples of floats are stored compactly.
+    """
+    return cache_megabytes, compact_values
+
+
+def set_cache_budget(megabytes: float | None, compact: bool = False) -> None:
+    """
+    Limit the memory of the caches of this process. Each cache gets its share of the budget.
+
+    The entries that are already cached are cleared, as they were measured with the previous budget.
+
+    :param megabytes: The memory all caches can take together, in megabytes. None to limit them by their number of
+        entries instead.
+    :param compact: Whether to store tuples of floats as 32-bit floats, if there is a budget. They take about a quarter
+        of the memory, but the cached results are only accurate to about 7 significant digits.
+    """
+    global cache_megabytes, compact_values
+    cache_megabytes = megabytes
+    compact_values = compact
+    for cache in caches:
+        cache.cache_clear()
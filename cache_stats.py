@@ -0,0 +1,137 @@
+"""Measure how well the caches of the best move analysis work, to help choose their sizes."""
+from __future__ import annotations
+from functools import wraps
+from typing import Any, Callable, NamedTuple, Protocol, TypeVar
+from utils import readable_number
+import sys
+import time
+
+T = TypeVar("T")
+
+ENTRY_OVERHEAD = 100  # The bytes `lru_cache` uses for each entry (its linked list node and dictionary slot).
+
+enabled = False
+time_spent: dict[str, float] = {}
+entry_bytes: dict[str, list[int]] = {}  # The total size and the number of entries measured.
+child_time: list[float] = []
+
+
+class CachedFunction(Protocol):
+    """A function wrapped with `functools.lru_cache`."""
+
+    def cache_info(self) -> tuple[int, int, int | None, int]:
+        """Get the hits, misses, maximum size, and current size of the cache."""
+
+
+class CacheStats(NamedTuple):
+    """How a cache has been used."""
+
+    hits: int
+    misses: int
+    evictions: int
+    size: int
+    max_size: int | None
+    estimated_bytes: int
+    seconds: float
+    budget_bytes: int | None = None
+
+
+def enable_stats() -> None:
+    """Start measuring the time spent in and the size of the entries of cached functions."""
+    global enabled
+    enabled = True
+
+
+def stats_enabled() -> bool:
+    """
+    Get whether stats are being collected in this process, to collect them in worker processes too.
+
+    :return: Whether `enable_stats` was called.
+    """
+    return enabled
+
+
+def deep_size(value: object) -> int:
+    """
+    Estimate the memory used by a value and the tuples inside it.
+
+    :param value: The value (e.g. the arguments of a function).
+    :return: The estimated size in bytes.
+    """
+    if isinstance(value, tuple):
+        return sys.getsizeof(value) + sum(map(deep_size, value))
+    return sys.getsizeof(value)
+
+
+def timed(function: Callable[..., T]) -> Callable[..., T]:
+    """
+    Measure the time spent calculating the results of a function and the size of its results, if stats are enabled.
+
+    The time of nested timed functions is only counted once, in the function that spent it.
+    It should be placed under `lru_cache`, so only cache misses are measured.
+
+    :param function: The function to measure.
+    :return: The measured function.
+    """
+    name = function.__name__
+    time_spent[name] = 0.
+    entry_bytes[name] = [0, 0]
+
+    @wraps(function)
+    def timed_function(*arguments: Any) -> T:
+        if not enabled:
+            return function(*arguments)
+        start = time.perf_counter()
+        child_time.append(0.)
+        try:
+            result = function(*arguments)
+        finally:
+            elapsed = time.perf_counter() - start
+            time_spent[name] += elapsed - child_time.pop()
+            if child_time:
+                child_time[-1] += elapsed
+        entry_bytes[name][0] += deep_size(arguments) + deep_size(result) + ENTRY_OVERHEAD
+        entry_bytes[name][1] += 1
+        return result
+    return timed_function
+
+
+def get_cache_stats(functions: dict[str, CachedFunction]) -> dict[str, CacheStats]:
+    """
+    Get how the caches of some functions have been used.
+
+    :param functions: The cached functions and their names.
+    :return: The stats of each cache. The estimated bytes and the time spent are only measured after `enable_stats`,
+        unless the cache measures its own memory (see `budget_cache.BudgetCache`).
+    """
+    stats = {}
+    for name, function in functions.items():
+        hits, misses, max_size, size = function.cache_info()
+        total_bytes, entries_measured = entry_bytes.get(name, [0, 0])
+        estimated_bytes = size * total_bytes // entries_measured if entries_measured else 0
+        evictions = max(misses - size, 0) if max_size is not None else 0
+        budget_bytes = getattr(function, "budget_bytes", None)
+        if budget_bytes is not None:  # The cache measured its own entries.
+            estimated_bytes = getattr(function, "bytes")
+            evictions = getattr(function, "evictions")
+        stats[name] = CacheStats(hits, misses, evictions, size, max_size, estimated_bytes, time_spent.get(name, 0.),
+                                 budget_bytes)
+    return stats
+
+
+def format_cache_stats(stats: dict[str, CacheStats]) -> str:
+    """
+    Turn the stats of the caches into readable text.
+
+    :param stats: The stats of each cache (from `get_cache_stats`).
+    :return: One line for each cache.
+    """
+    lines = []
+    for name, cache in stats.items():
+        max_size = readable_number(cache.max_size) if cache.max_size is not None else "unlimited"
+        if cache.budget_bytes is not None:
+            max_size = f"{readable_number(cache.budget_bytes)}B budget"
+        lines.append(f"{name}: Hits: {readable_number(cache.hits)}, Misses: {readable_number(cache.misses)}, "
+                     f"Evictions: {readable_number(cache.evictions)}, Size: {readable_number(cache.size)}/{max_size}, "
+                     f"Estimated memory: {readable_number(cache.estimated_bytes)}B, Time: {round(cache.seconds, 3)}s")
+    return "\n".join(lines)
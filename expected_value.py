@@ -1,16 +1,21 @@
 """Estimate the expected value of a given strategy."""
 from __future__ import annotations
-from utils import get_cards_seen, DECK, readable_number
+from utils import get_cards_seen, DECK, readable_number, RuleSet
 from action_strategies import BaseMover
 from betting_strategies import BaseBetter
+from best_move import precomputed_tables, print_cache_stats, setup_worker_caches, use_precomputed_tables
+from shared_cache import SharedResultTable, shared_table_for
+from budget_cache import cache_budget, set_cache_budget
+from result_store import MAX_BUCKET_SIZE
 from collections import deque
-from typing import Iterable
-import matplotlib.pyplot as plt
+from typing import Iterable, Sequence
 import random
 import betting_strategies
 import action_strategies
 import argparse
 import multiprocessing
+import os
+import cache_stats
 
 
 class Hand:
@@ -73,8 +78,8 @@ def get_card_from_shoe(shoe: list[int]) -> int:
     return card
 
 
-def get_mover_and_better(mover_name: str, better_name: str
-                         ) -> tuple[action_strategies.BaseMover, betting_strategies.BaseBetter]:
+def get_mover_and_better(mover_name: str, better_name: str, bucket_size: int = 1, validation_rate: float = .01,
+                         infinite_deck: bool = False) -> tuple[action_strategies.BaseMover, betting_strategies.BaseBetter]:
     """
     Get the mover and the better from the arguments passed by the user.
 
@@ -82,6 +87,9 @@ def get_mover_and_better(mover_name: str, better_name: str
         then in checks if there is a class of that name.
     :param better_name: The name of the better to use. If it isn't one of the recognized names,
         then in checks if there is a class of that name.
+    :param bucket_size: The size of the buckets of the perfect mover (see `action_strategies.PerfectMover`).
+    :param validation_rate: How often the perfect mover checks the error of its buckets.
+    :param infinite_deck: Whether the perfect mover uses the infinite-deck engine (see `action_strategies.PerfectMover`).
     :return: The mover and the better to use, already set up.
     """
     mover_class: action_strategies.BaseMover
@@ -114,7 +122,7 @@ def get_mover_and_better(mover_name: str, better_name: str
     elif mover_name == "basic-strategy":
         mover_class = action_strategies.BasicStrategyMover("data/6deck_s17_das_peek_basic_strategy.csv")
     elif mover_name == "perfect":
-        mover_class = action_strategies.PerfectMover()
+        mover_class = action_strategies.PerfectMover(bucket_size, validation_rate, infinite_deck)
     elif mover_name == "simple":
         mover_class = action_strategies.SimpleMover()
     else:  # Run a user-defined class.
@@ -134,6 +142,16 @@ def get_mover_and_better(mover_name: str, better_name: str
     return mover_class, better_class
 
 
+def print_bucketing_error(action_class: action_strategies.BaseMover) -> None:
+    """
+    Print the largest errors caused by the buckets of the perfect mover, if it uses buckets.
+
+    :param action_class: The class that chose the actions.
+    """
+    if isinstance(action_class, action_strategies.PerfectMover) and action_class.bucket_size > 1:
+        print(f"{action_class.bucketing_error()} (process {os.getpid()})")
+
+
 def play_dealer(dealer_cards: Iterable[int], shoe: list[int], dealer_stands_soft_17: bool) -> int:
     """
     Play the dealers hand to get its final value.
@@ -152,8 +170,7 @@ def play_dealer(dealer_cards: Iterable[int], shoe: list[int], dealer_stands_soft
 
 def play_hand(action_class: action_strategies.BaseMover,
               hand_cards: list[list[int]], dealer_up_card: int, dealer_down_card: int, shoe: list[int],
-              splits_remaining: int, deck_number: int, dealer_peeks_for_blackjack: bool = True, das: bool = True,
-              dealer_stands_soft_17: bool = True) -> tuple[list[list[int]], int]:
+              splits_remaining: int, rules: RuleSet) -> tuple[list[list[int]], int]:
     """
     Play hands but don't play the dealer.
 
@@ -163,10 +180,7 @@ def play_hand(action_class: action_strategies.BaseMover,
     :param dealer_down_card: The dealer's down card.
     :param shoe: The shoe.
     :param splits_remaining: How many more splits we can do.
-    :param deck_number: The number of decks in the initial shoe.
-    :param dealer_peeks_for_blackjack: Whether the dealer peeks for blackjack.
-    :param das: Whether we can double after splitting.
-    :param dealer_stands_soft_17: Whether the dealer stands on soft 17.
+    :param rules: The rules of the game, including the number of decks in the initial shoe.
     :return: The hands played out.
     """
     splits_used = 0
@@ -177,15 +191,14 @@ def play_hand(action_class: action_strategies.BaseMover,
             continue
         can_split = (splits_remaining > 0 and len(cards) == 2 and cards[0] == cards[1]
                      and (not cards[0] == 11 or splits_remaining == 3))
-        can_double = len(cards) == 2 and (das or splits_remaining == 3)
-        cards_seen = get_cards_seen(deck_number, shoe)
+        can_double = len(cards) == 2 and (rules.das or splits_remaining == 3)
+        cards_seen = get_cards_seen(rules.deck_number, shoe)
         cards_seen.remove(dealer_down_card)
         hand = Hand(cards)
         initial_hand_value, initial_hand_has_ace = hand.value_ace()
         action, insure = action_class.get_move(initial_hand_value, bool(initial_hand_has_ace), dealer_up_card,
                                                can_double,
-                                               can_split, False, False, cards, cards_seen, deck_number,
-                                               dealer_peeks_for_blackjack, das, dealer_stands_soft_17)
+                                               can_split, False, False, cards, cards_seen, rules)
 
         if action == "s":
             done_hands.append(cards)
@@ -199,9 +212,7 @@ def play_hand(action_class: action_strategies.BaseMover,
         elif action == "h":
             card = get_card_from_shoe(shoe)
             hand.add_card(card)
-            hand_cards, _ = play_hand(action_class, [hand.cards], dealer_up_card, dealer_down_card, shoe,
-                                      0, deck_number, dealer_peeks_for_blackjack, das,
-                                      dealer_stands_soft_17)
+            hand_cards, _ = play_hand(action_class, [hand.cards], dealer_up_card, dealer_down_card, shoe, 0, rules)
             done_hands.append(hand_cards[0])
 
         elif action == "p" and can_split:
@@ -211,16 +222,14 @@ def play_hand(action_class: action_strategies.BaseMover,
             card1 = get_card_from_shoe(shoe)
             hand1.add_card(card1)
             done_split_hands, splits_used_first_hand = play_hand(action_class, [hand1.cards], dealer_up_card,
-                                                                 dealer_down_card, shoe, splits_remaining - 1, deck_number,
-                                                                 dealer_peeks_for_blackjack, das, dealer_stands_soft_17)
+                                                                 dealer_down_card, shoe, splits_remaining - 1, rules)
             done_hands.extend(done_split_hands)
             splits_used += splits_used_first_hand
             card2 = get_card_from_shoe(shoe)
             hand2.add_card(card2)
             done_split_hands, splits_used_second_hand = play_hand(action_class, [hand2.cards] + hand_cards[hand_index + 1:],
                                                                   dealer_up_card, dealer_down_card, shoe,
-                                                                  splits_remaining - splits_used, deck_number,
-                                                                  dealer_peeks_for_blackjack, das, dealer_stands_soft_17)
+                                                                  splits_remaining - splits_used, rules)
             done_hands.extend(done_split_hands)
             splits_used += splits_used_second_hand
             break
@@ -233,8 +242,7 @@ def play_hand(action_class: action_strategies.BaseMover,
 def simulate_hand(action_class: action_strategies.BaseMover,
                   cards: list[int], dealer_up_card: int,
                   dealer_down_card: int, shoe: list[int],
-                  splits_remaining: int, deck_number: int, dealer_peeks_for_blackjack: bool = True, das: bool = True,
-                  dealer_stands_soft_17: bool = True, surrender_allowed: bool = True) -> float:
+                  splits_remaining: int, rules: RuleSet) -> float:
     """
     Play one hand.
 
@@ -244,34 +252,29 @@ def simulate_hand(action_class: action_strategies.BaseMover,
     :param dealer_down_card: The dealer's down card.
     :param shoe: The shoe.
     :param splits_remaining: How many more splits we can do.
-    :param deck_number: The number of decks in the initial shoe.
-    :param dealer_peeks_for_blackjack: Whether the dealer peeks for blackjack.
-    :param das: Whether we can double after splitting.
-    :param dealer_stands_soft_17: Whether the dealer stands on soft 17.
-    :param surrender_allowed: Whether the game rules allow surrendering.
+    :param rules: The rules of the game, including the number of decks in the initial shoe.
     :return: The profit/loss from the hand, and how many times we split.
     """
     can_split = (splits_remaining > 0 and len(cards) == 2 and cards[0] == cards[1]
                  and (not cards[0] == 11 or splits_remaining == 3))
-    can_double = len(cards) == 2 and (das or splits_remaining == 3)
-    can_surrender_now = surrender_allowed
+    can_double = len(cards) == 2 and (rules.das or splits_remaining == 3)
+    can_surrender_now = rules.surrender_allowed
     can_insure = dealer_up_card == 11
     insurance_profit = 0.
     dealer_has_blackjack = dealer_up_card + dealer_down_card == 21
     player_has_blackjack = cards[0] + cards[1] == 21
-    player_loses_all_bets = dealer_has_blackjack and not dealer_peeks_for_blackjack and not player_has_blackjack
-    cards_seen = get_cards_seen(deck_number, shoe)
+    player_loses_all_bets = dealer_has_blackjack and not rules.dealer_peeks_for_blackjack and not player_has_blackjack
+    cards_seen = get_cards_seen(rules.deck_number, shoe)
     cards_seen.remove(dealer_down_card)
     hand = Hand(cards)
     initial_hand_value, initial_hand_has_ace = hand.value_ace()
     action, insure = action_class.get_move(initial_hand_value, bool(initial_hand_has_ace), dealer_up_card, can_double,
-                                           can_split, can_surrender_now, can_insure, cards, cards_seen, deck_number,
-                                           dealer_peeks_for_blackjack, das, dealer_stands_soft_17)
+                                           can_split, can_surrender_now, can_insure, cards, cards_seen, rules)
 
     if insure and can_insure:
         insurance_profit = 1 if dealer_down_card == 10 else -.5
 
-    if dealer_peeks_for_blackjack:
+    if rules.dealer_peeks_for_blackjack:
         if dealer_has_blackjack and player_has_blackjack:  # Push
             return 0 + insurance_profit
         elif dealer_has_blackjack:  # Dealer blackjack
@@ -288,7 +291,7 @@ def simulate_hand(action_class: action_strategies.BaseMover,
         return -.5 + insurance_profit
 
     elif action == "s":
-        dealer_value = play_dealer((dealer_up_card, dealer_down_card), shoe, dealer_stands_soft_17)
+        dealer_value = play_dealer((dealer_up_card, dealer_down_card), shoe, rules.dealer_stands_soft_17)
         if player_loses_all_bets:
             return -1 + insurance_profit
         if initial_hand_value > dealer_value:
@@ -304,7 +307,7 @@ def simulate_hand(action_class: action_strategies.BaseMover,
             return -2 + insurance_profit
         if hand.value() > 21:
             return -2 + insurance_profit
-        dealer_value = play_dealer((dealer_up_card, dealer_down_card), shoe, dealer_stands_soft_17)
+        dealer_value = play_dealer((dealer_up_card, dealer_down_card), shoe, rules.dealer_stands_soft_17)
         if hand.value() > dealer_value:
             return +2 + insurance_profit
         elif hand.value() < dealer_value:
@@ -318,10 +321,9 @@ def simulate_hand(action_class: action_strategies.BaseMover,
             return -1 + insurance_profit
         if hand.value() > 21:
             return -1 + insurance_profit
-        hands, _ = play_hand(action_class, [hand.cards], dealer_up_card, dealer_down_card, shoe,
-                             splits_remaining, deck_number, dealer_peeks_for_blackjack, das, dealer_stands_soft_17)
+        hands, _ = play_hand(action_class, [hand.cards], dealer_up_card, dealer_down_card, shoe, splits_remaining, rules)
         hand = Hand(hands[0])
-        dealer_value = play_dealer((dealer_up_card, dealer_down_card), shoe, dealer_stands_soft_17)
+        dealer_value = play_dealer((dealer_up_card, dealer_down_card), shoe, rules.dealer_stands_soft_17)
         if hand.value() > 21 or dealer_value > hand.value():
             return -1 + insurance_profit
         elif hand.value() > dealer_value:
@@ -338,7 +340,7 @@ def simulate_hand(action_class: action_strategies.BaseMover,
             hand2.add_card(card)
             if player_loses_all_bets:
                 return -2 + insurance_profit
-            dealer_value = play_dealer((dealer_up_card, dealer_down_card), shoe, dealer_stands_soft_17)
+            dealer_value = play_dealer((dealer_up_card, dealer_down_card), shoe, rules.dealer_stands_soft_17)
             split_profit = 0
             if hand1.value() > 21 or dealer_value > hand1.value():
                 split_profit -= 1
@@ -352,17 +354,15 @@ def simulate_hand(action_class: action_strategies.BaseMover,
         card1 = get_card_from_shoe(shoe)
         hand1.add_card(card1)
         all_hands, splits_used = play_hand(action_class, [hand1.cards], dealer_up_card, dealer_down_card, shoe,
-                                           splits_remaining - 1, deck_number, dealer_peeks_for_blackjack, das,
-                                           dealer_stands_soft_17)
+                                           splits_remaining - 1, rules)
         card2 = get_card_from_shoe(shoe)
         hand2.add_card(card2)
         done_hands, _ = play_hand(action_class, [hand2.cards], dealer_up_card, dealer_down_card, shoe,
-                                  splits_remaining - 1 - splits_used, deck_number, dealer_peeks_for_blackjack, das,
-                                  dealer_stands_soft_17)
+                                  splits_remaining - 1 - splits_used, rules)
         all_hands += done_hands
         if player_loses_all_bets:
             return -len(all_hands) + insurance_profit
-        dealer_value = play_dealer((dealer_up_card, dealer_down_card), shoe, dealer_stands_soft_17)
+        dealer_value = play_dealer((dealer_up_card, dealer_down_card), shoe, rules.dealer_stands_soft_17)
         split_profit = 0
         for hand_cards in all_hands:
             hand = Hand(hand_cards)
@@ -399,6 +399,7 @@ def expected_value(action_class: action_strategies.BaseMover, betting_class: bet
     :param print_info: Whether to print information about the progress of the simulation. Disabled for multithreading.
     :return: The total return, the average return of a game, the average bet size, and the risk of ruin.
     """
+    rules = RuleSet(deck_number, 3, dealer_peeks_for_blackjack, das, dealer_stands_soft_17, surrender_allowed)
     starting_shoe = DECK * deck_number
     starting_number = len(starting_shoe)
     reshuffle_at = int(starting_number * shoe_penetration)
@@ -420,9 +421,8 @@ def expected_value(action_class: action_strategies.BaseMover, betting_class: bet
 
             cards_seen.extend([dealer_up_card] + player_cards)
 
-            reward = simulate_hand(action_class, player_cards, dealer_up_card,
-                                   dealer_down_card, shoe, 3, deck_number,
-                                   dealer_peeks_for_blackjack, das, dealer_stands_soft_17, surrender_allowed)
+            reward = simulate_hand(action_class, player_cards, dealer_up_card, dealer_down_card, shoe, rules.max_splits,
+                                   rules)
             reward *= initial_bet
             profit += reward
             bets.append(initial_bet)
@@ -456,13 +456,10 @@ def expected_value(action_class: action_strategies.BaseMover, betting_class: bet
     if print_info:
         print(f"Total profit: {profit}, Average profit: {avg_profit}, Average bet: {avg_bet}, "
               f"Average bet (if Wonging): {avg_non_zero_bet}, Risk of ruin: {risk_of_ruin}")
+        print_bucketing_error(action_class)
     if plot_profits:
-        plt.plot(profits_over_time_hand, label="Total profit")
-        plt.xlabel("Hands played")
-        plt.ylabel("Total profit")
-        plt.title("Profits over time")
-        plt.legend()
-        plt.show()
+        from plotting import plot_profits_over_time
+        plot_profits_over_time(profits_over_time_hand)
 
     return profit, avg_profit, avg_bet, avg_non_zero_bet, risk_of_ruin
 
@@ -473,7 +470,10 @@ def _expected_value_multithreading_wrapper(results: multiprocessing.Queue[tuple[
                                            simulations: int, deck_number: int = 6, shoe_penetration: float = .25,
                                            dealer_peeks_for_blackjack: bool = True, das: bool = True,
                                            dealer_stands_soft_17: bool = True, surrender_allowed: bool = True,
-                                           units: int = 200, hands_played: int = 1000) -> None:
+                                           units: int = 200, hands_played: int = 1000,
+                                           table: SharedResultTable | None = None, collect_stats: bool = False,
+                                           table_files: Sequence[str] = (), cache_megabytes: float | None = None,
+                                           compact_cache: bool = False) -> None:
     """
     Estimate the expected value of a strategy. Used inside multithreading. Don't use this function directly.
 
@@ -488,10 +488,17 @@ def _expected_value_multithreading_wrapper(results: multiprocessing.Queue[tuple[
     :param surrender_allowed: Whether the game rules allow surrendering.
     :param units: The number of units in total.
     :param hands_played: How many hands to play before checking the risk of ruin.
+    :param table: The table to share the results of the best move analysis with the other processes.
+    :param collect_stats: Whether to print how the caches of the best move analysis were used when the process exits.
+    :param table_files: The precomputed tables of the best move analysis to use.
+    :param cache_megabytes: The memory budget of the caches of the best move analysis (see `budget_cache.set_cache_budget`).
+    :param compact_cache: Whether the caches store tuples of floats compactly.
     """
+    setup_worker_caches(None, table, collect_stats, table_files, cache_megabytes, compact_cache)
     results.put(expected_value(action_class, betting_class, simulations, deck_number, shoe_penetration,
                                dealer_peeks_for_blackjack, das, dealer_stands_soft_17, surrender_allowed,
                                units, hands_played, False, False))
+    print_bucketing_error(action_class)
 
 
 def expected_value_multithreading(action_class: action_strategies.BaseMover, betting_class: betting_strategies.BaseBetter,
@@ -518,15 +525,19 @@ def expected_value_multithreading(action_class: action_strategies.BaseMover, bet
     """
     core_results: multiprocessing.Queue[tuple[float, float, float, float, float]] = multiprocessing.Queue()
     worker_pool = []
-    for _ in range(cores):
-        p = multiprocessing.Process(target=_expected_value_multithreading_wrapper,
-                                    args=(core_results, action_class, betting_class, total_simulations // cores,
-                                          deck_number, shoe_penetration, dealer_peeks_for_blackjack, das,
-                                          dealer_stands_soft_17, surrender_allowed, units, hands_played))
-        p.start()
-        worker_pool.append(p)
-    for p in worker_pool:
-        p.join()  # Wait for all the workers to finish.
+    # Only the perfect mover uses the best move analysis, so only it needs to share results.
+    with shared_table_for(cores if isinstance(action_class, action_strategies.PerfectMover) else 1) as table:
+        for _ in range(cores):
+            p = multiprocessing.Process(target=_expected_value_multithreading_wrapper,
+                                        args=(core_results, action_class, betting_class, total_simulations // cores,
+                                              deck_number, shoe_penetration, dealer_peeks_for_blackjack, das,
+                                              dealer_stands_soft_17, surrender_allowed, units, hands_played, table,
+                                              cache_stats.enabled, [precomputed.path for precomputed in precomputed_tables],
+                                              *cache_budget()))
+            p.start()
+            worker_pool.append(p)
+        for p in worker_pool:
+            p.join()  # Wait for all the workers to finish.
     profit = 0.
     avg_profit = 0.
     avg_bet = 0.
@@ -582,7 +593,34 @@ if __name__ == "__main__":
     parser.add_argument("--units", default=200, type=int, help='The number of units in total. (default: 200)')
     parser.add_argument("--hands-played", default=1000, type=int,
                         help='How many hands to play before checking the risk of ruin. (default: 1000)')
+    parser.add_argument("--stats", action='store_true', help='Print how the caches of the best move analysis were used '
+                                                             'by each process. (default: false)')
+    parser.add_argument("--bucket-size", default=1, type=int,
+                        help='Round deep shoes to buckets of this size in the perfect mover, so that similar shoes '
+                             'share results. Much faster, but only approximate. (default: 1 for exact results)')
+    parser.add_argument("--validation-rate", default=.01, type=float,
+                        help='How often the perfect mover checks the error of its buckets against the exact results. '
+                             '(default: 0.01)')
+    parser.add_argument("--table", action='append', default=[],
+                        help='A precomputed table of the best move analysis (see best_move.py --build-table), so the '
+                             'perfect mover answers the first hand of each shoe instantly. (default: no tables)')
+    parser.add_argument("--infinite-deck", action='store_true',
+                        help='Draw every card with the probabilities of the shoe in the perfect mover, instead of '
+                             'removing the cards that are drawn. Much faster, but approximate. (default: false)')
+    parser.add_argument("--cache-mb", type=float,
+                        help='How much memory the caches of the best move analysis can take in each process, in '
+                             'megabytes. (default: no limit on memory, only on the number of results)')
+    parser.add_argument("--compact-cache", action='store_true',
+                        help='Store the cached results as 32-bit floats, which take less memory but are only accurate '
+                             'to about 7 significant digits. Only used with --cache-mb. (default: false)')
     args = parser.parse_args()
+    if not 1 <= args.bucket_size <= MAX_BUCKET_SIZE:
+        parser.error(f"--bucket-size must be between 1 and {MAX_BUCKET_SIZE}.")
+
+    if args.stats:
+        cache_stats.enable_stats()
+    set_cache_budget(args.cache_mb, args.compact_cache)
+    use_precomputed_tables(args.table)
 
     decks_number = args.decks
     stand_soft_17 = args.stand17 or (not args.hit17)
@@ -597,7 +635,8 @@ if __name__ == "__main__":
         mover = BaseMover()  # Replace BaseMover with your own class.
         better = BaseBetter()  # Replace BaseBetter with your own class.
     else:
-        mover, better = get_mover_and_better(args.mover, args.better)
+        mover, better = get_mover_and_better(args.mover, args.better, args.bucket_size, args.validation_rate,
+                                             args.infinite_deck)
 
     if cores_used > 1:
         expected_value_multithreading(mover, better, args.simulations, cores_used, args.decks, args.deck_penetration,
@@ -605,3 +644,5 @@ if __name__ == "__main__":
     else:
         expected_value(mover, better, args.simulations, args.decks, args.deck_penetration, peek_for_bj, das_allowed,
                        stand_soft_17, can_surrender, args.units, args.hands_played)
+        if args.stats:
+            print_cache_stats()
@@ -0,0 +1,117 @@
+"""
+Plot the results of the simulator.
+
+Only imported when a plot is requested, so that the other modules (and the processes they start) don't have to import
+matplotlib, which is slow.
+"""
+from utils import list_range_str
+import matplotlib.pyplot as plt
+import matplotlib.patches as patches
+
+
+def plot_action_profits(profits: dict[str, float], best_action: str, get_insurance: bool) -> None:
+    """
+    Show a table with the expected returns of all possible actions, with the best move highlighted.
+
+    :param profits: The expected return of each possible action.
+    :param best_action: The action with the highest expected return.
+    :param get_insurance: Whether taking insurance is profitable.
+    """
+    result_table = [[action.title(), str(round(profits[action], 10))] for action in profits]
+    result_table_colors = [(["y", "y"] if action == best_action or action == "insurance" and get_insurance else ["w", "w"]
+                            ) for action in profits]
+    fig, ax = plt.subplots(dpi=200)
+    fig.patch.set_visible(False)
+    fig.set_size_inches(4, 2)
+    ax.set_yticklabels([])
+    ax.set_xticklabels([])
+    ax.set_xticks([])
+    ax.set_yticks([])
+    ax.spines['top'].set_visible(False)
+    ax.spines['right'].set_visible(False)
+    ax.spines['bottom'].set_visible(False)
+    ax.spines['left'].set_visible(False)
+    table = ax.table(result_table, result_table_colors, loc='center', cellLoc='center')
+    table.scale(1, 1.5)
+    ax.set_title("Actions and their expected returns")
+    ax.set_ylabel("Actions")
+    ax.set_xlabel("Expected Returns")
+    plt.tight_layout()
+    plt.show()
+
+
+def plot_profits_over_time(profits_over_time: list[float]) -> None:
+    """
+    Show how the total profit changed over time.
+
+    :param profits_over_time: The total profit after each hand.
+    """
+    plt.plot(profits_over_time, label="Total profit")
+    plt.xlabel("Hands played")
+    plt.ylabel("Total profit")
+    plt.title("Profits over time")
+    plt.legend()
+    plt.show()
+
+
+def action_colors(table: list[list[str]]) -> list[list[str]]:
+    """
+    Get the color of each cell of a basic strategy table.
+
+    :param table: The actions of each cell (e.g. "s", "dh", "p (0.12)").
+    :return: The color of each cell.
+    """
+    colors: list[list[str]] = [[] for _ in table]
+    codes = {"s": "y", "h": "w", "d": "g", "p": "c", "u": "r", "i": "maroon"}
+    for row_index, row in enumerate(table):
+        for action in row:
+            if action[:1] in codes:
+                colors[row_index].append(codes[action[:1]])
+    return colors
+
+
+def plot_strategy_tables(no_ace_table: list[list[str]], ace_table: list[list[str]], split_table: list[list[str]]
+                         ) -> None:
+    """
+    Show the basic strategy tables, with their expected returns.
+
+    :param no_ace_table: The actions for hard totals from 4 to 21 against each up card.
+    :param ace_table: The actions for soft totals from 12 to 21 against each up card.
+    :param split_table: The actions for pairs of 2s to aces against each up card.
+    """
+    for table_cells, title, row_labels, size, scale, legend_offset in (
+            (no_ace_table, "Hard totals", list_range_str(4, 22), 4.8, 1.1, -0.14),
+            (ace_table, "Soft totals", ["A,A"] + [f"A,{card}" for card in range(2, 11)], 3.2, 1.25, -0.23),
+            (split_table, "Pair Splitting", [f"{card},{card}" for card in range(2, 11)] + ["A,A"], 3.2, 1.25, -0.23)):
+        fig, ax = plt.subplots(dpi=200)
+
+        fig.patch.set_visible(False)
+        fig.set_size_inches(7, size)
+        ax.set_yticklabels([])
+        ax.set_xticklabels([])
+        ax.set_xticks([])
+        ax.set_yticks([])
+        ax.spines['top'].set_visible(False)
+        ax.spines['right'].set_visible(False)
+        ax.spines['bottom'].set_visible(False)
+        ax.spines['left'].set_visible(False)
+        ax.yaxis.set_label_coords(-0.12, 0)
+
+        table = ax.table(cellText=table_cells, cellColours=action_colors(table_cells), colLabels=list_range_str(2, 12),
+                         rowLabels=row_labels, loc='center', cellLoc='center')
+        table.scale(1.13, scale)
+        table.auto_set_font_size(False)
+        table.set_fontsize(3.5)
+
+        ax.set_title(title)
+        ax.set_xlabel("Dealer Up Card")
+        ax.set_ylabel("Player Cards")
+        ax.xaxis.tick_top()
+
+        handles = [patches.Rectangle((0, 0), .1, .1, facecolor=color, edgecolor='k', lw=.6)
+                   for color in ["y", "w", "g", "c", "r", "maroon"]]
+        ax.legend(handles, ["Stand", "Hit", "Double", "Split", "Surrender", "Insurance"], fontsize="xx-small",
+                  bbox_to_anchor=(0.5, legend_offset), ncol=6, loc=8)
+
+        plt.tight_layout()
+    plt.show()
@@ -0,0 +1,242 @@
+"""Store the results of the best move analysis in files, so they can be reused by later runs."""
+from __future__ import annotations
+from itertools import combinations_with_replacement
+import os
+import sqlite3
+import struct
+import time
+from typing import Iterable
+from utils import RuleSet
+import numpy as np
+import numpy.typing as npt
+
+PROFITS_FORMAT = "6d"
+USES_FLUSH_SIZE = 1000  # How many hits `ResultStore` remembers before it writes when they happened.
+POSITION_FORMAT = struct.Struct("<5BHHB")  # The up card, the options, the splits, the rules, the bucket size and pruning.
+MAX_BUCKET_SIZE = 65535  # The largest bucket size that fits in a key.
+
+
+def result_key(cards: tuple[int, ...], dealer_up_card: int, counts: Iterable[int], can_double: bool, can_insure: bool,
+               can_surrender: bool, max_splits: int, rules: int, bucket_size: int = 1, prune: bool = False) -> bytes:
+    """
+    Create a compact key that describes a position and the rules it is played with.
+
+    :param cards: The cards in the player's hand (sorted).
+    :param dealer_up_card: The dealer's up card.
+    :param counts: How many cards of each rank are left in the shoe.
+    :param can_double: Whether the player can double.
+    :param can_insure: Whether the player can take insurance.
+    :param can_surrender: Whether the player can surrender.
+    :param max_splits: How many times the player can split their hand.
+    :param rules: The rules of the game (`RuleSet.analysis_code`).
+    :param bucket_size: The size of the buckets of the dealer's shoes. 1 for exact results. At most `MAX_BUCKET_SIZE`.
+    :param prune: Whether only the best expected return was needed (see `best_move.perfect_mover`).
+    :return: The key.
+    """
+    if not 1 <= bucket_size <= MAX_BUCKET_SIZE:
+        raise ValueError(f"The bucket size must be between 1 and {MAX_BUCKET_SIZE}, not {bucket_size}.")
+    position = POSITION_FORMAT.pack(dealer_up_card, can_double, can_insure, can_surrender, max_splits, rules, bucket_size,
+                                    prune)
+    counts = tuple(counts)
+    return position + bytes((len(cards),) + cards) + struct.pack(f"<{len(counts)}H", *counts)
+
+
+class ResultStore:
+    """
+    A SQLite file that keeps the expected returns of positions that have already been analysed.
+
+    Reading a position doesn't write to the file, so processes that share the store don't wait for each other's reads.
+    When each position was last used is remembered in memory, and written when a position is stored, when positions
+    are evicted, when `USES_FLUSH_SIZE` hits are remembered, and when the store is closed.
+    """
+
+    def __init__(self, path: str, max_entries: int = 1_000_000) -> None:
+        """
+        :param path: The file to store the results in. It is created if it doesn't exist.
+        :param max_entries: How many positions to keep. When there are more, the least recently used ones are deleted.
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.entries = 0
+        self._connection: sqlite3.Connection | None = None
+        self._pid = 0
+        self.uses: dict[bytes, int] = {}  # When the positions that were read were last used, until it is written.
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """
+        Get the connection to the file. Each process opens its own connection, so the store can be used by worker processes.
+
+        :return: The connection.
+        """
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, timeout=60)
+            self._pid = os.getpid()
+            self.uses = {}  # Only the process that read the positions writes when they were used.
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS results "
+                                     "(key BLOB PRIMARY KEY, profits BLOB NOT NULL, last_used INTEGER NOT NULL)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+            self._connection.commit()
+            self.entries = len(self)
+        return self._connection
+
+    def get(self, key: bytes) -> tuple[float, ...] | None:
+        """
+        Get the expected returns of a position.
+
+        :param key: The position's key (from `result_key`).
+        :return: The expected returns of all 6 possible actions, or None if the position isn't stored.
+        """
+        row = self.connection.execute("SELECT profits FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        self.uses[key] = time.time_ns()
+        if len(self.uses) >= USES_FLUSH_SIZE:
+            self.flush_uses()
+        return struct.unpack(PROFITS_FORMAT, row[0])
+
+    def flush_uses(self) -> None:
+        """Write when the positions that were read were last used, so they aren't evicted before older ones."""
+        if self.uses:
+            with self.connection:
+                self.connection.executemany("UPDATE results SET last_used = ? WHERE key = ?",
+                                            [(used, key) for key, used in self.uses.items()])
+            self.uses.clear()
+
+    def put(self, key: bytes, profits: tuple[float, ...]) -> None:
+        """
+        Store the expected returns of a position, and evict the least recently used positions if the store is full.
+
+        :param key: The position's key (from `result_key`).
+        :param profits: The expected returns of all 6 possible actions.
+        """
+        self.uses.pop(key, None)
+        self.flush_uses()
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+                                    (key, struct.pack(PROFITS_FORMAT, *profits), time.time_ns()))
+        self.entries += 1
+        if self.entries > self.max_entries:
+            self.evict()
+
+    def evict(self) -> None:
+        """Delete the least recently used positions until the store is at 90% of its size budget."""
+        self.flush_uses()
+        self.entries = len(self)  # Other processes may have added positions too.
+        excess = self.entries - self.max_entries * 9 // 10
+        if self.entries > self.max_entries and excess > 0:
+            with self.connection:
+                self.connection.execute("DELETE FROM results WHERE key IN "
+                                        "(SELECT key FROM results ORDER BY last_used LIMIT ?)", (excess,))
+            self.entries -= excess
+
+    def close(self) -> None:
+        """Close the connection to the file."""
+        if self._connection is not None and self._pid == os.getpid():
+            self.flush_uses()
+            self._connection.close()
+        self._connection = None
+
+    def __len__(self) -> int:
+        """
+        Get how many positions are stored.
+
+        :return: The number of positions.
+        """
+        return int(self.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0])
+
+
+TABLE_MAGIC = b"BJPT"
+TABLE_VERSION = 1
+TABLE_HEADER = struct.Struct("<4s7BI")  # Magic, version, decks, splits, peek, das, soft 17, surrender, and hands.
+TABLE_HEADER_SIZE = 64  # The header is padded, so the expected returns are aligned.
+
+
+def hand_value(cards: tuple[int, ...]) -> int:
+    """
+    Get the value of a hand, counting aces as 1 when they would make the hand bust.
+
+    :param cards: The cards in the hand.
+    :return: The value of the hand.
+    """
+    value = sum(cards)
+    aces = cards.count(11)
+    while value > 21 and aces > 0:
+        value -= 10
+        aces -= 1
+    return value
+
+
+def table_hands(max_cards: int = 5) -> list[tuple[int, ...]]:
+    """
+    Get the hands a precomputed table has the expected returns of, in the order they are stored.
+
+    :param max_cards: The number of cards of the largest hands.
+    :return: Every sorted hand of 2 to `max_cards` cards that hasn't busted.
+    """
+    hands = []
+    for cards_number in range(2, max_cards + 1):
+        hands += [cards for cards in combinations_with_replacement(range(2, 12), cards_number) if hand_value(cards) <= 21]
+    return hands
+
+
+class PrecomputedTable:
+    """
+    A file with the expected returns of every hand against every dealer up card, when the hand is dealt from a full shoe.
+
+    The file is memory-mapped, so loading it is instant, and it is shared by every process that uses it.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        :param path: The file created by `write_precomputed_table`.
+        """
+        self.path = path
+        with open(path, "rb") as file:
+            header = file.read(TABLE_HEADER_SIZE)
+        (magic, version, deck_number, max_splits, peek, das, soft_17, surrender,
+         hands_number) = TABLE_HEADER.unpack_from(header)
+        if magic != TABLE_MAGIC or version != TABLE_VERSION:
+            raise ValueError(f"{path} isn't a precomputed table.")
+        self.rules = RuleSet(deck_number, max_splits, bool(peek), bool(das), bool(soft_17), bool(surrender))
+        self.hand_indices = {cards: index for index, cards in enumerate(table_hands())}
+        if hands_number != len(self.hand_indices):
+            raise ValueError(f"{path} was created for different hands.")
+        self.profits = np.memmap(path, np.float64, "r", TABLE_HEADER_SIZE, (hands_number, 10, 6))
+
+    def get(self, cards: tuple[int, ...], dealer_up_card: int) -> tuple[float, ...] | None:
+        """
+        Get the expected returns of a hand dealt from a full shoe.
+
+        :param cards: The cards in the player's hand (sorted).
+        :param dealer_up_card: The dealer's up card.
+        :return: The expected returns of all 6 possible actions, or None if the hand isn't in the table.
+        """
+        index = self.hand_indices.get(cards)
+        if index is None:
+            return None
+        profits = self.profits[index, dealer_up_card - 2]
+        if np.isnan(profits[0]):  # The shoe doesn't have enough cards for this hand.
+            return None
+        return tuple(profits.tolist())
+
+
+def write_precomputed_table(path: str, profits: npt.ArrayLike, rules: RuleSet) -> None:
+    """
+    Write a precomputed table. The file is replaced at once, so processes that are reading it never see half of it.
+
+    :param path: The file to write the table to.
+    :param profits: The expected returns of all 6 possible actions of each hand (in the order of `table_hands`)
+        against each dealer up card. NaN if the shoe doesn't have enough cards for the hand.
+    :param rules: The rules the hands were played with. The number of decks is the size of the full shoe.
+    """
+    profits = np.asarray(profits, np.float64)
+    header = TABLE_HEADER.pack(TABLE_MAGIC, TABLE_VERSION, rules.deck_number, rules.max_splits,
+                               rules.dealer_peeks_for_blackjack, rules.das, rules.dealer_stands_soft_17,
+                               rules.surrender_allowed, len(profits))
+    with open(f"{path}.tmp", "wb") as file:
+        file.write(header.ljust(TABLE_HEADER_SIZE, b"\0"))
+        file.write(profits.tobytes())
+    os.replace(f"{path}.tmp", path)
@@ -0,0 +1,140 @@
+"""Share the results of the best move analysis between processes."""
+from __future__ import annotations
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+from types import TracebackType
+from typing import Any, Iterator
+import hashlib
+import multiprocessing
+import struct
+
+MAX_PROBES = 32
+READY = 1
+
+
+class SharedResultTable:
+    """
+    A hash table in shared memory that maps positions (the arguments of `perfect_mover`) to expected returns.
+
+    The process that creates the table should pass it to the worker processes (e.g. through the arguments of a
+    `multiprocessing.Process` or the `initargs` of a `multiprocessing.Pool`). Every process can read results without
+    locking, and a lock is only held while publishing a new result. Slots are never overwritten, so once the table is
+    full, new results aren't shared.
+
+    Positions are identified by two independent 64-bit hashes: Python's hash of the position, which also chooses its
+    slot, and a BLAKE2b digest of its representation, so positions whose first hashes collide are still told apart. The
+    positions only contain integers and booleans, so both hashes are the same in every process.
+    """
+
+    def __init__(self, slots: int = 1 << 18, name: str | None = None, lock: Any = None) -> None:
+        """
+        :param slots: How many positions the table can hold. Each slot takes 65 bytes.
+        :param name: The name of an existing table to attach to. If it is None, a new table is created.
+        :param lock: The lock of the existing table.
+        """
+        self.slots = slots
+        self.owner = name is None
+        self.memory = shared_memory.SharedMemory(name=name, create=self.owner, size=slots * (16 + 48 + 1))
+        self.lock = multiprocessing.Lock() if lock is None else lock
+        buffer = self.memory.buf
+        assert buffer is not None
+        self.hashes = buffer[:slots * 16].cast("Q")
+        self.values = buffer[slots * 16:slots * (16 + 48)].cast("d")
+        self.states = buffer[slots * (16 + 48):slots * (16 + 48 + 1)]
+
+    def __getstate__(self) -> dict[str, Any]:
+        """
+        Send only the name of the shared memory to other processes.
+
+        :return: What is needed to attach to the table.
+        """
+        return {"slots": self.slots, "name": self.memory.name, "lock": self.lock}
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        """
+        Attach to the table in another process.
+
+        :param state: What is needed to attach to the table.
+        """
+        self.__init__(state["slots"], state["name"], state["lock"])  # type: ignore[misc]
+
+    def find(self, position: tuple[Any, ...]) -> tuple[int, bool, int, int]:
+        """
+        Find the slot of a position.
+
+        :param position: The position.
+        :return: The slot of the position (or the first empty slot, or -1 if there is no room), whether the position
+            was found, and the position's two hashes.
+        """
+        first_hash = hash(position) & 0xFFFF_FFFF_FFFF_FFFF
+        second_hash = int.from_bytes(hashlib.blake2b(repr(position).encode(), digest_size=8).digest(), "little")
+        index = first_hash % self.slots
+        for _ in range(MAX_PROBES):
+            if self.states[index] != READY:
+                return index, False, first_hash, second_hash
+            if self.hashes[2 * index] == first_hash and self.hashes[2 * index + 1] == second_hash:
+                return index, True, first_hash, second_hash
+            index = (index + 1) % self.slots
+        return -1, False, first_hash, second_hash
+
+    def get(self, position: tuple[Any, ...]) -> tuple[float, ...] | None:
+        """
+        Get the expected returns of a position.
+
+        :param position: The position.
+        :return: The expected returns of all 6 possible actions, or None if no process has published them.
+        """
+        index, found, _, _ = self.find(position)
+        return tuple(self.values[6 * index:6 * index + 6].tolist()) if found else None
+
+    def put(self, position: tuple[Any, ...], profits: tuple[float, ...]) -> None:
+        """
+        Publish the expected returns of a position to every process.
+
+        :param position: The position.
+        :param profits: The expected returns of all 6 possible actions.
+        """
+        with self.lock:
+            index, found, first_hash, second_hash = self.find(position)
+            if found or index == -1:
+                return
+            self.hashes[2 * index] = first_hash
+            self.hashes[2 * index + 1] = second_hash
+            self.values[6 * index:6 * index + 6] = memoryview(struct.pack("6d", *profits)).cast("d")
+            self.states[index] = READY  # Written last, so readers never see a half-written slot.
+
+    def close(self) -> None:
+        """Detach from the table. The process that created the table also frees the shared memory."""
+        for view in (self.hashes, self.values, self.states):
+            view.release()
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+    def __enter__(self) -> SharedResultTable:
+        """
+        Use the table as a context manager, so that it is freed at the end.
+
+        :return: The table.
+        """
+        return self
+
+    def __exit__(self, exc_type: type[BaseException] | None, exc_value: BaseException | None,
+                 traceback: TracebackType | None) -> None:
+        """Free the table."""
+        self.close()
+
+
+@contextmanager
+def shared_table_for(processes: int) -> Iterator[SharedResultTable | None]:
+    """
+    Create a table to share results between processes, if there is more than one process.
+
+    :param processes: How many processes will use the table.
+    :return: The table, or None if there is only one process.
+    """
+    if processes <= 1:
+        yield None
+        return
+    with SharedResultTable() as table:
+        yield table
@@ -1,6 +1,173 @@
 """Shoe generators."""
-from utils import get_hilo_true_count, DECK
+from __future__ import annotations
+from functools import lru_cache
+from typing import Iterable
+from utils import ShoeCounts
+import math
 import random
+import numpy as np
+import numpy.typing as npt
+
+LOW_RANKS = slice(0, 5)  # 2-6, which count +1 when they are seen (the indices of `ShoeCounts`).
+NEUTRAL_RANKS = slice(5, 8)  # 7-9.
+HIGH_RANKS = slice(8, 10)  # 10 and ace, which count -1 when they are seen.
+
+
+@lru_cache(maxsize=256)
+def hilo_states(low_cards: int, neutral_cards: int, high_cards: int, min_cards: int, true_counts: tuple[int, ...]
+                ) -> dict[int, tuple[npt.NDArray[np.int64], npt.NDArray[np.float64]]]:
+    """
+    Get how many low, neutral and high cards a shoe with each true count can have, and how likely each is.
+
+    The depth of the shoe is equally likely to be anywhere in the penetration range, and the cards that are left at that
+    depth are a random (multivariate hypergeometric) sample of the cards. Only the shoes with the true count are kept.
+
+    :param low_cards: How many low cards (2-6) can be in the shoe.
+    :param neutral_cards: How many neutral cards (7-9) can be in the shoe.
+    :param high_cards: How many high cards (10 and ace) can be in the shoe.
+    :param min_cards: How few cards the shoe can have before it is reshuffled.
+    :param true_counts: The true counts. A shoe with a true count between `true_count` and `true_count` + 0.3 (or
+        `true_count` - 0.3 for negative true counts, and both for 0) has that true count, like in `hilo_generator`.
+    :return: For each true count, the (low, neutral, high) cards of every possible shoe (one shoe per column), and the
+        cumulative probabilities of the shoes.
+    """
+    all_cards = low_cards + neutral_cards + high_cards
+    log_factorials = np.concatenate(([0.], np.cumsum(np.log(np.arange(1, all_cards + 1)))))
+    low = np.arange(low_cards + 1)[:, None, None]
+    neutral = np.arange(neutral_cards + 1)[None, :, None]
+    high = np.arange(high_cards + 1)[None, None, :]
+    size = low + neutral + high
+
+    def log_combinations(cards: int, chosen: npt.NDArray[np.int64]) -> npt.NDArray[np.float64]:
+        combinations: npt.NDArray[np.float64] = log_factorials[cards] - log_factorials[chosen] - log_factorials[cards - chosen]
+        return combinations
+
+    log_probabilities = (log_combinations(low_cards, low) + log_combinations(neutral_cards, neutral)
+                         + log_combinations(high_cards, high) - log_combinations(all_cards, size))
+    # The +1 and -1 are reversed as this is calculated for the unseen cards (see `utils.get_hilo_true_count`).
+    with np.errstate(divide="ignore", invalid="ignore"):
+        true_count = (high - low) / (size / 52)
+    nearest_count = np.where(true_count >= 0, np.floor(true_count), np.ceil(true_count))
+    valid = ((size >= max(min_cards, 1)) & (nearest_count - .3 * (nearest_count <= 0) <= true_count)
+             & (true_count <= nearest_count + .3 * (nearest_count >= 0)))
+
+    states = {}
+    for count in true_counts:
+        matching = valid & (nearest_count == count)
+        if not matching.any():
+            raise ValueError(f"No shoe with {low_cards + neutral_cards + high_cards} cards left and at least {min_cards}"
+                             f" cards in play has a true count of {count}.")
+        probabilities = np.exp(log_probabilities[matching] - log_probabilities[matching].max())
+        cumulative = np.cumsum(probabilities)
+        cards = np.stack([axis[matching] for axis in np.broadcast_arrays(low, neutral, high)])
+        states[count] = cards, cumulative / cumulative[-1]
+    return states
+
+
+def split_cards(generator: np.random.Generator, available: npt.NDArray[np.int64], totals: npt.NDArray[np.int64]
+                ) -> npt.NDArray[np.int64]:
+    """
+    Choose how many cards of each rank are in shoes, given how many cards of the ranks there are in total.
+
+    :param generator: The random number generator.
+    :param available: How many cards of each rank can be in a shoe.
+    :param totals: How many cards of the ranks are in each shoe.
+    :return: How many cards of each rank (columns) are in each shoe (rows).
+    """
+    counts = np.zeros((len(totals), len(available)), np.int64)
+    left = totals.copy()
+    for rank in range(len(available) - 1):
+        counts[:, rank] = generator.hypergeometric(available[rank], available[rank + 1:].sum(), left)
+        left -= counts[:, rank]
+    counts[:, -1] = left
+    return counts
+
+
+def hilo_compositions(true_counts: Iterable[int], decks: int, deck_penetration: float, cards_present: Iterable[int],
+                      shoes_number: int = 1, generator: np.random.Generator | None = None
+                      ) -> dict[int, npt.NDArray[np.int64]]:
+    """
+    Generate random shoes with specific true counts, by sampling how many cards of each rank they have directly.
+
+    :param true_counts: The target true counts.
+    :param decks: The maximum number of decks in the shoe.
+    :param deck_penetration: When to reshuffle the shoe (see `hilo_generator`).
+    :param cards_present: The cards we have already seen (see `hilo_generator`).
+    :param shoes_number: How many shoes to generate for each true count.
+    :param generator: The random number generator. If it is None, a new one is created.
+    :return: For each true count, how many cards of each rank (columns, as in `ShoeCounts`) are in each shoe (rows).
+    """
+    if generator is None:
+        generator = np.random.default_rng()
+    available = np.array(ShoeCounts.from_decks(decks).remove_cards(cards_present), np.int64)
+    states = hilo_states(int(available[LOW_RANKS].sum()), int(available[NEUTRAL_RANKS].sum()),
+                         int(available[HIGH_RANKS].sum()), math.ceil(52 * decks * deck_penetration), tuple(true_counts))
+
+    chosen = np.concatenate([cards[:, np.searchsorted(cumulative, generator.random(shoes_number), side="right")]
+                             for cards, cumulative in states.values()], axis=1)  # The shoes of all true counts at once.
+    compositions = np.concatenate([split_cards(generator, available[ranks], chosen[group])
+                                   for group, ranks in enumerate((LOW_RANKS, NEUTRAL_RANKS, HIGH_RANKS))], axis=1)
+    return {count: compositions[index * shoes_number:(index + 1) * shoes_number] for index, count in enumerate(states)}
+
+
+def split_cards_evenly(available: npt.NDArray[np.int64], total: int) -> npt.NDArray[np.int64]:
+    """
+    Split cards between ranks in proportion to how many cards of each rank can be in the shoe (the expected split).
+
+    :param available: How many cards of each rank can be in the shoe.
+    :param total: How many cards of the ranks are in the shoe.
+    :return: How many cards of each rank are in the shoe. The fractions are given to the ranks with the largest ones.
+    """
+    expected = available * total / max(available.sum(), 1)
+    counts: npt.NDArray[np.int64] = np.floor(expected).astype(np.int64)
+    counts[np.argsort(counts - expected, kind="stable")[:total - counts.sum()]] += 1
+    return counts
+
+
+def hilo_representative_shoes(true_counts: Iterable[int], decks: int, deck_penetration: float,
+                              cards_present: Iterable[int], points: int
+                              ) -> dict[int, tuple[npt.NDArray[np.int64], npt.NDArray[np.float64]]]:
+    """
+    Get a few shoes that represent all the shoes with specific true counts, weighted by their exact probabilities.
+
+    The shoes with each true count (see `hilo_states`) are split into `points` groups of equal probability, from the
+    shoes with the fewest cards left to the ones with the most. Each group is represented by its shoe that is closest to
+    the group's average, with the low, neutral and high cards split evenly between their ranks. No random numbers are
+    used, so the shoes are always the same.
+
+    :param true_counts: The target true counts.
+    :param decks: The maximum number of decks in the shoe.
+    :param deck_penetration: When to reshuffle the shoe (see `hilo_generator`).
+    :param cards_present: The cards we have already seen (see `hilo_generator`).
+    :param points: How many groups to split the shoes of each true count into.
+    :return: For each true count, how many cards of each rank (columns, as in `ShoeCounts`) are in each representative
+        shoe (rows), and the probability of each shoe's group.
+    """
+    available = np.array(ShoeCounts.from_decks(decks).remove_cards(cards_present), np.int64)
+    states = hilo_states(int(available[LOW_RANKS].sum()), int(available[NEUTRAL_RANKS].sum()),
+                         int(available[HIGH_RANKS].sum()), math.ceil(52 * decks * deck_penetration), tuple(true_counts))
+
+    shoes = {}
+    for count, (cards, cumulative) in states.items():
+        probabilities = np.diff(cumulative, prepend=0.)
+        order = np.argsort(cards.sum(axis=0), kind="stable")
+        middle_mass = np.cumsum(probabilities[order]) - probabilities[order] / 2
+        groups = np.minimum(middle_mass * points, points - 1).astype(np.int64)
+
+        compositions: dict[tuple[int, ...], float] = {}
+        for group in range(points):
+            members = order[groups == group]
+            if not len(members):
+                continue
+            weight = float(probabilities[members].sum())
+            average = (cards[:, members] * probabilities[members]).sum(axis=1) / weight
+            closest = cards[:, members[np.argmin(((cards[:, members].T - average) ** 2).sum(axis=1))]]
+            composition = tuple(np.concatenate([split_cards_evenly(available[ranks], int(closest[index]))
+                                                for index, ranks in enumerate((LOW_RANKS, NEUTRAL_RANKS, HIGH_RANKS))]
+                                               ).tolist())
+            compositions[composition] = compositions.get(composition, 0.) + weight
+        shoes[count] = np.array(list(compositions), np.int64), np.array(list(compositions.values()))
+    return shoes
 
 
 def hilo_generator(true_count: int, decks: int, deck_penetration: float, cards_present: list[int]) -> list[int]:
@@ -16,23 +183,7 @@ def hilo_generator(true_count: int, decks: int, deck_penetration: float, cards_p
         number of 3s is 6*4-2=22.
     :return: A shoe with a specific true count.
     """
-    max_true_count = true_count + .3 if true_count >= 0 else true_count
-    min_true_count = true_count - .3 if true_count <= 0 else true_count
-
-    all_cards = DECK * decks
-    for card in cards_present:
-        all_cards.remove(card)
-
-    while True:
-        shoe = all_cards.copy()
-        random.shuffle(shoe)
-        good_shoes = []
-
-        while len(shoe) >= 52 * decks * deck_penetration:
-            if min_true_count <= get_hilo_true_count(shoe) <= max_true_count:
-                good_shoes.append(shoe.copy())
-            shoe.pop()
-
-        if good_shoes:
-            break
-    return random.choice(good_shoes)
+    counts = hilo_compositions((true_count,), decks, deck_penetration, cards_present)[true_count][0]
+    shoe = [card for card, count in zip(range(2, 12), counts.tolist()) for _ in range(count)]
+    random.shuffle(shoe)
+    return shoe
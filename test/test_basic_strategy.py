@@ -1,13 +1,16 @@
 """Test the basic strategy generator."""
-from basic_strategy_generator import draw_and_export_tables
+import multiprocessing
+import os
+import tempfile
+import pytest
+from collections import Counter
+from basic_strategy_generator import (GeneratorCheckpoint, HandTask, TableSpec, add_weighted_profits, analyse_hands,
+                                      draw_and_export_tables, generate_data_tables, generate_test_shoes,
+                                      split_table_generator, true_count_filename)
+from utils import RuleSet, ShoeCounts
 
 
-def test_basic_strategy() -> None:
-    """Test the basic strategy generator."""
-    draw_and_export_tables(0, cores=2, filename="basic_strategy_generated_during_testing.csv", plot_results=False)
-    with open("basic_strategy_generated_during_testing.csv") as file:
-        test_contents = file.read()
-    correct_contents = """n4,h,h,h,h,h,h,h,h,h,h
+CORRECT_CONTENTS = """n4,h,h,h,h,h,h,h,h,h,h
 n5,h,h,h,h,h,h,h,h,h,h
 n6,h,h,h,h,h,h,h,h,h,h
 n7,h,h,h,h,h,h,h,h,h,h
@@ -46,4 +49,130 @@ s9,p,p,p,p,p,s,p,p,s,s
 s10,s,s,s,s,s,s,s,s,s,s
 s11,p,p,p,p,p,p,p,p,p,p
 """
-    assert test_contents == correct_contents
+
+
+def test_basic_strategy() -> None:
+    """Test the basic strategy generator."""
+    draw_and_export_tables(0, cores=2, filename="basic_strategy_generated_during_testing.csv", plot_results=False)
+    with open("basic_strategy_generated_during_testing.csv") as file:
+        test_contents = file.read()
+    assert test_contents == CORRECT_CONTENTS
+
+
+def test_infinite_deck_basic_strategy() -> None:
+    """Test the basic strategy generator with the infinite-deck engine. It finds the same strategy for 6 decks."""
+    draw_and_export_tables(0, cores=2, filename="basic_strategy_generated_during_testing.csv", plot_results=False,
+                           infinite_deck=True)
+    with open("basic_strategy_generated_during_testing.csv") as file:
+        test_contents = file.read()
+    assert test_contents == CORRECT_CONTENTS
+
+
+def test_add_weighted_profits() -> None:
+    """Test that the expected returns are weighted by how many of the tested combinations are the hand."""
+    row = [0.] * 7
+    add_weighted_profits(row, (.5, .25, .75, -1000., -.5, .1), 3, 3)
+    add_weighted_profits(row, (-.5, .25, .5, -1000., -.5, .1), 1, 3)
+    assert row == [1., 1., 2.75, -4000., -4000., -4000., 4.]
+
+
+def test_generate_test_shoes() -> None:
+    """Test that the shoes generated more than once are only tested once, with a higher weight."""
+    assert generate_test_shoes((10, 6), 10, 6, None, 30, .25) == ((ShoeCounts.from_decks(6).remove_cards((10, 6, 10)),),
+                                                                  (1,))
+    shoes, weights = generate_test_shoes((10, 6), 10, 1, 2, 30, .75)
+    assert sum(weights) == 30 and len(set(shoes)) == len(shoes)
+    assert all(0 <= count <= maximum for shoe in shoes
+               for count, maximum in zip(shoe, ShoeCounts.from_decks(1).remove_cards((10, 6, 10))))
+
+
+def test_generator_checkpoint() -> None:
+    """Test that a resumed generation only analyses the missing hands, and that hands are only deleted when asked to."""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "checkpoint.db")
+        checkpoint = GeneratorCheckpoint(path, "infinite deck")
+        split_table = split_table_generator(infinite_deck=True, checkpoint=checkpoint)
+        assert len(checkpoint) == 100
+        results = checkpoint.results()
+        task, shoe_profits = results["split", None, (8, 8), 10]
+        checkpoint.put(task, [(1., 0., 0., 0., -.5, -1000.)])  # Only a reused result can make standing best.
+        checkpoint.connection.execute("DELETE FROM hands WHERE cards = ? AND dealer_up_card = 2", (bytes((2, 2)),))
+        checkpoint.connection.commit()
+        checkpoint.close()
+
+        with pytest.raises(ValueError):
+            GeneratorCheckpoint(path, "finite deck", resume=True)
+        checkpoint = GeneratorCheckpoint(path, "infinite deck", resume=True)
+        assert len(checkpoint) == 99
+        resumed_table = split_table_generator(infinite_deck=True, checkpoint=checkpoint)
+        assert resumed_table[8][10] == "s (1.0)"
+        resumed_table[8][10] = split_table[8][10]
+        assert resumed_table == split_table
+        assert checkpoint.results()["split", None, (2, 2), 2] == results["split", None, (2, 2), 2]
+        checkpoint.close()
+
+        with pytest.raises(ValueError):  # A restart that forgets to resume mustn't delete the results.
+            GeneratorCheckpoint(path, "infinite deck")
+        with pytest.raises(ValueError):
+            GeneratorCheckpoint(path, "infinite deck", resume=True, fresh=True)
+        checkpoint = GeneratorCheckpoint(path, "infinite deck", resume=True)
+        assert len(checkpoint) == 100
+        checkpoint.close()
+        checkpoint = GeneratorCheckpoint(path, "finite deck", fresh=True)
+        assert len(checkpoint) == 0
+        checkpoint.close()
+
+
+def test_repeated_generations() -> None:
+    """Test that a finished generation's checkpoint is replaced by the next generation, but an unfinished one isn't."""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "checkpoint.db")
+        tables = draw_and_export_tables(0, plot_results=False, infinite_deck=True, checkpoint_file=path)
+        assert draw_and_export_tables(0, plot_results=False, infinite_deck=True, checkpoint_file=path) == tables
+        assert draw_and_export_tables(0, true_count=2, plot_results=False, infinite_deck=True, checkpoint_file=path)
+
+        checkpoint = GeneratorCheckpoint(path, "infinite deck")  # A generation that is interrupted before it finishes.
+        split_table_generator(infinite_deck=True, checkpoint=checkpoint)
+        checkpoint.close()
+        with pytest.raises(ValueError):
+            draw_and_export_tables(0, plot_results=False, infinite_deck=True, checkpoint_file=path)
+        assert draw_and_export_tables(0, plot_results=False, infinite_deck=True, checkpoint_file=path, fresh=True) == tables
+
+
+def test_failing_hand() -> None:
+    """Test that an exception in a worker process is raised, and the pool can still be closed."""
+    empty_shoe = ShoeCounts.from_decks(0)  # Analysing a hand in an empty shoe raises an exception.
+    tasks = (HandTask((10, 6), 10, (empty_shoe,), (1.,), True, False, True, 3, "no_ace") for _ in range(20))
+    with multiprocessing.Pool(1) as pool:  # The window is full when the exception arrives, so the tasks wait to be sent.
+        with pytest.raises(ZeroDivisionError):
+            list(analyse_hands(pool, tasks, 2))
+
+
+def test_true_counts_in_one_pool() -> None:
+    """Test that the hands of many true counts and tables are analysed together, each with its own rules."""
+    specs = [TableSpec("no_ace", Counter({(8, 8): 4}), 0, 3), TableSpec("split", Counter({(8, 8): 1}), 1, 3)]
+    data_tables = generate_data_tables(specs, [-2, None, 2], 2, RuleSet(max_splits=3), .25, None, True, None)
+    assert set(data_tables) == {(name, true_count) for name in ("no_ace", "split") for true_count in (-2, None, 2)}
+    for (name, true_count), data_table in data_tables.items():
+        shoes = 1 if true_count is None else 3
+        for dealer_up_card in range(2, 12):
+            if name == "split":
+                assert data_table[8][dealer_up_card][6] == shoes
+                assert data_table[8][dealer_up_card][3] > -1000 * shoes  # Splitting was analysed.
+            else:
+                assert data_table[16][dealer_up_card]["all"][6] == 4 * shoes
+        if name == "no_ace":
+            assert data_table[16][11]["insurance"][3] == -1000 * 4 * shoes  # The no ace table can't split.
+
+    assert true_count_filename("strategy.csv", -10) == "strategy_tc_minus_10.csv"
+    assert true_count_filename("data/6deck_s17_das_peek.csv", 0) == "data/6deck_s17_das_peek_tc_0.csv"
+    assert true_count_filename("strategy.csv", 3) == "strategy_tc_plus_3.csv"
+
+
+def test_weighted_compositions() -> None:
+    """Test that the representative shoes give the same deviations in every run."""
+    specs = [TableSpec("no_ace", Counter({(10, 6): 4, (9, 7): 2}), 0, 5, True)]
+    data_tables = generate_data_tables(specs, [3], 1, RuleSet(), .25, None, True, None)
+    assert generate_data_tables(specs, [3], 1, RuleSet(), .25, None, True, None) == data_tables
+    for dealer_up_card in range(2, 12):
+        assert abs(data_tables["no_ace", 3][16][dealer_up_card]["all"][6] - 6) < 1e-9  # The probabilities add up to 1.
@@ -1,6 +1,12 @@
 """Test the best move analysis."""
-from best_move import perfect_mover_cache
-from utils import DECK
+from best_move import (perfect_mover_cache, perfect_mover, perfect_mover_batch, dealer_probabilities,
+                       dealer_probabilities_batch, split_hands_profit, analyse_queries, analyse_query, read_queries,
+                       write_results, bucket_counts, validate_bucketing, effects_of_removal,
+                       infinite_deck_mover, card_probabilities, parallel_perfect_mover,
+                       progressive_perfect_mover, parse_duration)
+from utils import DECK, RuleSet, ShoeCounts
+from typing import cast
+import io
 
 
 def test_best_move() -> None:
@@ -10,8 +16,167 @@ def test_best_move() -> None:
     for card in [11, 11, 11]:
         shoe.remove(card)
     results = perfect_mover_cache((11, 11), 11, tuple(shoe), max_splits=1, return_all_profits=True)
-    assert results == (-0.6664582487827273, -0.022205703672547265, -0.6202385156597964, 0.1271437956545917, -0.5,
+    assert results == (-0.6664582487827274, -0.022205703672547296, -0.6202385156597965, 0.12714379565459183, -0.5,
                        -0.033980582524271885)
 
     results = perfect_mover_cache((10, 10), 10, tuple(shoe), max_splits=2, return_all_profits=True)
-    assert results == (0.5542589949582133, -0.8662002899228858, -1.7324005798457716, 0.03259440081835285, -0.5, -1000.0)
+    assert results == (0.5542589949582133, -0.8662002899228858, -1.7324005798457716, 0.03259440081835291, -0.5, -1000.0)
+
+    counts = ShoeCounts.from_cards(shoe)
+    assert perfect_mover_cache((10, 10), 10, counts, max_splits=2, return_all_profits=True) == results
+
+    # Resplitting is optional, so more splits can't have a lower expected return.
+    split_profits = [cast(tuple[float, ...], perfect_mover_cache((8, 8), 10, counts, max_splits=max_splits,
+                                                                 return_all_profits=True))[3] for max_splits in (1, 2, 3)]
+    assert split_profits[0] < split_profits[1] < split_profits[2]
+    assert (split_hands_profit(11, 11, tuple(counts), 2, 2, True, True, RuleSet(can_resplit_aces=True).analysis_code)
+            > split_hands_profit(11, 11, tuple(counts), 2, 2, True, True, RuleSet().analysis_code))
+
+    outcomes = dealer_probabilities(10, tuple(counts), True, True)
+    assert abs(sum(outcomes) - 1) < 1e-12
+    assert outcomes[6] == 0  # The dealer peeked, so they can't have blackjack.
+    assert dealer_probabilities(10, tuple(counts), False, True)[6] > 0
+
+    shoes = [tuple(counts), tuple(counts.remove_cards([10, 10, 5])), tuple(counts.remove_cards([2, 3, 4, 6]))]
+    for dealer_up_card, dealer_peeks_for_blackjack, dealer_stands_soft_17 in ((11, True, False), (10, False, True),
+                                                                              (6, False, False)):
+        batch_outcomes = dealer_probabilities_batch(dealer_up_card, shoes, dealer_peeks_for_blackjack,
+                                                    dealer_stands_soft_17)
+        for shoe_counts, shoe_outcomes in zip(shoes, batch_outcomes):
+            outcomes = dealer_probabilities(dealer_up_card, shoe_counts, dealer_peeks_for_blackjack,
+                                            dealer_stands_soft_17)
+            assert max(abs(a - b) for a, b in zip(outcomes, shoe_outcomes)) < 1e-12
+
+    single_results = [cast(tuple[float, ...], perfect_mover_cache((10, 6), 10, ShoeCounts(*shoe_counts),
+                                                                  return_all_profits=True)) for shoe_counts in shoes]
+    perfect_mover.cache_clear()
+    batch_results = perfect_mover_batch((10, 6), 10, [ShoeCounts(*shoe_counts) for shoe_counts in shoes])
+    for shoe_results, batch_shoe_results in zip(single_results, batch_results):
+        assert max(abs(a - b) for a, b in zip(shoe_results, batch_shoe_results)) < 1e-12
+
+
+def test_batch() -> None:
+    """Test analysing a batch of positions."""
+    shoe = ",".join(map(str, DECK))
+    queries = io.StringIO(f'{{"id": 1, "cards": "8,8", "dealer_card": "10"}}\n\n'
+                          f'{{"id": 2, "cards": [11, 6], "dealer_card": "A", "shoe": "{shoe}"}}\n')
+    results = list(analyse_queries(read_queries(queries, "jsonl"), max_splits=2))
+    assert [result["id"] for result in results] == [1, 2]
+    profits = cast(tuple[float, ...], perfect_mover_cache((8, 8), 10, ShoeCounts.from_decks(6).remove_cards((8, 8, 10)),
+                                                          max_splits=2, return_all_profits=True))
+    assert [results[0][action] for action in ("stand", "hit", "double", "split", "surrender")] == list(profits[:5])
+    assert results[0]["insurance"] is None
+    assert results[0]["best_action"] == "split"
+    assert results[1]["split"] is None
+    assert results[1]["insurance"] is not None
+
+    output = io.StringIO()
+    write_results(analyse_queries(read_queries(io.StringIO('cards,dealer_card,hand\n"A,7",5,first\n10,A,second\n'), "csv"),
+                                  cores=2), output, "csv")
+    lines = output.getvalue().splitlines()
+    assert lines[0] == "cards,dealer_card,hand,stand,hit,double,split,surrender,insurance,best_action,error"
+    assert lines[1].startswith('"A,7",5,first,') and lines[1].endswith(",double,")
+    assert lines[2].startswith("10,A,second,")
+
+    impossible = analyse_query({"cards": "10,6", "dealer_card": "5", "shoe": "10,10,5"})
+    assert impossible["error"].startswith("ValueError") and impossible["stand"] is None
+
+    # A bad position among good ones gets an error, and the rest of the batch is still analysed.
+    queries = io.StringIO('{"id": 1, "cards": "10,6", "dealer_card": "10"}\n'
+                          '{"id": 2, "cards": "10,X", "dealer_card": "10"}\n'
+                          '{"id": 3, "cards": "10,6", "dealer_card": "5", "shoe": "10,10,5"}\n'
+                          '{"id": 4, "cards": "9,7", "dealer_card": "10"}\n')
+    results = list(analyse_queries(read_queries(queries, "jsonl"), cores=2))
+    assert [result["id"] for result in results] == [1, 2, 3, 4]
+    assert [result["error"] is None for result in results] == [True, False, False, True]
+    assert results[1]["best_action"] is None and results[1]["hit"] is None
+    assert results[3]["best_action"] == "surrender"
+
+
+def test_bucketing() -> None:
+    """Test putting the shoes into buckets."""
+    counts = tuple(ShoeCounts.from_decks(6).remove_cards((2, 2, 3, 5, 10)))
+    assert bucket_counts(counts, 4) == (24, 24, 24, 24, 24, 24, 24, 24, 96, 24)
+    assert bucket_counts(counts, 1) == counts
+    small_counts = tuple(ShoeCounts.from_decks(1).remove_cards((2, 3)))
+    assert bucket_counts(small_counts, 4) == small_counts
+
+    positions = [((10, 6), 10, ShoeCounts(*counts)), ((11, 7), 9, ShoeCounts(*counts).remove_cards((10,) * 20))]
+    error = validate_bucketing(positions, 4, max_splits=1)
+    assert error.positions == 2
+    assert 0 < error.max_error < .01
+    assert error.max_regret >= 0
+
+
+def test_effects_of_removal() -> None:
+    """Test calculating the effects of removal."""
+    shoe = ShoeCounts(1, 1, 1, 1, 1, 1, 1, 1, 4, 1)  # A small shoe, so the test is fast.
+    eor = effects_of_removal(shoe, cores=2, max_splits=1)
+    assert abs(sum(eor.frequencies) - 1) < 1e-12
+    assert eor.effects[5 - 2] > 0 > eor.effects[10 - 2]
+    assert eor.betting_correlation() > .8
+    assert abs(effects_of_removal(shoe.remove_cards((5,)), max_splits=1).baseline
+               - (eor.baseline + eor.effects[5 - 2])) < 1e-12
+    assert [row["card"] for row in eor.rows()] == ["2", "3", "4", "5", "6", "7", "8", "9", "10", "A"]
+
+
+def test_infinite_deck() -> None:
+    """Test the infinite-deck engine against the exact analysis of a very large shoe."""
+    shoe = ShoeCounts.from_decks(200)
+    for cards, dealer_up_card in (((10, 6), 10), ((8, 8), 10), ((11, 7), 9), ((5, 6), 11)):
+        counts = shoe.remove_cards(cards + (dealer_up_card,))
+        exact = cast(tuple[float, ...], perfect_mover_cache(cards, dealer_up_card, counts, max_splits=1,
+                                                            return_all_profits=True))
+        infinite = cast(tuple[float, ...], perfect_mover_cache(cards, dealer_up_card, counts, max_splits=1,
+                                                               return_all_profits=True, infinite_deck=True))
+        assert max(abs(a - b) for a, b in zip(exact, infinite)) < 2e-3
+    probabilities = card_probabilities(tuple(ShoeCounts.from_decks(6)), 2, False)
+    assert infinite_deck_mover((10, 10, 5), 6, probabilities)[0] == -1  # The hand is bust.
+    assert (infinite_deck_mover((11, 11), 6, probabilities, rules=RuleSet(can_resplit_aces=True).analysis_code)[3]
+            > infinite_deck_mover((11, 11), 6, probabilities)[3])
+
+
+def test_pruning() -> None:
+    """Test that pruning keeps the best action and its expected return exact."""
+    shoe = ShoeCounts.from_decks(2)
+    rules = RuleSet().analysis_code
+    for cards, dealer_up_card in (((10, 8), 6), ((9, 3), 4), ((2, 3), 6), ((11, 6), 3), ((8, 8), 10)):
+        counts = tuple(shoe.remove_cards(cards + (dealer_up_card,)))
+        exact = perfect_mover(cards, dealer_up_card, counts, True, True, True, 1, rules, 1, False)
+        pruned = perfect_mover(cards, dealer_up_card, counts, True, True, True, 1, rules, 1, True)
+        assert max(pruned[:5]) == max(exact[:5])
+        # Actions that can't be the best get an upper bound of their expected return.
+        assert all(pruned_profit >= exact_profit - 1e-12 for pruned_profit, exact_profit in zip(pruned, exact))
+        assert (perfect_mover_cache(cards, dealer_up_card, ShoeCounts(*counts), max_splits=1)
+                == perfect_mover_cache(cards, dealer_up_card, ShoeCounts(*counts), max_splits=1, prune=False))
+    counts = tuple(shoe.remove_cards((10, 8, 6)))
+    assert (perfect_mover((10, 8), 6, counts, True, True, True, 1, rules, 1, True)[1]
+            > perfect_mover((10, 8), 6, counts, True, True, True, 1, rules, 1, False)[1])  # Hitting hard 18 was pruned.
+
+
+def test_parallel_perfect_mover() -> None:
+    """Test that analysing the branches of a position in many processes gives exactly the same results."""
+    rules = RuleSet().analysis_code
+    for cards, dealer_up_card in (((8, 8), 10), ((5, 6), 6)):
+        counts = tuple(ShoeCounts.from_decks(1).remove_cards(cards + (dealer_up_card,)))
+        perfect_mover.cache_clear()
+        split_hands_profit.cache_clear()
+        parallel = parallel_perfect_mover(cards, dealer_up_card, counts, True, True, True, 2, rules, 1, False, 2)
+        perfect_mover.cache_clear()
+        split_hands_profit.cache_clear()
+        assert parallel == perfect_mover(cards, dealer_up_card, counts, True, True, True, 2, rules, 1, False)
+
+
+def test_progressive_perfect_mover() -> None:
+    """Test that the hand is analysed with more splits while there is time left."""
+    shoe = ShoeCounts.from_decks(1).remove_cards((8, 8, 10))
+    levels = list(progressive_perfect_mover((8, 8), 10, shoe, 600, max_splits=2))
+    assert [level.max_splits for level in levels] == [0, 1, 2]
+    for level in levels:
+        assert level.profits == perfect_mover_cache((8, 8), 10, shoe, max_splits=level.max_splits,
+                                                    return_all_profits=True)
+    assert [level.action_changed for level in levels] == [False, levels[1].best_action != levels[0].best_action,
+                                                          levels[2].best_action != levels[1].best_action]
+    assert [level.max_splits for level in progressive_perfect_mover((8, 8), 10, shoe, 0, max_splits=2)] == [0]
+    assert [level.max_splits for level in progressive_perfect_mover((9, 7), 10, shoe, 600, max_splits=2)] == [2]
+    assert parse_duration("5s") == parse_duration("5") == 5 and parse_duration("500ms") == .5
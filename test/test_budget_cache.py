@@ -0,0 +1,48 @@
+"""Test the caches limited by a memory budget."""
+from best_move import cache_stats, perfect_mover_cache, perfect_mover
+from budget_cache import BudgetCache, set_cache_budget
+from utils import ShoeCounts
+
+
+def test_budget_cache() -> None:
+    """Test that the caches stay within their budget and evict the least recently used entries."""
+    cache = BudgetCache(lambda counts: tuple(count / 3 for count in counts), 2, .5)
+    try:
+        cache((1, 2))
+        cache((1, 3))
+        cache((1, 2))
+        cache((1, 4))  # Over `maxsize`, so the least recently used entry is evicted.
+        assert cache.cache_info() == (1, 3, 2, 2)
+        cache((1, 2))
+        assert cache.cache_info().hits == 2
+
+        set_cache_budget(.01)  # 5 KB for this cache, about 8 entries.
+        assert cache.cache_info() == (0, 0, None, 0)
+        for count in range(20):
+            cache((count,) * 5)
+        assert 0 < cache.bytes <= 5000
+        assert cache.evictions == 20 - len(cache.entries)
+        assert ((19,) * 5,) in cache.entries and ((0,) * 5,) not in cache.entries
+
+        set_cache_budget(.01, compact=True)
+        assert cache((1, 2)) == (1 / 3, 2 / 3)
+        compact_result = cache((1, 2))
+        assert compact_result != (1 / 3, 2 / 3) and abs(compact_result[0] - 1 / 3) < 1e-7
+    finally:
+        set_cache_budget(None)
+
+
+def test_best_move_budget() -> None:
+    """Test that the best move analysis gives the same results within a memory budget."""
+    shoe = ShoeCounts.from_decks(1).remove_cards((9, 4, 10))
+    perfect_mover.cache_clear()
+    profits = perfect_mover_cache((9, 4), 10, shoe, return_all_profits=True)
+    try:
+        set_cache_budget(.1)
+        assert perfect_mover_cache((9, 4), 10, shoe, return_all_profits=True) == profits
+        stats = cache_stats()["perfect_mover"]
+        assert stats.budget_bytes == 25_000
+        assert 0 < stats.estimated_bytes <= stats.budget_bytes
+        assert stats.evictions > 0
+    finally:
+        set_cache_budget(None)
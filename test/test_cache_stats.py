@@ -0,0 +1,23 @@
+"""Test the cache stats."""
+from best_move import cache_stats, perfect_mover_cache, perfect_mover, dealer_final_probabilities
+from cache_stats import enable_stats, format_cache_stats
+from utils import ShoeCounts
+import cache_stats as cache_stats_module
+
+
+def test_cache_stats() -> None:
+    """Test that the stats count what the caches did."""
+    enable_stats()
+    perfect_mover.cache_clear()
+    dealer_final_probabilities.cache_clear()
+    shoe = ShoeCounts.from_decks(1).remove_cards((9, 4, 10))
+    perfect_mover_cache((9, 4), 10, shoe)
+    perfect_mover_cache((9, 4), 10, shoe)
+    stats = cache_stats()
+    assert stats["perfect_mover"].hits >= 1
+    assert stats["perfect_mover"].misses == stats["perfect_mover"].size
+    assert stats["perfect_mover"].evictions == 0
+    assert stats["perfect_mover"].estimated_bytes > 0
+    assert stats["dealer_final_probabilities"].seconds > 0
+    assert format_cache_stats(stats).startswith("perfect_mover: Hits: ")
+    cache_stats_module.enabled = False
@@ -2,6 +2,9 @@
 from expected_value import expected_value, expected_value_multithreading, get_mover_and_better
 from action_strategies import SimpleMover, PerfectMover, BaseMover
 from betting_strategies import SimpleBetter, BaseBetter
+from utils import RuleSet
+import subprocess
+import sys
 
 
 def test_expected_value() -> None:
@@ -19,7 +22,7 @@ def test_expected_value() -> None:
 
     try:
         BaseMover().get_move(12, True, 2, True, True, True,
-                             True, [10, 2], [10, 2, 2], 6, True, True, True)
+                             True, [10, 2], [10, 2, 2], RuleSet())
         assert False
     except NotImplementedError:
         pass
@@ -31,5 +34,27 @@ def test_expected_value() -> None:
         pass
 
     assert PerfectMover().get_move(12, True, 2, True, True, True,
-                                   True, [10, 2], [10, 2, 2], 6, True,
-                                   True, True) == ("hit", False)
+                                   True, [10, 2], [10, 2, 2], RuleSet()) == ("h", False)
+
+    mover = PerfectMover(bucket_size=4, validation_rate=1)
+    assert mover.get_move(12, True, 2, True, True, True,
+                          True, [10, 2], [10, 2, 2, 5], RuleSet()) == ("h", False)
+    error = mover.bucketing_error()
+    assert error.positions == 1
+    assert 0 < error.max_error < .01
+
+
+def test_perfect_mover_actions() -> None:
+    """Test that the perfect mover gives the same action codes as the other movers, so that it can be simulated."""
+    assert PerfectMover().get_move(19, False, 6, True, False, True,
+                                   True, [10, 9], [10, 9, 6], RuleSet()) == ("s", False)
+    assert PerfectMover().get_move(11, False, 6, True, False, True,
+                                   True, [6, 5], [6, 5, 6], RuleSet()) == ("d", False)
+
+
+def test_matplotlib_is_imported_lazily() -> None:
+    """Test that matplotlib is only imported when something is plotted, so new processes start quickly."""
+    imported = subprocess.run([sys.executable, "-c", "import expected_value, basic_strategy_generator, sys; "
+                                                     "print('matplotlib' in sys.modules)"],
+                              capture_output=True, text=True, check=True).stdout
+    assert imported.strip() == "False"
@@ -0,0 +1,77 @@
+"""Test the persistent store of best move results."""
+import os
+import tempfile
+import numpy as np
+import pytest
+from best_move import perfect_mover_cache, use_persistent_store, use_precomputed_tables
+from result_store import PrecomputedTable, ResultStore, result_key, table_hands, write_precomputed_table
+from utils import RuleSet, ShoeCounts
+
+
+def test_result_store() -> None:
+    """Test storing, reusing and evicting results."""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "results.db")
+        store = ResultStore(path, max_entries=10)
+        counts = ShoeCounts.from_decks(6)
+        rules = RuleSet().analysis_code
+        keys = [result_key((2, card), 10, counts, True, True, True, 0, rules) for card in range(2, 12)]
+        assert len(set(keys)) == 10
+        large_buckets = [result_key((2, 3), 10, counts, True, True, True, 0, rules, bucket_size)
+                         for bucket_size in (255, 256, 65535)]
+        assert len(set(large_buckets)) == 3
+        with pytest.raises(ValueError):
+            result_key((2, 3), 10, counts, True, True, True, 0, rules, 65536)
+        for profit, key in enumerate(keys):
+            store.put(key, (float(profit), 0., 0., 0., -.5, -1000.))
+        last_used = store.connection.execute("SELECT last_used FROM results WHERE key = ?", (keys[3],)).fetchone()
+        assert store.get(keys[3]) == (3., 0., 0., 0., -.5, -1000.)
+        reader = ResultStore(path)  # Reading doesn't write, until the uses are flushed.
+        assert reader.connection.execute("SELECT last_used FROM results WHERE key = ?", (keys[3],)).fetchone() == last_used
+        store.flush_uses()
+        assert reader.connection.execute("SELECT last_used FROM results WHERE key = ?", (keys[3],)).fetchone() > last_used
+        reader.close()
+        assert store.get(keys[3]) is not None
+        hit_soft_17 = RuleSet(dealer_stands_soft_17=False).analysis_code
+        assert store.get(result_key((2, 3), 10, counts, True, True, True, 0, hit_soft_17)) is None
+        store.put(result_key((3, 3), 10, counts, True, True, True, 0, rules), (0., 0., 0., 0., 0., 0.))
+        assert len(store) == 9
+        assert store.get(keys[3]) is not None  # Recently used, so it wasn't evicted.
+        assert store.get(keys[0]) is None
+        store.close()
+
+        use_persistent_store(path)
+        shoe = ShoeCounts.from_decks(6).remove_cards((9, 7, 10))
+        profits = perfect_mover_cache((9, 7), 10, shoe, return_all_profits=True)
+        store = ResultStore(path)
+        assert store.get(result_key((7, 9), 10, shoe, True, True, True, 0, RuleSet().analysis_code)) == profits
+        store.close()
+        assert perfect_mover_cache((7, 9), 10, shoe, return_all_profits=True) == profits
+        use_persistent_store(None)
+
+
+def test_precomputed_table() -> None:
+    """Test answering hands dealt from a full shoe with a precomputed table."""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "6deck.bjt")
+        hands = table_hands()
+        profits = np.zeros((len(hands), 10, 6))
+        profits[:, :, 0] = np.arange(len(hands))[:, None]
+        profits[hands.index((7, 9)), 10 - 2] = (.5, .25, 0., -1000., -.5, -1000.)
+        write_precomputed_table(path, profits, RuleSet(6, 1))
+
+        table = PrecomputedTable(path)
+        assert table.rules == RuleSet(6, 1)
+        assert table.get((7, 9), 10) == (.5, .25, 0., -1000., -.5, -1000.)
+        assert table.get((2, 3, 4), 5) == (float(hands.index((2, 3, 4))), 0., 0., 0., 0., 0.)
+        assert table.get((10, 10, 10), 5) is None
+        del table  # Unmap the file, so the directory can be deleted.
+
+        use_precomputed_tables([path])
+        shoe = ShoeCounts.from_decks(6).remove_cards((9, 7, 10))
+        assert perfect_mover_cache((9, 7), 10, shoe, return_all_profits=True) == (.5, .25, 0., -1000., -.5, -1000.)
+        # Other rules, or a shoe that isn't full, are still analysed.
+        assert perfect_mover_cache((9, 7), 10, shoe, can_surrender=False, return_all_profits=True)[0] != .5
+        assert perfect_mover_cache((9, 7), 10, shoe.remove_cards((2,)), return_all_profits=True)[0] != .5
+        use_precomputed_tables([])
+        assert perfect_mover_cache((9, 7), 10, shoe, return_all_profits=True)[0] != .5
@@ -0,0 +1,41 @@
+"""Test sharing best move results between processes."""
+import multiprocessing
+from best_move import perfect_mover, use_shared_table
+from shared_cache import SharedResultTable
+from utils import RuleSet, ShoeCounts
+
+
+def _publish(table: SharedResultTable, position: tuple[object, ...]) -> None:
+    """Publish a result from another process."""
+    table.put(position, (1., 2., 3., 4., 5., 6.))
+
+
+def test_shared_cache() -> None:
+    """Test reading and publishing results from different processes."""
+    counts = tuple(ShoeCounts.from_decks(6).remove_cards((10, 6, 10)))
+    rules = RuleSet().analysis_code
+    position = ((6, 10), 10, counts, True, True, True, 0, rules)
+    with SharedResultTable(slots=1024) as table:
+        assert table.get(position) is None
+        process = multiprocessing.Process(target=_publish, args=(table, position))
+        process.start()
+        process.join()
+        assert table.get(position) == (1., 2., 3., 4., 5., 6.)
+        assert table.get(((6, 10), 10, counts, True, True, True, 0, RuleSet(das=False).analysis_code)) is None
+        index, found, first_hash, second_hash = table.find(position)
+        assert found and second_hash != hash((position, 1)) & 0xFFFF_FFFF_FFFF_FFFF
+        table.hashes[2 * index + 1] ^= 1  # Another position with the same first hash isn't mistaken for this one.
+        assert table.get(position) is None
+        table.hashes[2 * index + 1] ^= 1
+
+        attached_table = SharedResultTable(table.slots, table.memory.name, table.lock)  # What a spawned process does.
+        assert attached_table.get(position) == (1., 2., 3., 4., 5., 6.)
+        attached_table.close()
+
+        use_shared_table(table)
+        perfect_mover.cache_clear()
+        assert perfect_mover(*position) == (1., 2., 3., 4., 5., 6.)
+        profits = perfect_mover((7, 10), 10, counts, True, True, True, 0, rules)
+        assert table.get(((7, 10), 10, counts, True, True, True, 0, rules)) == profits
+        use_shared_table(None)
+        perfect_mover.cache_clear()
@@ -1,8 +1,42 @@
 """Test the shoe generators."""
-from shoe_generators import hilo_generator
-from utils import get_hilo_true_count
+import numpy as np
+import pytest
+from shoe_generators import hilo_compositions, hilo_generator, hilo_representative_shoes
+from utils import ShoeCounts, get_hilo_true_count
 
 
 def test_hilo_true_count() -> None:
     """Test the Hi-Lo true count generator."""
     assert 3 <= get_hilo_true_count(hilo_generator(3, 6, .25, [2, 5, 7])) <= 3.3
+
+
+def test_hilo_compositions() -> None:
+    """Test sampling shoes for many true counts at once."""
+    shoes = hilo_compositions(range(-10, 11), 6, .25, [2, 5, 7], 200, np.random.default_rng(1))
+    assert sorted(shoes) == list(range(-10, 11))
+    maximum = np.array(ShoeCounts.from_decks(6).remove_cards((2, 5, 7)))
+    for true_count, compositions in shoes.items():
+        assert compositions.shape == (200, 10)
+        assert ((0 <= compositions) & (compositions <= maximum)).all() and (compositions.sum(axis=1) >= 78).all()
+        low, high = (true_count, true_count + .3) if true_count > 0 else (true_count - .3, true_count + .3 * (not true_count))
+        for composition in compositions:
+            assert low <= get_hilo_true_count(ShoeCounts(*composition).to_cards()) <= high
+    assert len({tuple(composition) for composition in shoes[3]}) > 150  # The shoes aren't all the same.
+    with pytest.raises(ValueError):
+        hilo_compositions((60,), 1, .5, [])  # At most 20 high cards in 26 cards.
+
+
+def test_hilo_representative_shoes() -> None:
+    """Test that the representative shoes have the true count, and are the same every time."""
+    shoes = hilo_representative_shoes((-4, 0, 4), 6, .25, (10, 6, 10), 6)
+    maximum = ShoeCounts.from_decks(6).remove_cards((10, 6, 10))
+    for true_count, (compositions, probabilities) in shoes.items():
+        assert 0 < len(compositions) <= 6 and abs(probabilities.sum() - 1) < 1e-9
+        sizes = compositions.sum(axis=1)
+        assert (sizes[1:] > sizes[:-1]).all()  # From the fewest cards left to the most.
+        low, high = (true_count, true_count + .3) if true_count > 0 else (true_count - .3, true_count + .3 * (not true_count))
+        for composition in compositions:
+            assert all(count <= most for count, most in zip(composition, maximum))
+            assert low <= get_hilo_true_count(ShoeCounts(*composition).to_cards()) <= high
+    again = hilo_representative_shoes((-4, 0, 4), 6, .25, (10, 6, 10), 6)
+    assert all((shoes[count][0] == again[count][0]).all() and (shoes[count][1] == again[count][1]).all() for count in shoes)
@@ -1,5 +1,6 @@
 """Test the utilities."""
-from utils import short_to_long_action, long_to_short_action, readable_number, list_range_str
+from utils import short_to_long_action, long_to_short_action, readable_number, list_range_str, ShoeCounts, DECK, RuleSet
+import pickle
 
 
 def test_utils() -> None:
@@ -22,3 +23,14 @@ def test_utils() -> None:
     assert readable_number(2_580_000) == "2.6M"
 
     assert list_range_str(1, 3) == ["1", "2"]
+
+    counts = ShoeCounts.from_decks(2)
+    assert counts == ShoeCounts.from_cards(DECK * 2)
+    assert counts.ten == 32 and counts.ace == 8
+    assert counts.remove_cards([10, 11, 11]) == (8, 8, 8, 8, 8, 8, 8, 8, 31, 6)
+    assert counts.to_cards() == sorted(DECK * 2)
+
+    rules = RuleSet(8, 1, False, True, False, True)
+    assert RuleSet.from_code(rules.code) == rules
+    assert RuleSet.from_code(rules.code) is pickle.loads(pickle.dumps(rules))
+    assert rules.analysis_code == RuleSet(2, 3, False, True, False, False).analysis_code != RuleSet().analysis_code
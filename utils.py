@@ -1,6 +1,8 @@
 """Utilities for the rest of the program."""
-
+from __future__ import annotations
 from collections import Counter
+from functools import lru_cache
+from typing import Any, Iterable, NamedTuple
 
 
 """The card that a suit contains."""
@@ -10,6 +12,129 @@ SUIT: list[int] = [2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10, 11]
 DECK: list[int] = SUIT * 4
 
 
+class ShoeCounts(NamedTuple):
+    """
+    How many cards of each rank a shoe contains. A compact alternative to listing every card in the shoe.
+
+    The count of a card is at index `card - 2` (e.g. `counts[10 - 2]` is the number of tens).
+    """
+
+    two: int
+    three: int
+    four: int
+    five: int
+    six: int
+    seven: int
+    eight: int
+    nine: int
+    ten: int
+    ace: int
+
+    @classmethod
+    def from_cards(cls, cards: Iterable[int]) -> ShoeCounts:
+        """
+        Count the cards of each rank in a shoe.
+
+        :param cards: The cards in the shoe. (e.g. [2, 10, 11, 10, ...])
+        :return: How many cards of each rank the shoe contains.
+        """
+        card_counts = Counter(cards)
+        return cls(*(card_counts[card] for card in range(2, 12)))
+
+    @classmethod
+    def from_decks(cls, deck_number: int) -> ShoeCounts:
+        """
+        Get the counts of a full shoe.
+
+        :param deck_number: How many decks the shoe contains.
+        :return: How many cards of each rank the shoe contains.
+        """
+        return cls(*(4 * deck_number if card != 10 else 16 * deck_number for card in range(2, 12)))
+
+    def remove_cards(self, cards: Iterable[int]) -> ShoeCounts:
+        """
+        Remove cards from the shoe.
+
+        :param cards: The cards to remove. (e.g. the player's cards and the dealer's up card)
+        :return: How many cards of each rank the shoe contains after removing the cards.
+        """
+        card_counts = Counter(cards)
+        return ShoeCounts(*(count - card_counts[card] for card, count in zip(range(2, 12), self)))
+
+    def to_cards(self) -> list[int]:
+        """
+        Create a shoe with these counts.
+
+        :return: The cards in the shoe, sorted.
+        """
+        cards = []
+        for card, count in zip(range(2, 12), self):
+            cards += [card] * count
+        return cards
+
+
+class RuleSet(NamedTuple):
+    """
+    The rules of a game.
+
+    The rules are packed into a small integer (`code`), which is what the best move analysis puts in its cache keys and
+    what is sent to other processes. `RuleSet.from_code` returns the same object for the same rules, so each process
+    only holds one copy of every set of rules.
+    """
+
+    deck_number: int = 6
+    max_splits: int = 3
+    dealer_peeks_for_blackjack: bool = True
+    das: bool = True
+    dealer_stands_soft_17: bool = True
+    surrender_allowed: bool = True
+    can_resplit_aces: bool = False
+
+    @property
+    def code(self) -> int:
+        """
+        Pack the rules into an integer.
+
+        :return: The flags in the lowest 5 bits, the maximum number of splits in the next 4 bits, and the number of decks
+            in the rest.
+        """
+        return (self.dealer_peeks_for_blackjack | self.das << 1 | self.dealer_stands_soft_17 << 2
+                | self.surrender_allowed << 3 | self.can_resplit_aces << 4 | self.max_splits << 5 | self.deck_number << 9)
+
+    @property
+    def analysis_code(self) -> int:
+        """
+        Pack only the rules that change the analysis of a position into an integer.
+
+        The number of decks, the maximum number of splits, and surrendering are left out, because the shoe and the other
+        arguments of the analysis already describe them, so the same position shares results between these rules.
+
+        :return: The code of the rules without the number of decks, the splits, and surrendering.
+        """
+        return (self.dealer_peeks_for_blackjack | self.das << 1 | self.dealer_stands_soft_17 << 2
+                | self.can_resplit_aces << 4)
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def from_code(code: int) -> RuleSet:
+        """
+        Unpack the rules from an integer.
+
+        :param code: The rules packed by `code`.
+        :return: The rules. The same object is returned every time for the same code.
+        """
+        return RuleSet(code >> 9, code >> 5 & 15, bool(code & 1), bool(code & 2), bool(code & 4), bool(code & 8),
+                       bool(code & 16))
+
+    def __reduce__(self) -> tuple[Any, ...]:
+        """
+        Send only the code to other processes.
+
+        :return: What is needed to get the same rules in another process.
+        """
+        return RuleSet.from_code, (self.code,)
+
+
 def list_range_str(start: int, end: int, step: int = 1) -> list[str]:
     """
     Return a list of string numbers.